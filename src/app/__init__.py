@@ -1,7 +1,9 @@
 from flask import Flask
 from app.core import init_core
+from app.instrumentation import init_instrumentation
 
 def create_app():
     app = Flask(__name__)
+    init_instrumentation(app)
     init_core(app)
     return app
@@ -0,0 +1,325 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    ASGI application
+    ========================
+    Alternative entry point (``asgi.py``) for event loop servers, one
+    process holds thousands of idle connections::
+
+        uvicorn asgi:app
+
+    The hot reads are answered by async handlers on an async driver, see
+    :mod:`app.asgi.database`:
+     - ``GET /api/entities/<id>`` without fields or include and
+       ``GET /api/entity-types/<id>``
+     - ``GET /api/entities`` and ``GET /api/entity-types`` without content
+       filters or fields
+     - ``GET /api/changes``, long polls and event streams wait on one
+       shared :class:`~app.asgi.changes.ChangeWatch`
+
+    Every other request is delegated to the Flask application in a pool of
+    ``BCRM_ASGI_THREADS`` threads, both entry points serve the same api.
+
+    The async handlers cover these five reads only and bypass the layers of
+    the Flask application:
+     - they always read the primary, ``BCRM_DB_REPLICAS`` is not used
+     - they are not instrumented, no ``Server-Timing`` header and no
+       ``/metrics`` counters
+     - they read through the in process cache only, the shared cache
+       backends are blocking
+"""
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from werkzeug.urls import url_decode, url_encode, url_quote
+from app import create_app
+from app.asgi.bridge import WSGIBridge
+from app.asgi.changes import ChangeWatch
+from app.asgi.database import async_database
+from app.core.cache import TOMBSTONE, cache
+from app.core.changes import EVENT_STREAM, KEEP_ALIVE, ChangeFeedError, ChangeRecord, \
+    change_args, change_event
+from app.core.conditional import etag
+from app.core.db import env_int
+from app.core.lookups import EntityRecord, EntityTypeRecord, entity_key, entity_type_key
+from app.core.pagination import PaginationError, page_args
+from app.core.serialization import render
+
+ENTITY_COLUMNS = 'id, "entityTypeId", CAST(content AS TEXT), version'
+ENTITY_TYPE_COLUMNS = 'id, name, CAST(schema AS TEXT), version'
+CHANGE_COLUMNS = 'seq, op, entity_id, entity_type_id, content'
+
+def json_body(value):
+    return (render(value) + '\n').encode('utf-8')
+
+def request_path(scope):
+    """
+    Returns the path of the request below the mount point of the
+    application, as ``url_for`` builds it
+    """
+    return url_quote(scope.get('root_path', '') + scope['path'])
+
+def header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+class ASGIApp(object):
+    """ ASGI application serving the core api, see module documentation """
+
+    def __init__(self, flask_app, executor):
+        self.flask_app = flask_app
+        self.bridge = WSGIBridge(flask_app, executor)
+        self.executor = executor
+        self.database = None
+        self.watch = None
+        self._connecting = None
+        self.routes = [
+            (re.compile(r'^/api/entities/([^/]+)$'), self.get_entity),
+            (re.compile(r'^/api/entity-types/([^/]+)$'), self.get_entity_type),
+            (re.compile(r'^/api/entities$'), self.list_entities),
+            (re.compile(r'^/api/entity-types$'), self.list_entity_types),
+            (re.compile(r'^/api/changes$'), self.list_changes),
+        ]
+
+    async def startup(self):
+        if self.database is not None:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+        async with self._connecting:
+            if self.database is None:
+                database = async_database(
+                    self.flask_app.config['SQLALCHEMY_DATABASE_URI'],
+                    max_size=self.flask_app.config['BCRM_ASGI_DB_POOL_SIZE']
+                )
+                await database.connect()
+                self.watch = ChangeWatch(database)
+                self.database = database
+
+    async def shutdown(self):
+        if self.watch is not None:
+            await self.watch.close()
+            self.watch = None
+        if self.database is not None:
+            await self.database.close()
+            self.database = None
+        self.executor.shutdown(wait=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if scope['method'] == 'GET':
+            args = url_decode(scope.get('query_string', b''))
+            for pattern, handler in self.routes:
+                match = pattern.match(scope['path'])
+                if match:
+                    await self.startup()
+                    response = await handler(scope, args, *match.groups())
+                    if callable(response):
+                        await response(send)
+                        return
+                    if response is not None:
+                        await self.send_response(send, *response)
+                        return
+                    break
+        await self.bridge(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e: # pylint: disable=broad-except
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def send_response(self, send, status, body, headers=()):
+        headers = list(headers)
+        if body:
+            headers.append((b'content-type', b'application/json'))
+        headers.append((b'content-length', str(len(body)).encode('latin-1')))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    def param(self, index):
+        return self.database.param(index)
+
+    async def read_through(self, key, record, sql, record_id):
+        value = cache.local.get(key)
+        if value is not None and value != TOMBSTONE:
+            return record(*value)
+        rows = await self.database.fetch(sql, record_id)
+        if not rows:
+            return None
+        if value is None:
+            cache.local.add(key, list(rows[0]))
+        return record(*rows[0])
+
+    def record_response(self, scope, record):
+        tag = quote_etag(etag(record.version)).encode('latin-1')
+        if_none_match = header(scope, b'if-none-match')
+        if if_none_match and parse_etags(if_none_match).contains_weak(etag(record.version)):
+            return 304, b'', [(b'etag', tag)]
+        return 200, json_body(record.toRawDict()), [(b'etag', tag)]
+
+    async def get_entity(self, scope, args, entity_id):
+        if 'fields' in args or 'include' in args:
+            return None
+        record = await self.read_through(
+            entity_key(entity_id), EntityRecord,
+            'SELECT {} FROM entity WHERE id = {}'.format(ENTITY_COLUMNS, self.param(1)),
+            entity_id
+        )
+        if record is None:
+            return 404, json_body({'message': 'Not found'})
+        return self.record_response(scope, record)
+
+    async def get_entity_type(self, scope, args, entity_type_id):
+        record = await self.read_through(
+            entity_type_key(entity_type_id), EntityTypeRecord,
+            'SELECT {} FROM entity_type WHERE id = {}'.format(ENTITY_TYPE_COLUMNS, self.param(1)),
+            entity_type_id
+        )
+        if record is None:
+            return 404, json_body({'message': 'Not found'})
+        return self.record_response(scope, record)
+
+    async def list_page(self, scope, args, table, columns, record, filters):
+        try:
+            after, limit = page_args(args)
+        except PaginationError as e:
+            return 400, json_body({'message': str(e)})
+
+        conditions = []
+        params = []
+        for column, value in filters + [('id >', after)]:
+            if value is not None:
+                params.append(value)
+                conditions.append('{} {}'.format(column, self.param(len(params))))
+        params.append(limit + 1)
+        sql = 'SELECT {} FROM {}{} ORDER BY id LIMIT {}'.format(
+            columns, table,
+            ' WHERE ' + ' AND '.join(conditions) if conditions else '',
+            self.param(len(params))
+        )
+        rows = await self.database.fetch(sql, *params)
+
+        headers = []
+        if len(rows) > limit:
+            rows = rows[:limit]
+            query = [(name, value) for name, value in args.items(multi=True) if name != 'after']
+            query.append(('after', rows[-1][0]))
+            headers.append((b'link', '<{}?{}>; rel="next"'.format(
+                request_path(scope), url_encode(query)).encode('latin-1')))
+        return 200, json_body([record(*row).toRawDict() for row in rows]), headers
+
+    async def list_entities(self, scope, args):
+        if not set(args.keys()) <= {'entity_type_id', 'after', 'limit'}:
+            return None
+        return await self.list_page(
+            scope, args, 'entity', ENTITY_COLUMNS, EntityRecord,
+            [('"entityTypeId" =', args.get('entity_type_id'))]
+        )
+
+    async def list_entity_types(self, scope, args):
+        if not set(args.keys()) <= {'after', 'limit'}:
+            return None
+        return await self.list_page(
+            scope, args, 'entity_type', ENTITY_TYPE_COLUMNS, EntityTypeRecord, []
+        )
+
+    async def fetch_changes(self, since, limit, entity_type_id):
+        params = [since]
+        sql = 'SELECT {} FROM entity_change WHERE seq > {}'.format(CHANGE_COLUMNS, self.param(1))
+        if entity_type_id is not None:
+            params.append(entity_type_id)
+            sql += ' AND entity_type_id = {}'.format(self.param(len(params)))
+        params.append(limit)
+        sql += ' ORDER BY seq LIMIT {}'.format(self.param(len(params)))
+        return [ChangeRecord(*row) for row in await self.database.fetch(sql, *params)]
+
+    async def list_changes(self, scope, args):
+        try:
+            since, limit, wait, entity_type_id = change_args(args, header(scope, b'last-event-id'))
+        except ChangeFeedError as e:
+            return 400, json_body({'message': str(e)})
+
+        accept = parse_accept_header(header(scope, b'accept'), MIMEAccept)
+        if accept.best_match(['application/json', EVENT_STREAM]) == EVENT_STREAM:
+            return lambda send: self.stream_changes(send, since, limit, entity_type_id, wait)
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + wait
+        seen = since
+        changes = await self.fetch_changes(since, limit, entity_type_id)
+        while not changes and deadline > loop.time():
+            last = await self.watch.wait(seen, deadline - loop.time())
+            if last is None or last <= seen:
+                break
+            seen = last
+            changes = await self.fetch_changes(since, limit, entity_type_id)
+
+        query = [(name, value) for name, value in args.items(multi=True) if name != 'since']
+        query.append(('since', changes[-1].seq if changes else since))
+        link = '<{}?{}>; rel="next"'.format(request_path(scope), url_encode(query))
+        return 200, json_body([change.toRawDict() for change in changes]), [
+            (b'link', link.encode('latin-1'))
+        ]
+
+    async def stream_changes(self, send, since, limit, entity_type_id, wait):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + wait
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', '{}; charset=utf-8'.format(EVENT_STREAM).encode('latin-1')),
+            (b'cache-control', b'no-cache'),
+        ]})
+        await send({
+            'type': 'http.response.body',
+            'body': 'retry: {}\n\n'.format(int(self.watch.interval * 1000)).encode('utf-8'),
+            'more_body': True,
+        })
+        seen = since
+        while True:
+            changes = await self.fetch_changes(since, limit, entity_type_id)
+            if changes:
+                since = changes[-1].seq
+                seen = max(seen, since)
+                body = ''.join(change_event(change) for change in changes)
+                await send({'type': 'http.response.body', 'body': body.encode('utf-8'), 'more_body': True})
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            last = await self.watch.wait(seen, min(remaining, KEEP_ALIVE))
+            if last is not None and last > seen:
+                seen = last
+            elif deadline > loop.time():
+                await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+def create_asgi_app(flask_app=None):
+    """
+    Returns the ASGI application serving ``flask_app``, a new application
+    by default
+    """
+    if flask_app is None:
+        flask_app = create_app()
+    flask_app.config['BCRM_ASGI_THREADS'] = env_int('BCRM_ASGI_THREADS') or 16
+    flask_app.config['BCRM_ASGI_DB_POOL_SIZE'] = env_int('BCRM_ASGI_DB_POOL_SIZE') or 10
+    return ASGIApp(flask_app, ThreadPoolExecutor(flask_app.config['BCRM_ASGI_THREADS']))
@@ -0,0 +1,162 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    WSGI bridge
+    ========================
+    Serves an ASGI http request with the Flask application in a thread
+    pool. The response body is streamed back chunk by chunk, the worker
+    thread waits while the client is slower than the application.
+
+    When the client disconnects, or sending to it fails, the worker stops
+    within ``PUT_TIMEOUT`` seconds and closes the WSGI response, streams
+    release their thread and their database connection.
+"""
+import asyncio
+import concurrent.futures
+import io
+import sys
+import threading
+
+PUT_TIMEOUT = 1
+
+class ClientDisconnected(Exception):
+    """ Raised in the worker thread once the response has no reader any more """
+
+async def read_body(receive):
+    """
+    Returns the whole request body
+    """
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+async def wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+def wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = name
+        else:
+            key = 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+class WSGIBridge(object):
+    """ ASGI application delegating to a WSGI application """
+
+    def __init__(self, wsgi_app, executor):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+
+    def run(self, environ, loop, queue, closed):
+        def put(message):
+            if closed.is_set():
+                raise ClientDisconnected()
+            future = asyncio.run_coroutine_threadsafe(queue.put(message), loop)
+            while True:
+                try:
+                    return future.result(PUT_TIMEOUT)
+                except concurrent.futures.TimeoutError:
+                    if closed.is_set():
+                        future.cancel()
+                        raise ClientDisconnected()
+
+        def start_response(status, headers, exc_info=None):
+            put(('start', status, headers))
+            return lambda data: put(('body', data))
+
+        try:
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if chunk:
+                            put(('body', chunk))
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            finally:
+                put(('end',))
+        except ClientDisconnected:
+            pass
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_event_loop()
+        environ = wsgi_environ(scope, await read_body(receive))
+        queue = asyncio.Queue(maxsize=8)
+        closed = threading.Event()
+        worker = loop.run_in_executor(self.executor, self.run, environ, loop, queue, closed)
+        disconnect = loop.create_task(wait_disconnect(receive))
+
+        started = False
+        try:
+            while True:
+                message = loop.create_task(queue.get())
+                await asyncio.wait([message, disconnect], return_when=asyncio.FIRST_COMPLETED)
+                if disconnect.done():
+                    message.cancel()
+                    closed.set()
+                    await worker
+                    return
+                message = message.result()
+                if message[0] == 'start':
+                    status, headers = message[1], message[2]
+                    await send({
+                        'type': 'http.response.start',
+                        'status': int(status.split(' ', 1)[0]),
+                        'headers': [
+                            (name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in headers
+                        ],
+                    })
+                    started = True
+                elif message[0] == 'body':
+                    await send({
+                        'type': 'http.response.body', 'body': message[1], 'more_body': True
+                    })
+                else:
+                    break
+        except BaseException:
+            # nobody reads the queue any more, the worker gives up its next put
+            closed.set()
+            raise
+        finally:
+            disconnect.cancel()
+        await worker
+
+        if not started:
+            await send({'type': 'http.response.start', 'status': 500, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
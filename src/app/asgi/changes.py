@@ -0,0 +1,70 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Change feed watch
+    ========================
+    Long polls and event streams of the change feed wait on one shared
+    watch instead of querying the database each. While anybody waits, the
+    watch reads the last ``seq`` once per poll interval and wakes the
+    waiters when it grew.
+"""
+import asyncio
+from app.core.changes import POLL_INTERVAL
+
+class ChangeWatch(object):
+    """ Shared poll of the last change feed ``seq`` """
+
+    def __init__(self, database, interval=POLL_INTERVAL):
+        self.database = database
+        self.interval = interval
+        self.last = None
+        self.waiters = 0
+        self.changed = None
+        self.task = None
+
+    async def poll(self):
+        while self.waiters:
+            rows = await self.database.fetch('SELECT MAX(seq) FROM entity_change')
+            last = rows[0][0] or 0
+            if self.last is None or last > self.last:
+                self.last = last
+                self.changed.set()
+                self.changed = asyncio.Event()
+            await asyncio.sleep(self.interval)
+        self.task = None
+
+    async def wait(self, after, timeout):
+        """
+        Returns the last ``seq`` once it is greater than ``after`` or when
+        ``timeout`` seconds passed
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        self.waiters += 1
+        try:
+            if self.changed is None:
+                self.changed = asyncio.Event()
+            if self.task is None:
+                self.task = asyncio.ensure_future(self.poll())
+            while self.last is None or self.last <= after:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self.changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            self.waiters -= 1
+        return self.last
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
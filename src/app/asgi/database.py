@@ -0,0 +1,78 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Async database access
+    ========================
+    Non blocking reads of the entity tables for the ASGI handlers:
+     - ``asyncpg`` connection pool for PostgreSQL
+     - ``aiosqlite`` connection for SQLite
+
+    Both drivers are optional, they are imported when the ASGI app starts.
+    Queries are plain SQL with the placeholders of :meth:`param`.
+"""
+import copy
+from sqlalchemy.engine.url import make_url
+
+class PostgresDatabase(object):
+    """ asyncpg pool """
+
+    def __init__(self, url, min_size, max_size):
+        url = copy.copy(url)
+        url.drivername = 'postgresql'
+        self.dsn = str(url)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+
+    def param(self, index):
+        return '${}'.format(index)
+
+    async def connect(self):
+        import asyncpg
+        self.pool = await asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size)
+
+    async def fetch(self, sql, *params):
+        async with self.pool.acquire() as connection:
+            return [tuple(row) for row in await connection.fetch(sql, *params)]
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+class SQLiteDatabase(object):
+    """ aiosqlite connection """
+
+    def __init__(self, url):
+        self.database = url.database or ':memory:'
+        self.uri = url.query.get('uri') == 'true'
+        self.connection = None
+
+    def param(self, index):
+        return '?'
+
+    async def connect(self):
+        import aiosqlite
+        self.connection = await aiosqlite.connect(self.database, uri=self.uri)
+
+    async def fetch(self, sql, *params):
+        return [tuple(row) for row in await self.connection.execute_fetchall(sql, params)]
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+def async_database(uri, min_size=1, max_size=10):
+    """
+    Returns the async database of a SQLAlchemy database url
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'postgresql':
+        return PostgresDatabase(url, min_size, max_size)
+    if url.get_backend_name() == 'sqlite':
+        return SQLiteDatabase(url)
+    raise ValueError("no async driver for '{}'".format(url.get_backend_name()))
@@ -8,9 +8,23 @@
     File contains api for
      - EntityType
 """
+import os
 from app.core.resources import core_api
 from app.core.db import init_db
+from app.core.validation import validators
+from app.core.cache import init_cache
+from app.core.replicas import init_replicas
+from app.core.serialization import init_serialization
+from app.core.models.import_checkpoint import ImportCheckpoint # pylint: disable=unused-import
 
 def init_core(app):
     init_db(app)
+    init_replicas(app)
+    init_cache(app)
+    init_serialization(app)
+    validators.maxsize = int(os.environ.get('BCRM_VALIDATOR_CACHE_SIZE') or 256)
+    app.config['BCRM_BATCH_CHUNK_SIZE'] = int(os.environ.get('BCRM_BATCH_CHUNK_SIZE') or 500)
+    app.config['BCRM_BATCH_MAX_ITEMS'] = int(os.environ.get('BCRM_BATCH_MAX_ITEMS') or 10000)
+    app.config['BCRM_BATCH_GET_MAX_IDS'] = int(os.environ.get('BCRM_BATCH_GET_MAX_IDS') or 1000)
+    app.config['BCRM_IDEMPOTENCY_TTL'] = int(os.environ.get('BCRM_IDEMPOTENCY_TTL') or 86400)
     app.register_blueprint(core_api)
@@ -0,0 +1,420 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Aggregations
+    ========================
+    Counts and numeric aggregates of the entities of a type, grouped by
+    content fields and computed by the database::
+
+        GET /api/entities:aggregate?entity_type_id=<id>&group_by=content.stage
+            &metric=count&metric=sum:content.amount
+
+    ``metric`` is ``count`` or one of ``sum``, ``min``, ``max``, ``avg``
+    on a content field, only numbers are aggregated. Content filters (see
+    :mod:`app.core.filters`) select the aggregated entities. Every group is
+    returned with its field values and the requested metrics::
+
+        [{"group": {"content.stage": "won"}, "count": 2, "sum:content.amount": 300}]
+
+    An entity type declares the aggregations its dashboards refresh often
+    as rollups in its schema, fields are dot separated content paths::
+
+        {"x-bcrm-rollups": {"by_stage": {"group_by": ["stage"], "sum": ["amount"]}}}
+
+    The running counts and totals of rollups are kept in ``entity_rollup``
+    by the write hooks, totals are exact decimals so adding and removing
+    the same values never drifts. An aggregation without filters, grouped by the
+    fields of a rollup and asking for ``count``, ``sum`` or ``avg`` of its
+    fields, is read from there instead of the entities.
+"""
+import json
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+from functools import lru_cache
+from sqlalchemy import Numeric, and_, case, cast, func, literal, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Text
+from app.core.db import db
+from app.core.filters import apply_filters, parse_filters, sqlite_path
+from app.core.hooks import write_hook
+from app.core.indexing import type_schemas
+from app.core.models.entity import Entity
+from app.core.models.entity_rollup import EntityRollup
+from app.core.projection import content_path
+
+ROLLUP_KEYWORD = 'x-bcrm-rollups'
+AGGREGATES = {
+    'sum': func.sum,
+    'min': func.min,
+    'max': func.max,
+    'avg': func.avg,
+}
+ROLLUP_AGGREGATES = ('count', 'sum', 'avg')
+MAX_GROUP_BY = 3
+MAX_GROUPS = 1000
+REBUILD_BATCH_SIZE = 1000
+
+Metric = namedtuple('Metric', ['name', 'aggregate', 'path'])
+Rollup = namedtuple('Rollup', ['name', 'group_by', 'sum'])
+
+class AggregationError(ValueError):
+    """ Raised when the aggregation arguments are not valid """
+
+def content_field(name):
+    path = tuple(name.split('.')[1:])
+    if not name.startswith('content.') or not all(path):
+        raise AggregationError("invalid content field '{}'".format(name))
+    return path
+
+def parse_aggregation(args):
+    """
+    Returns the ``(group_by, metrics)`` of the query string, ``group_by``
+    is a list of content paths
+    """
+    group_by = [content_field(name) for name in args.getlist('group_by')]
+    if len(group_by) > MAX_GROUP_BY:
+        raise AggregationError("group_by is limited to {} fields".format(MAX_GROUP_BY))
+    metrics = []
+    for name in args.getlist('metric') or ['count']:
+        if name == 'count':
+            metrics.append(Metric(name, 'count', None))
+            continue
+        aggregate, _, field = name.partition(':')
+        if aggregate not in AGGREGATES:
+            raise AggregationError(
+                "metric must be 'count' or one of {} on a content field".format(
+                    ', '.join(sorted(AGGREGATES))))
+        metrics.append(Metric(name, aggregate, content_field(field)))
+    return group_by, metrics
+
+def number(value):
+    """
+    Returns ``value`` as a json number, ``None`` if it is not a number
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float, Decimal)):
+        return None
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+def lookup(document, path):
+    for key in path:
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+def group_key(values):
+    return json.dumps(values, sort_keys=True)
+
+def result(group_by, values, metric_values):
+    data = dict([])
+    data['group'] = dict(
+        ('.'.join(('content',) + path), value) for path, value in zip(group_by, values)
+    )
+    for metric, value in metric_values:
+        data[metric.name] = value
+    return data
+
+
+def postgresql_columns(group_by, metrics):
+    keys = [content_path(list(path)) for path in group_by]
+    values = []
+    for metric in metrics:
+        if metric.aggregate == 'count':
+            values.append(func.count())
+            continue
+        field = Entity.content.op('#>')(literal(list(metric.path), ARRAY(Text)))
+        numeric = case([(
+            func.jsonb_typeof(field) == 'number',
+            cast(Entity.content.op('#>>')(literal(list(metric.path), ARRAY(Text))), Numeric)
+        )])
+        values.append(AGGREGATES[metric.aggregate](numeric))
+    return keys, values
+
+def postgresql_group(row, count):
+    return [json.loads(value) if value is not None else None for value in row[:count]]
+
+def sqlite_columns(group_by, metrics):
+    keys = []
+    for path in group_by:
+        keys.append(func.json_type(Entity.content, sqlite_path(path)))
+        keys.append(func.json_extract(Entity.content, sqlite_path(path)))
+    values = []
+    for metric in metrics:
+        if metric.aggregate == 'count':
+            values.append(func.count())
+            continue
+        json_path = sqlite_path(metric.path)
+        numeric = case([(
+            func.json_type(Entity.content, json_path).in_(('integer', 'real')),
+            func.json_extract(Entity.content, json_path)
+        )])
+        values.append(AGGREGATES[metric.aggregate](numeric))
+    return keys, values
+
+def sqlite_value(value_type, value):
+    if value_type == 'true':
+        return True
+    if value_type == 'false':
+        return False
+    if value_type in ('object', 'array'):
+        return json.loads(value)
+    return value
+
+def sqlite_group(row, count):
+    return [sqlite_value(row[index * 2], row[index * 2 + 1]) for index in range(count)]
+
+def aggregate_entities(entity_type_id, group_by, metrics, args):
+    """
+    Returns the aggregation computed over the entities
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        keys, values = postgresql_columns(group_by, metrics)
+        group = postgresql_group
+    else:
+        keys, values = sqlite_columns(group_by, metrics)
+        group = sqlite_group
+    query = db.session.query(*(keys + values)).filter(Entity.entityTypeId == entity_type_id)
+    query = apply_filters(query, args, entity_type_id)
+    if keys:
+        query = query.group_by(*keys)
+    rows = query.limit(MAX_GROUPS + 1).all()
+    if len(rows) > MAX_GROUPS:
+        raise AggregationError(
+            "aggregation has more than {} groups".format(MAX_GROUPS))
+
+    results = []
+    for row in rows:
+        values = row[len(keys):]
+        results.append((group(row, len(group_by)), [
+            (metric, number(value) if metric.aggregate != 'count' else value)
+            for metric, value in zip(metrics, values)
+        ]))
+    results.sort(key=lambda item: group_key(item[0]))
+    return [result(group_by, values, metric_values) for values, metric_values in results]
+
+
+@lru_cache(maxsize=256)
+def declared_rollups(schema):
+    """
+    Returns the tuple of rollups declared by a schema text
+    """
+    declarations = json.loads(schema).get(ROLLUP_KEYWORD)
+    if not isinstance(declarations, dict):
+        return ()
+    rollups = []
+    for name, declaration in sorted(declarations.items()):
+        if not isinstance(declaration, dict):
+            continue
+        group_by = declaration.get('group_by', [])
+        sums = declaration.get('sum', [])
+        if not isinstance(group_by, list) or not isinstance(sums, list):
+            continue
+        if not all(isinstance(field, str) and field for field in group_by + sums):
+            continue
+        rollups.append(Rollup(
+            name,
+            tuple(tuple(field.split('.')) for field in group_by),
+            tuple(sorted(set(sums)))
+        ))
+    return tuple(rollups)
+
+def matching_rollup(schema, group_by, metrics, args):
+    if parse_filters(args):
+        return None
+    for rollup in declared_rollups(schema):
+        if list(rollup.group_by) != group_by:
+            continue
+        if all(
+                metric.aggregate == 'count' or (
+                    metric.aggregate in ROLLUP_AGGREGATES and
+                    '.'.join(metric.path) in rollup.sum)
+                for metric in metrics):
+            return rollup
+    return None
+
+def rollup_value(metric, counts):
+    if metric.aggregate == 'count':
+        return counts.get('', (0, 0))[0]
+    count, total = counts.get('.'.join(metric.path), (0, 0))
+    if not count:
+        return None
+    if metric.aggregate == 'sum':
+        return number(total)
+    return number(total) / count
+
+def read_rollup(entity_type_id, rollup, metrics):
+    """
+    Returns the aggregation read from the rollup rows
+    """
+    groups = defaultdict(dict)
+    # a group has a count row and at most one row per summed field
+    rows = (
+        db.session.query(
+            EntityRollup.group_key, EntityRollup.field, EntityRollup.count, EntityRollup.total)
+        .filter(EntityRollup.entity_type_id == entity_type_id,
+                EntityRollup.rollup == rollup.name)
+        .order_by(EntityRollup.group_key, EntityRollup.field)
+        .limit((MAX_GROUPS + 1) * (len(rollup.sum) + 1))
+    )
+    for key, field, count, total in rows:
+        groups[key][field] = (count, total)
+    if len(groups) > MAX_GROUPS:
+        raise AggregationError(
+            "aggregation has more than {} groups".format(MAX_GROUPS))
+    if not rollup.group_by and not groups:
+        groups[group_key([])] = {}
+    return [
+        result(rollup.group_by, json.loads(key), [
+            (metric, rollup_value(metric, groups[key])) for metric in metrics
+        ])
+        for key in sorted(groups)
+    ]
+
+def aggregate(entity_type, args):
+    """
+    Returns the aggregation of the query string over the entities of the
+    type, read from a rollup when one answers it
+
+    Raises :exc:`AggregationError` or :exc:`FilterError` if the arguments
+    are not valid
+    """
+    group_by, metrics = parse_aggregation(args)
+    rollup = matching_rollup(entity_type.schema, group_by, metrics, args)
+    if rollup is not None:
+        return read_rollup(entity_type.id, rollup, metrics)
+    return aggregate_entities(entity_type.id, group_by, metrics, args)
+
+
+def contribute(deltas, entity_type_id, rollups, document, sign):
+    for rollup in rollups:
+        key = group_key([lookup(document, path) for path in rollup.group_by])
+        deltas[(entity_type_id, rollup.name, key, '')][0] += sign
+        for field in rollup.sum:
+            value = number(lookup(document, field.split('.')))
+            if value is not None:
+                delta = deltas[(entity_type_id, rollup.name, key, field)]
+                delta[0] += sign
+                delta[1] += sign * Decimal(str(value))
+
+def apply_deltas(deltas):
+    table = EntityRollup.__table__
+    changes = [
+        {
+            'entity_type_id': entity_type_id, 'rollup': rollup, 'group_key': key,
+            'field': field, 'count': count, 'total': total,
+        }
+        for (entity_type_id, rollup, key, field), (count, total) in sorted(deltas.items())
+        if count or total
+    ]
+    if not changes:
+        return
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        statement = postgresql.insert(table)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.entity_type_id, table.c.rollup, table.c.group_key, table.c.field],
+            set_={
+                'count': table.c.count + statement.excluded.count,
+                'total': table.c.total + statement.excluded.total,
+            }
+        ), changes)
+    else:
+        # totals are text on SQLite, they are added in python to stay exact
+        for change in changes:
+            row = and_(
+                table.c.entity_type_id == change['entity_type_id'],
+                table.c.rollup == change['rollup'],
+                table.c.group_key == change['group_key'],
+                table.c.field == change['field'],
+            )
+            current = db.session.execute(
+                select([table.c.count, table.c.total]).where(row)).first()
+            if current is None:
+                db.session.execute(table.insert(), change)
+            else:
+                db.session.execute(table.update().where(row).values(
+                    count=current.count + change['count'],
+                    total=current.total + change['total'],
+                ))
+
+    touched = defaultdict(set)
+    for change in changes:
+        touched[(change['entity_type_id'], change['rollup'])].add(change['group_key'])
+    for (entity_type_id, rollup), keys in sorted(touched.items()):
+        db.session.execute(table.delete().where(and_(
+            table.c.entity_type_id == entity_type_id,
+            table.c.rollup == rollup,
+            table.c.group_key.in_(sorted(keys)),
+            table.c.count <= 0
+        )))
+
+def rebuild_rollups(entity_type_id, schema):
+    """
+    Recomputes the rollups of the entity type from its entities, must run
+    inside the caller transaction
+    """
+    table = EntityRollup.__table__
+    db.session.execute(table.delete().where(table.c.entity_type_id == entity_type_id))
+    rollups = declared_rollups(schema)
+    if not rollups:
+        return
+    deltas = defaultdict(lambda: [0, 0])
+    entities = (
+        db.session.query(Entity.content)
+        .filter(Entity.entityTypeId == entity_type_id)
+        .yield_per(REBUILD_BATCH_SIZE)
+    )
+    for content, in entities:
+        contribute(deltas, entity_type_id, rollups, json.loads(content), 1)
+    apply_deltas(deltas)
+
+def reindex_rollups(entity_type, previous_schema):
+    """
+    Rebuilds the rollups of the entity type when its declarations changed,
+    must run inside the caller transaction
+    """
+    if declared_rollups(entity_type.schema) != declared_rollups(previous_schema):
+        rebuild_rollups(entity_type.id, entity_type.schema)
+
+@write_hook
+def maintain_rollups(op, rows):
+    entity_type_ids = set(row['entityTypeId'] for row in rows)
+    entity_type_ids.update(row['previous']['entityTypeId'] for row in rows if 'previous' in row)
+    schemas = type_schemas(entity_type_ids)
+    rollups = dict(
+        (entity_type_id, declared_rollups(schema)) for entity_type_id, schema in schemas.items()
+    )
+    if not any(rollups.values()):
+        return
+
+    deltas = defaultdict(lambda: [0, 0])
+    rebuild = set()
+    for row in rows:
+        entity_type_id = row['entityTypeId']
+        if op == 'update' and 'previous' not in row:
+            if rollups[entity_type_id]:
+                rebuild.add(entity_type_id)
+            continue
+        if op == 'update':
+            previous = row['previous']
+            if rollups[previous['entityTypeId']]:
+                contribute(deltas, previous['entityTypeId'], rollups[previous['entityTypeId']],
+                           json.loads(previous['content']), -1)
+        if not rollups[entity_type_id]:
+            continue
+        document = row.get('document')
+        if document is None:
+            document = json.loads(row['content'])
+        contribute(deltas, entity_type_id, rollups[entity_type_id], document,
+                   -1 if op == 'delete' else 1)
+
+    apply_deltas(dict(
+        (key, delta) for key, delta in deltas.items() if key[0] not in rebuild
+    ))
+    for entity_type_id in rebuild:
+        rebuild_rollups(entity_type_id, schemas[entity_type_id])
@@ -0,0 +1,133 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Batch entity creation
+    ========================
+    Validates a list of entities with one EntityType lookup per distinct
+    type and inserts them with executemany in chunks, inside one transaction.
+"""
+import json
+import uuid
+from jsonschema import Draft4Validator, ValidationError
+from app.core.db import db
+from app.core.models.entity import Entity, entity_schema
+from app.core.lookups import get_entity_type
+from app.core.validation import validate_content
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson')
+
+entity_validator = Draft4Validator(entity_schema)
+
+class BatchError(ValueError):
+    """ Raised when the batch payload can not be read """
+
+def parse_items(request):
+    """
+    Returns the list of items of a json array or ndjson request body
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for number, line in enumerate(request.get_data(as_text=True).splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise BatchError("line {} is not json".format(number))
+        return items
+
+    if not request.is_json:
+        raise BatchError("payload is not json")
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        raise BatchError("payload is not a json array")
+    return items
+
+def load_entity_types(entity_type_ids):
+    """
+    Returns the entity types of the given ids in a dict, read through the cache
+    """
+    entity_types = {}
+    for entity_type_id in set(entity_type_ids):
+        entity_type = get_entity_type(entity_type_id)
+        if entity_type is not None:
+            entity_types[entity_type_id] = entity_type
+    return entity_types
+
+def prepare_rows(items):
+    """
+    Validates every item and returns ``(rows, results)``.
+
+    ``rows`` holds the insert parameters of the valid items, ``results``
+    holds one result per item in the request order
+    """
+    shaped = [
+        isinstance(item, dict) and entity_validator.is_valid(item)
+        for item in items
+    ]
+    entity_types = load_entity_types(
+        item['entity_type_id'] for item, ok in zip(items, shaped) if ok
+    )
+
+    rows = []
+    results = []
+    for index, (item, ok) in enumerate(zip(items, shaped)):
+        if not ok:
+            if isinstance(item, dict):
+                error = next(entity_validator.iter_errors(item))
+                message = error.message
+            else:
+                message = "item is not a json object"
+            results.append({'index': index, 'status': 400, 'message': message})
+            continue
+
+        entity_type = entity_types.get(item['entity_type_id'])
+        if entity_type is None:
+            results.append({
+                'index': index,
+                'status': 400,
+                'message': "Entity type id '{}' does not exist".format(item['entity_type_id'])
+            })
+            continue
+
+        try:
+            validate_content(entity_type, item['content'])
+        except ValidationError:
+            results.append({
+                'index': index,
+                'status': 400,
+                'message': "Entity content does not match type schema"
+            })
+            continue
+
+        row = {
+            'id': str(uuid.uuid4()),
+            'entityTypeId': entity_type.id,
+            'content': json.dumps(item['content']),
+        }
+        rows.append(row)
+        results.append({'index': index, 'status': 201, 'id': row['id']})
+    return rows, results
+
+def not_created(results):
+    """
+    Returns the results of a rejected atomic batch, its valid items were
+    not created
+    """
+    return [
+        {'index': result['index'], 'status': 424,
+         'message': "Not created, the batch contains invalid entities"}
+        if result['status'] == 201 else result
+        for result in results
+    ]
+
+def insert_rows(rows, chunk_size):
+    """
+    Inserts the rows with executemany, ``chunk_size`` rows per statement.
+    Must run inside the caller transaction.
+    """
+    statement = Entity.__table__.insert()
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(statement, rows[start:start + chunk_size])
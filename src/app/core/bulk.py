@@ -0,0 +1,176 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Bulk updates and deletes
+    ========================
+    Entities are selected by an id list, by the ``entity_type_id`` and
+    content filters of the list endpoint, or both. The selection is
+    processed in chunks of ``BCRM_BATCH_CHUNK_SIZE`` entities ordered by
+    id, every chunk is one ``DELETE`` or one batched ``UPDATE`` statement in
+    its own transaction, so a long cleanup never holds its locks for long
+    and the chunks committed before a failure stay committed.
+
+    The selected rows are read as plain rows, never as ORM objects, to give
+    the write hooks the previous content. Updates are merged and validated
+    in python and the merged documents are written, the database stores
+    exactly the content the write hooks get.
+"""
+import json
+from jsonschema import ValidationError
+from sqlalchemy import bindparam
+from app.core.db import db
+from app.core.filters import apply_filters
+from app.core.hooks import entities_written
+from app.core.lookups import get_entity_type
+from app.core.models.entity import Entity
+from app.core.patch import merge_patch
+from app.core.validation import validate_changes
+
+bulk_delete_schema = {
+    "type": "object",
+    "properties": {
+        "ids": {"type": "array", "items": {"type": "string"}},
+    },
+}
+
+bulk_update_schema = {
+    "type": "object",
+    "properties": {
+        "ids": {"type": "array", "items": {"type": "string"}},
+        "patch": {"type": "object"},
+    },
+    "required": ["patch"],
+}
+
+class InvalidEntity(ValueError):
+    """ Raised when a bulk update would make an entity content invalid """
+
+    def __init__(self, entity_id, updated):
+        super(InvalidEntity, self).__init__("Entity content does not match type schema")
+        self.entity_id = entity_id
+        self.updated = updated
+
+
+def selection(args, entity_type_id=None):
+    """
+    Returns the query of the ``(id, entityTypeId, content)`` rows selected
+    by the query string filters
+
+    Raises :exc:`app.core.filters.FilterError` if a filter is not valid
+    """
+    query = db.session.query(Entity.id, Entity.entityTypeId, Entity.content)
+    entity_type_id = entity_type_id or args.get('entity_type_id')
+    if entity_type_id is not None:
+        query = query.filter(Entity.entityTypeId == entity_type_id)
+    return apply_filters(query, args, entity_type_id)
+
+def type_selection(entity_type_id):
+    """
+    Returns the query of the ``(id, entityTypeId, content)`` rows of every
+    entity of the type
+    """
+    return db.session.query(Entity.id, Entity.entityTypeId, Entity.content) \
+        .filter(Entity.entityTypeId == entity_type_id)
+
+def selected_chunks(query, ids, chunk_size):
+    """
+    Yields the selected rows chunk by chunk, a chunk is read when it is
+    asked for so it runs in the transaction of the caller
+    """
+    query = query.with_for_update()
+    if ids is not None:
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), chunk_size):
+            rows = query.filter(Entity.id.in_(ids[start:start + chunk_size])).all()
+            if rows:
+                yield rows
+        return
+
+    after = None
+    while True:
+        page = query if after is None else query.filter(Entity.id > after)
+        rows = page.order_by(Entity.id).limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1].id
+
+def process(query, ids, chunk_size, apply_chunk):
+    """
+    Runs ``apply_chunk(rows)`` on every chunk in its own transaction and
+    returns the number of rows processed
+    """
+    chunks = selected_chunks(query, ids, chunk_size)
+    processed = 0
+    while True:
+        db.session.begin()
+        rows = next(chunks, None)
+        if rows is None:
+            db.session.rollback()
+            return processed
+        try:
+            apply_chunk(rows)
+        except Exception:
+            db.session.rollback()
+            raise
+        db.session.commit()
+        processed += len(rows)
+
+def delete_rows(rows):
+    """
+    Deletes the selected rows, must run inside the caller transaction
+    """
+    if not rows:
+        return
+    table = Entity.__table__
+    entities_written('delete', [
+        {'id': row.id, 'entityTypeId': row.entityTypeId, 'content': row.content}
+        for row in rows
+    ])
+    db.session.execute(table.delete().where(table.c.id.in_([row.id for row in rows])))
+
+def delete_entities(query, ids, chunk_size):
+    """
+    Deletes the selected entities and returns how many were deleted
+    """
+    return process(query, ids, chunk_size, delete_rows)
+
+def update_entities(query, ids, patch, chunk_size):
+    """
+    Applies the merge patch to the selected entities and returns how many
+    were updated
+
+    Raises :exc:`InvalidEntity` when a patched content does not match the
+    schema of its type, the chunk holding it is rolled back
+    """
+    table = Entity.__table__
+    keys = set(patch.keys())
+    updated = [0]
+
+    def update_chunk(rows):
+        written = []
+        for row in rows:
+            document = merge_patch(json.loads(row.content), patch)
+            try:
+                validate_changes(get_entity_type(row.entityTypeId), document, keys)
+            except ValidationError:
+                raise InvalidEntity(row.id, updated[0])
+            written.append({
+                'id': row.id,
+                'entityTypeId': row.entityTypeId,
+                'content': json.dumps(document),
+                'document': document,
+                'previous': {'entityTypeId': row.entityTypeId, 'content': row.content},
+            })
+        db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam('entity_id'))
+            .values(content=bindparam('merged'), version=table.c.version + 1),
+            [{'entity_id': row['id'], 'merged': row['content']} for row in written]
+        )
+        entities_written('update', written)
+        updated[0] += len(rows)
+
+    return process(query, ids, chunk_size, update_chunk)
@@ -0,0 +1,216 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Read cache
+    ========================
+    Two level cache for entity and entity type reads:
+     - an in process LRU with a short TTL, answered without any IO
+     - an optional shared backend seen by every worker, selected with
+       ``BCRM_CACHE_URL``:
+        - ``uwsgi://<cache name>`` a uWSGI cache (``cache2`` option)
+        - ``redis://host:port/db`` a Redis compatible server, needs the
+          ``redis`` package
+
+    Values must be json serializable. Failures of the shared backend are
+    logged and treated as misses, the database stays the source of truth.
+
+    Reads fill the cache with :meth:`~TieredCache.add`, which never
+    replaces a present key, and writes replace their keys by a
+    :data:`TOMBSTONE` for ``TOMBSTONE_TTL`` seconds. A reader that loaded a
+    row before a write committed finds the tombstone and can not put the
+    previous row back.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+TOMBSTONE = 'bcrm:tombstone'
+TOMBSTONE_TTL = 5
+
+class LocalCache(object):
+    """ In process LRU cache with TTL """
+
+    def __init__(self, maxsize=1024, ttl=2):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _store(self, key, value, ttl):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value):
+        """
+        Sets the key unless it is present, returns whether it was set
+        """
+        if self.maxsize <= 0:
+            return False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return False
+            self._store(key, value, None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class UwsgiCache(object):
+    """ uWSGI cache shared by the workers of one uWSGI instance """
+
+    def __init__(self, name, ttl):
+        import uwsgi
+        self.uwsgi = uwsgi
+        self.name = name
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.uwsgi.cache_get(key, self.name)
+        return None if value is None else json.loads(value.decode('utf-8'))
+
+    def set(self, key, value, ttl=None):
+        self.uwsgi.cache_update(
+            key, json.dumps(value).encode('utf-8'), ttl or self.ttl, self.name)
+
+    def add(self, key, value):
+        # cache_set does not replace an existing key
+        return bool(self.uwsgi.cache_set(
+            key, json.dumps(value).encode('utf-8'), self.ttl, self.name))
+
+    def delete(self, key):
+        self.uwsgi.cache_del(key, self.name)
+
+class RedisCache(object):
+    """ Redis compatible cache shared by every worker """
+
+    def __init__(self, url, ttl):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(key)
+        return None if value is None else json.loads(value.decode('utf-8'))
+
+    def set(self, key, value, ttl=None):
+        self.client.setex(key, ttl or self.ttl, json.dumps(value))
+
+    def add(self, key, value):
+        return bool(self.client.set(key, json.dumps(value), ex=self.ttl, nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+class TieredCache(object):
+    """ Local cache in front of an optional shared cache """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+        try:
+            value = self.shared.get(key)
+        except Exception: # pylint: disable=broad-except
+            logger.exception('shared cache get failed')
+            return None
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('shared cache set failed')
+
+    def add(self, key, value):
+        """
+        Fills the key unless it is present in the shared cache, or locally
+        without one
+        """
+        if self.shared is not None:
+            try:
+                if not self.shared.add(key, value):
+                    return
+            except Exception: # pylint: disable=broad-except
+                logger.exception('shared cache add failed')
+                return
+        self.local.add(key, value)
+
+    def tombstone(self, key):
+        """
+        Replaces the key by a tombstone, reads do not fill it again until
+        the tombstone expires
+        """
+        self.set(key, TOMBSTONE, TOMBSTONE_TTL)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            try:
+                self.shared.delete(key)
+            except Exception: # pylint: disable=broad-except
+                logger.exception('shared cache delete failed')
+
+    def clear(self):
+        self.local.clear()
+
+
+cache = TieredCache(LocalCache())
+
+def shared_backend(url, ttl):
+    if url.startswith('uwsgi://'):
+        return UwsgiCache(url[len('uwsgi://'):], ttl)
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisCache(url, ttl)
+    raise ValueError("unsupported cache url '{}'".format(url))
+
+def init_cache(app):
+    """
+    Configures the cache from the environment
+    """
+    cache.local.maxsize = int(os.environ.get('BCRM_CACHE_LOCAL_SIZE') or 1024)
+    cache.local.ttl = float(os.environ.get('BCRM_CACHE_LOCAL_TTL') or 2)
+    url = os.environ.get('BCRM_CACHE_URL')
+    if url:
+        cache.shared = shared_backend(url, int(os.environ.get('BCRM_CACHE_TTL') or 300))
+    app.config['BCRM_CACHE_URL'] = url
@@ -0,0 +1,193 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Change feed
+    ========================
+    Every entity write appends one row per written entity to
+    ``entity_change`` inside the writing transaction, numbered by a growing
+    ``seq``. Clients keep the last ``seq`` they processed and read on from
+    there, an incremental sync costs the changes instead of the table::
+
+        GET /api/changes?since=<seq>&limit=<n>&wait=<seconds>
+
+    ``wait`` turns the request into a long poll, it is answered as soon as
+    a change is there or when ``wait`` seconds passed. With
+    ``Accept: text/event-stream`` changes are streamed as Server-Sent
+    Events for ``wait`` seconds, the event id is the ``seq`` so a
+    reconnecting ``EventSource`` resumes with ``Last-Event-ID``.
+
+    The changes of a transaction are collected while it writes and
+    appended when it commits. On PostgreSQL the append takes a transaction
+    level advisory lock, sequence numbers become visible in commit order
+    and a reader never skips a change committed after a higher one. Only
+    the append and the commit itself are serialized, writers run their
+    statements, validation and other hooks side by side. SQLite serializes
+    writers already.
+"""
+import datetime
+import json
+import time
+from collections import namedtuple
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from app.core.db import db
+from app.core.hooks import write_hook
+from app.core.models.entity_change import EntityChange
+from app.core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.core.serialization import RawJSON, render
+
+EVENT_STREAM = 'text/event-stream'
+CHANGE_FEED_LOCK = 0x6263726d
+PENDING_CHANGES = 'bcrm_changes'
+POLL_INTERVAL = 0.5
+KEEP_ALIVE = 15
+MAX_WAIT = 60
+
+class ChangeFeedError(ValueError):
+    """ Raised when the change feed arguments are not valid """
+
+class ChangeRecord(namedtuple('ChangeRecord', ['seq', 'op', 'entity_id', 'entity_type_id', 'content'])):
+    """ Read only **EntityChange** """
+    __slots__ = ()
+
+    def toDict(self):
+        data = dict([])
+        data['seq'] = self.seq
+        data['op'] = self.op
+        data['id'] = self.entity_id
+        data['entity_type_id'] = self.entity_type_id
+        data['content'] = json.loads(self.content) if self.content is not None else None
+        return data
+
+    def toRawDict(self):
+        data = dict([])
+        data['seq'] = self.seq
+        data['op'] = self.op
+        data['id'] = self.entity_id
+        data['entity_type_id'] = self.entity_type_id
+        data['content'] = RawJSON(self.content) if self.content is not None else None
+        return data
+
+@write_hook
+def record_changes(op, rows):
+    db.session().info.setdefault(PENDING_CHANGES, []).extend(
+        {
+            'op': op,
+            'entity_id': row['id'],
+            'entity_type_id': row['entityTypeId'],
+            'content': row['content'] if op != 'delete' else None,
+        }
+        for row in rows
+    )
+
+@event.listens_for(Session, 'before_commit')
+def append_changes(session):
+    changes = session.info.pop(PENDING_CHANGES, None)
+    if not changes:
+        return
+    if session.get_bind().dialect.name == 'postgresql':
+        # held until the commit is done
+        session.execute(select([func.pg_advisory_xact_lock(CHANGE_FEED_LOCK)]))
+    session.execute(EntityChange.__table__.insert(), changes)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_changes(session):
+    session.info.pop(PENDING_CHANGES, None)
+
+def change_args(args, last_event_id=None):
+    """
+    Returns ``(since, limit, wait, entity_type_id)`` from the query string
+    ``args``, ``Last-Event-ID`` stands in for a missing ``since``
+    """
+    since = args.get('since', last_event_id or 0)
+    try:
+        since = int(since)
+    except ValueError:
+        raise ChangeFeedError("since must be an integer")
+    if since < 0:
+        raise ChangeFeedError("since must not be negative")
+
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ChangeFeedError("limit must be an integer")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ChangeFeedError("limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+
+    try:
+        wait = float(args.get('wait', 0))
+    except ValueError:
+        raise ChangeFeedError("wait must be a number")
+    if wait < 0 or wait > MAX_WAIT:
+        raise ChangeFeedError("wait must be between 0 and {}".format(MAX_WAIT))
+
+    return since, limit, wait, args.get('entity_type_id')
+
+def changes_since(since, limit, entity_type_id=None):
+    """
+    Returns up to ``limit`` changes after ``since`` in ``seq`` order
+    """
+    query = db.session.query(
+        EntityChange.seq, EntityChange.op, EntityChange.entity_id,
+        EntityChange.entity_type_id, EntityChange.content
+    ).filter(EntityChange.seq > since)
+    if entity_type_id is not None:
+        query = query.filter(EntityChange.entity_type_id == entity_type_id)
+    return [ChangeRecord(*row) for row in query.order_by(EntityChange.seq).limit(limit)]
+
+def poll_changes(since, limit, entity_type_id=None, wait=0):
+    """
+    Returns the changes after ``since``, waits up to ``wait`` seconds for
+    the first one
+    """
+    deadline = time.time() + wait
+    while True:
+        changes = changes_since(since, limit, entity_type_id)
+        remaining = deadline - time.time()
+        if changes or remaining <= 0:
+            return changes
+        time.sleep(min(POLL_INTERVAL, remaining))
+
+def change_event(change):
+    """
+    Returns the Server-Sent Event of a change
+    """
+    return 'id: {}\ndata: {}\n\n'.format(change.seq, render(change.toRawDict()))
+
+def event_stream(since, limit, entity_type_id=None, wait=0):
+    """
+    Yields the Server-Sent Events of the changes after ``since`` for
+    ``wait`` seconds, with keep alive comments while nothing changes
+    """
+    deadline = time.time() + wait
+    last_sent = time.time()
+    yield 'retry: {}\n\n'.format(int(POLL_INTERVAL * 1000))
+    while True:
+        changes = changes_since(since, limit, entity_type_id)
+        if changes:
+            since = changes[-1].seq
+            last_sent = time.time()
+            yield ''.join(change_event(change) for change in changes)
+            continue
+        now = time.time()
+        if now >= deadline:
+            return
+        if now - last_sent >= KEEP_ALIVE:
+            last_sent = now
+            yield ': keep-alive\n\n'
+        time.sleep(min(POLL_INTERVAL, deadline - now))
+
+def prune_changes(days):
+    """
+    Deletes the changes older than ``days``, returns the number of
+    deleted changes
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    db.session.begin()
+    result = db.session.execute(
+        EntityChange.__table__.delete().where(EntityChange.created < cutoff)
+    )
+    db.session.commit()
+    return result.rowcount
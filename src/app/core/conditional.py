@@ -0,0 +1,41 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Conditional requests
+    ========================
+    Entities and entity types carry a version that is bumped on every
+    update. It is sent as a strong ``ETag`` and checked against
+     - ``If-None-Match`` on reads, answered with 304 when unchanged
+     - ``If-Match`` on updates and deletes, answered with 412 when the
+       client holds a stale version
+"""
+from flask import jsonify, make_response, request
+
+def etag(version):
+    return str(version)
+
+def not_modified(version):
+    """
+    Returns True when the client copy of the given version is current
+    """
+    return version is not None and request.if_none_match.contains_weak(etag(version))
+
+def precondition_failed(version):
+    """
+    Returns True when ``If-Match`` does not match the given version
+    """
+    return bool(request.if_match) and not request.if_match.contains(etag(version))
+
+def not_modified_response(version):
+    response = make_response('', 304)
+    response.set_etag(etag(version))
+    return response
+
+def precondition_failed_response():
+    return make_response(jsonify({'message': 'Precondition failed'}), 412)
+
+def with_etag(response, version):
+    response.set_etag(etag(version))
+    return response
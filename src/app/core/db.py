@@ -4,21 +4,131 @@
 
 import os
 import click
-from flask_sqlalchemy import SQLAlchemy
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
 from flask.cli import with_appcontext
 from flask_migrate import Migrate
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import NullPool, Pool
+
+READ_BIND = 'bcrm_read_bind'
+WRITE_CONNECTION = 'bcrm_write_connection'
+
+def read_bind():
+    """
+    Returns the bind key of the replica serving the reads of the current
+    request, ``None`` when they go to the primary
+    """
+    return g.get(READ_BIND) if has_app_context() else None
+
+class RoutingSession(SignallingSession):
+    """
+    Runs the request in the transaction of its write connection when it
+    has one, sends the reads outside of a transaction to the replica picked
+    for the request
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        connection = g.get(WRITE_CONNECTION) if has_app_context() else None
+        if connection is not None:
+            return connection
+        bind = read_bind()
+        if bind is not None and self.transaction is None:
+            return db.get_engine(self.app, bind=bind)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """ Adds the pool and connection settings of the app config to the engines """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername.startswith('sqlite'):
+            return
+
+        pgbouncer = app.config['BCRM_DB_PGBOUNCER']
+        if pgbouncer:
+            # pgbouncer owns the pool, every checkout is a new client connection
+            options['poolclass'] = NullPool
+            for key in ('pool_size', 'pool_timeout', 'pool_recycle', 'max_overflow'):
+                options.pop(key, None)
+        else:
+            options['pool_pre_ping'] = app.config['SQLALCHEMY_POOL_PRE_PING']
+
+        timeout = app.config['BCRM_DB_STATEMENT_TIMEOUT']
+        if timeout and info.drivername.startswith('postgresql') and not pgbouncer:
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = '-c statement_timeout={}'.format(timeout)
 
 db = SQLAlchemy(session_options={'autocommit': True})
+
+def env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.lower() not in ('0', 'false', 'no', 'off')
+
 def init_db(app):
 
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI') \
         or 'sqlite:///bcrm.db' # Creates bcrm.db inside of app folder
+    app.config['SQLALCHEMY_POOL_SIZE'] = env_int('SQLALCHEMY_POOL_SIZE')
+    app.config['SQLALCHEMY_MAX_OVERFLOW'] = env_int('SQLALCHEMY_MAX_OVERFLOW')
+    app.config['SQLALCHEMY_POOL_TIMEOUT'] = env_int('SQLALCHEMY_POOL_TIMEOUT')
+    app.config['SQLALCHEMY_POOL_RECYCLE'] = env_int('SQLALCHEMY_POOL_RECYCLE')
+    app.config['SQLALCHEMY_POOL_PRE_PING'] = env_flag('SQLALCHEMY_POOL_PRE_PING', True)
+    app.config['BCRM_DB_STATEMENT_TIMEOUT'] = env_int('BCRM_DB_STATEMENT_TIMEOUT')
+    app.config['BCRM_DB_PGBOUNCER'] = env_flag('BCRM_DB_PGBOUNCER')
 
     db.init_app(app)
     migrate = Migrate(app, db)
+    register_postfork(app)
     app.cli.add_command(init_db_command)
-    
+    app.cli.add_command(export_entities_command)
+    app.cli.add_command(import_entities_command)
+    app.cli.add_command(prune_changes_command)
+    app.cli.add_command(dispatch_webhooks_command)
+    app.cli.add_command(prune_idempotency_keys_command)
+    app.cli.add_command(reindex_search_command)
+
+def register_postfork(app):
+    """
+    Drops the connections a uWSGI worker inherited from the master
+    """
+    try:
+        from uwsgidecorators import postfork
+    except ImportError:
+        return
+
+    @postfork
+    def dispose_engine():
+        with app.app_context():
+            db.engine.dispose()
+
+@event.listens_for(Pool, 'connect')
+def remember_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+@event.listens_for(Pool, 'checkout')
+def check_pid(dbapi_connection, connection_record, connection_proxy):
+    """
+    Refuses connections opened by another process, so a forked worker
+    never shares a socket with its parent
+    """
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            'Connection record belongs to pid {}, attempting to check out in pid {}'
+            .format(connection_record.info['pid'], pid)
+        )
 
 def create_db():
     db.create_all()
@@ -29,4 +139,80 @@ def create_db():
 def init_db_command():
     """Clear existing data and create new tables."""
     create_db()
-    click.echo('Initialized the database.')
\ No newline at end of file
+    click.echo('Initialized the database.')
+
+@click.command('export-entities')
+@click.option('--entity-type-id', default=None, help='Only export entities of this type.')
+@click.option('--output', '-o', default='-', type=click.File('w'), help='Output file, stdout by default.')
+@with_appcontext
+def export_entities_command(entity_type_id, output):
+    """Export entities as NDJSON."""
+    from app.core.export import export_ndjson
+    for chunk in export_ndjson(entity_type_id):
+        output.write(chunk)
+
+@click.command('import-entities')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='File format, guessed from the file extension by default.')
+@click.option('--chunk-size', default=1000, help='Records validated and committed together.')
+@click.option('--workers', default=None, type=int,
+              help='Validation processes, one per CPU by default, 0 validates in process.')
+@click.option('--resume', is_flag=True, help='Continue after the last checkpoint of the file.')
+@with_appcontext
+def import_entities_command(path, file_format, chunk_size, workers, resume):
+    """Import entities from a NDJSON or CSV file."""
+    from app.core.importer import import_entities
+    imported, rejected = import_entities(
+        path, file_format=file_format, chunk_size=chunk_size,
+        workers=workers, resume=resume, echo=click.echo
+    )
+    click.echo('Imported {} entities, rejected {}.'.format(imported, rejected))
+
+@click.command('prune-changes')
+@click.option('--days', default=30, help='Keep the changes of the last days.')
+@with_appcontext
+def prune_changes_command(days):
+    """Delete old change feed entries."""
+    from app.core.changes import prune_changes
+    click.echo('Deleted {} changes.'.format(prune_changes(days)))
+
+@click.command('dispatch-webhooks')
+@click.option('--concurrency', default=8, help='Webhook requests made at a time.')
+@click.option('--batch-size', default=50, help='Events posted to a webhook in one request.')
+@click.option('--max-attempts', default=8, help='Attempts before an event is dead.')
+@click.option('--timeout', default=10, help='Request timeout in seconds.')
+@click.option('--poll-interval', default=1.0, help='Seconds between outbox polls when idle.')
+@click.option('--once', is_flag=True, help='Stop when no delivery is due.')
+@with_appcontext
+def dispatch_webhooks_command(concurrency, batch_size, max_attempts, timeout, poll_interval, once):
+    """Deliver the webhook outbox."""
+    from app.core.webhooks import dispatch
+    delivered, failed = dispatch(
+        concurrency=concurrency, batch_size=batch_size, max_attempts=max_attempts,
+        timeout=timeout, poll_interval=poll_interval, once=once, echo=click.echo
+    )
+    click.echo('Delivered {} events, {} failed.'.format(delivered, failed))
+
+@click.command('prune-idempotency-keys')
+@with_appcontext
+def prune_idempotency_keys_command():
+    """Delete expired idempotency keys."""
+    from app.core.idempotency import prune_idempotency_keys
+    click.echo('Deleted {} idempotency keys.'.format(prune_idempotency_keys()))
+
+@click.command('reindex-search')
+@click.option('--entity-type-id', default=None, help='Only rebuild the search of this type.')
+@with_appcontext
+def reindex_search_command(entity_type_id):
+    """Rebuild the full-text search of entities."""
+    from app.core.models.entity_type import EntityType
+    from app.core.search import reindex_search
+    query = EntityType.query
+    if entity_type_id is not None:
+        query = query.filter(EntityType.id == entity_type_id)
+    for entity_type in query.all():
+        db.session.begin()
+        reindex_search(entity_type)
+        db.session.commit()
+        click.echo('Reindexed {}.'.format(entity_type.name))
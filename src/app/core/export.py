@@ -0,0 +1,39 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Entity export
+    ========================
+    Streams entities as NDJSON through a server side cursor. The stored
+    ``content`` text is written as is, it is never parsed on the way out.
+"""
+import json
+from app.core.db import db
+from app.core.models.entity import Entity
+
+EXPORT_BATCH_SIZE = 1000
+
+def export_rows(entity_type_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Returns an iterator over ``(id, entityTypeId, content)`` rows
+    """
+    query = db.session.query(Entity.id, Entity.entityTypeId, Entity.content)
+    if entity_type_id is not None:
+        query = query.filter(Entity.entityTypeId == entity_type_id)
+    return query.execution_options(stream_results=True).yield_per(batch_size)
+
+def export_ndjson(entity_type_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yields NDJSON chunks of up to ``batch_size`` entities
+    """
+    lines = []
+    for entity_id, entity_type, content in export_rows(entity_type_id, batch_size):
+        lines.append('{{"id": {}, "entity_type_id": {}, "content": {}}}\n'.format(
+            json.dumps(entity_id), json.dumps(entity_type), content
+        ))
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
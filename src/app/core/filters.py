@@ -0,0 +1,187 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Entity content filters
+    ========================
+    Query string filters on fields of the entity content:
+
+     - ``content.<path>=<op>:<value>`` compares the field at ``path``
+       (dot separated) with ``value``, ``op`` is one of
+       ``eq``, ``ne``, ``lt``, ``lte``, ``gt``, ``gte``. Without an
+       operator the comparison is ``eq``.
+     - ``content=contains:<json object>`` keeps entities whose content
+       contains the given document.
+
+    Values are read as json when they parse (``eq:18``, ``eq:true``,
+    ``eq:"18"``) and as plain strings otherwise.
+
+    On PostgreSQL filters run against the ``JSONB`` column and equality and
+    containment are answered by the GIN index. On SQLite they use the JSON1
+    functions. When the entity type is known, equality filters on fields it
+    declares indexed are answered by ``entity_index`` first.
+"""
+import json
+import operator
+from sqlalchemy import and_, exists, func, literal, literal_column, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Text
+from app.core.db import db
+from app.core.indexing import indexed_clauses
+from app.core.models.entity import Entity
+from app.core.models.json_text import JSONText
+
+COMPARISONS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+}
+
+class FilterError(ValueError):
+    """ Raised when a filter can not be parsed """
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+def parse_filters(args):
+    """
+    Returns the ``(path, op, value)`` filters of the query string,
+    ``path`` is a list of keys, empty for ``contains`` filters
+    """
+    filters = []
+    for name, values in args.lists():
+        if name == 'content':
+            for value in values:
+                op, _, operand = value.partition(':')
+                if op != 'contains':
+                    raise FilterError("content filter must be 'contains:<json object>'")
+                document = parse_value(operand)
+                if not isinstance(document, dict):
+                    raise FilterError("contains filter must be a json object")
+                filters.append(([], 'contains', document))
+            continue
+
+        if not name.startswith('content.'):
+            continue
+        path = name.split('.')[1:]
+        if not all(path):
+            raise FilterError("invalid filter path '{}'".format(name))
+        for value in values:
+            op, sep, operand = value.partition(':')
+            if not sep or op not in COMPARISONS:
+                op, operand = 'eq', value
+            operand = parse_value(operand)
+            if isinstance(operand, (dict, list)):
+                raise FilterError("filter '{}' value must be a scalar".format(name))
+            filters.append((path, op, operand))
+    return filters
+
+
+def nest(path, value):
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+def json_literal(value):
+    return literal(json.dumps(value), JSONText())
+
+def postgresql_type(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, (int, float)):
+        return 'number'
+    return 'string'
+
+def postgresql_clause(path, op, value):
+    if op == 'contains':
+        return Entity.content.op('@>')(json_literal(value))
+
+    field = Entity.content.op('#>')(literal(path, ARRAY(Text)))
+    comparison = COMPARISONS[op](field, json_literal(value))
+    if op == 'eq':
+        # the containment test lets the GIN index find the candidates
+        return and_(Entity.content.op('@>')(json_literal(nest(path, value))), comparison)
+    if op == 'ne':
+        return comparison
+    return and_(func.jsonb_typeof(field) == postgresql_type(value), comparison)
+
+
+def sqlite_path(path):
+    return '$' + ''.join('."{}"'.format(key.replace('"', '\\"')) for key in path)
+
+def sqlite_types(value):
+    if value is None:
+        return ('null',)
+    if value is True:
+        return ('true',)
+    if value is False:
+        return ('false',)
+    if isinstance(value, (int, float)):
+        return ('integer', 'real')
+    return ('text',)
+
+def sqlite_clause(path, op, value):
+    if op == 'contains':
+        return and_(*sqlite_contains(path, value))
+
+    json_path = sqlite_path(path)
+    field_type = func.json_type(Entity.content, json_path)
+    if value is None:
+        return field_type == 'null' if op == 'eq' else field_type != 'null'
+    types = sqlite_types(value)
+    if isinstance(value, bool):
+        value = int(value)
+    comparison = COMPARISONS[op](func.json_extract(Entity.content, json_path), value)
+    if op == 'ne':
+        return comparison
+    return and_(field_type.in_(types), comparison)
+
+def sqlite_contains(path, document):
+    if isinstance(document, dict):
+        clauses = []
+        for key, value in document.items():
+            clauses.extend(sqlite_contains(path + [key], value))
+        return clauses
+    if isinstance(document, list):
+        clauses = []
+        for item in document:
+            if isinstance(item, (dict, list)):
+                raise FilterError("nested containment is not supported by this database")
+            elements = func.json_each(Entity.content, sqlite_path(path))
+            clauses.append(exists(
+                select([literal(1)])
+                .select_from(elements)
+                .where(literal_column('json_each.value') == item)
+            ))
+        return clauses
+    return [sqlite_clause(path, 'eq', document)]
+
+
+def filter_clauses(filters):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return [postgresql_clause(*item) for item in filters]
+    return [sqlite_clause(*item) for item in filters]
+
+def apply_filters(query, args, entity_type_id=None):
+    """
+    Applies the content filters of the query string to an entity query
+
+    Raises :exc:`FilterError` if a filter is not valid
+    """
+    filters = parse_filters(args)
+    clauses = filter_clauses(filters)
+    if entity_type_id is not None:
+        clauses = indexed_clauses(entity_type_id, filters) + clauses
+    for clause in clauses:
+        query = query.filter(clause)
+    return query
@@ -0,0 +1,45 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Entity write hooks
+    ========================
+    Every handler that writes entities calls :func:`entities_written`
+    inside its transaction, after the entity rows are flushed for creates
+    and updates and before they are removed for deletes. Registered hooks
+    keep data derived from entities consistent with them.
+
+    Hooks are called with the operation, one of ``create``, ``update`` or
+    ``delete``, and a list of rows ``{'id', 'entityTypeId', 'content'}``.
+    Update and delete rows also carry a ``previous`` row when the previous
+    state is known, and rows written from a request carry the parsed
+    content as ``document`` so hooks do not parse it again.
+"""
+
+_hooks = []
+
+def write_hook(func):
+    """
+    Registers ``func`` as an entity write hook
+    """
+    _hooks.append(func)
+    return func
+
+def entities_written(op, rows):
+    if not rows:
+        return
+    for hook in _hooks:
+        hook(op, rows)
+
+def entity_row(entity, previous=None, document=None):
+    row = {
+        'id': entity.id,
+        'entityTypeId': entity.entityTypeId,
+        'content': entity.content,
+    }
+    if previous is not None:
+        row['previous'] = previous
+    if document is not None:
+        row['document'] = document
+    return row
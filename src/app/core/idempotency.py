@@ -0,0 +1,277 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Idempotent writes
+    ========================
+    Write requests sent with an ``Idempotency-Key`` header are run once.
+    The key is claimed in ``idempotency_key`` before the request runs and
+    the response is stored with it afterwards, a retry with the same key
+    is answered with the stored response (marked ``Idempotent-Replayed``)
+    without validating or writing anything again:
+     - a retry of a request still running is answered with 409
+     - a key reused for a different method, path, content type, query or
+       body is answered with 422
+     - server errors release the key, the request can be retried
+
+    The request runs in one database transaction, its commits only commit
+    once the response is stored in the same transaction: a crash can not
+    leave a write without its stored response. A request that rolled back
+    wrote nothing and stores its response on its own. Chunked requests
+    (``chunked=True``) commit every chunk, they store their response after
+    the last one.
+
+    Keys expire after ``BCRM_IDEMPOTENCY_TTL`` seconds. A claim is a lease
+    of ``LOCK_TIMEOUT`` seconds, renewed every ``HEARTBEAT_INTERVAL``
+    seconds by a thread while its request runs (uWSGI needs
+    ``enable-threads``): a retry is answered with 409 as long as the
+    claiming worker is alive, the key is only taken over once a crashed
+    worker stopped renewing it. A worker whose claim was taken over anyway
+    (e.g. stalled past the lease) rolls its write back and does not store
+    its response over the response of the new claim. ``flask prune-idempotency-keys`` deletes the
+    expired keys.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import threading
+from functools import wraps
+from flask import Response, current_app, g, jsonify, make_response, request
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from app.core.db import WRITE_CONNECTION, db
+from app.core.models.idempotency_key import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+STORED_HEADERS = ('Content-Type', 'ETag', 'Link', 'Location')
+MAX_KEY_LENGTH = 255
+LOCK_TIMEOUT = 60
+HEARTBEAT_INTERVAL = 20
+
+logger = logging.getLogger(__name__)
+
+def fingerprint():
+    """
+    Returns the digest of the request method, path, content type, query
+    and body
+    """
+    digest = hashlib.sha256()
+    digest.update(request.method.encode('utf-8') + b' ' + request.path.encode('utf-8'))
+    digest.update(b' ' + request.mimetype.encode('utf-8'))
+    digest.update(b'?' + request.query_string + b'\n')
+    digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+def lease_end():
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=LOCK_TIMEOUT)
+
+def claim(key, digest, now):
+    """
+    Claims ``key`` for the running request, returns ``None`` once claimed
+    or the stored row of the key. The claim is identified by its
+    ``created`` time ``now``
+    """
+    table = IdempotencyKey.__table__
+    row = None
+    for _ in range(3):
+        db.session.begin()
+        try:
+            db.session.execute(table.insert().values(
+                key=key, fingerprint=digest, created=now, expires=lease_end()))
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+
+        row = db.session.query(
+            IdempotencyKey.fingerprint, IdempotencyKey.status, IdempotencyKey.headers,
+            IdempotencyKey.body, IdempotencyKey.created, IdempotencyKey.expires
+        ).filter(IdempotencyKey.key == key).first()
+        if row is not None and row.expires > datetime.datetime.utcnow():
+            return row
+
+        if row is not None:
+            # the lease may have been renewed since it was read
+            db.session.begin()
+            db.session.execute(table.delete().where(table.c.key == key)
+                               .where(table.c.expires <= datetime.datetime.utcnow()))
+            db.session.commit()
+    return row
+
+class Heartbeat(threading.Thread):
+    """ Renews the lease of a claim until its request is done """
+
+    def __init__(self, app, key, created):
+        super(Heartbeat, self).__init__(name='idempotency-heartbeat')
+        self.daemon = True
+        self.app = app
+        self.key = key
+        self.created = created
+        self.done = threading.Event()
+
+    def renew(self):
+        table = IdempotencyKey.__table__
+        with db.get_engine(self.app).begin() as connection:
+            connection.execute(table.update()
+                               .where(table.c.key == self.key)
+                               .where(table.c.created == self.created)
+                               .where(table.c.status.is_(None))
+                               .values(expires=lease_end()))
+
+    def run(self):
+        while not self.done.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.renew()
+            except DBAPIError:
+                logger.warning('could not renew the claim of %s', self.key, exc_info=True)
+
+    def stop(self):
+        # a renewal still running is a no-op once the response is stored
+        self.done.set()
+
+def release(key, created):
+    table = IdempotencyKey.__table__
+    db.session.begin()
+    db.session.execute(table.delete().where(table.c.key == key)
+                       .where(table.c.created == created))
+    db.session.commit()
+
+def store_statement(key, created, response):
+    """
+    Returns the ``UPDATE`` storing the response of the claim, it matches
+    no row when the claim was taken over meanwhile
+    """
+    table = IdempotencyKey.__table__
+    headers = [(name, response.headers[name]) for name in STORED_HEADERS if name in response.headers]
+    expires = datetime.datetime.utcnow() + datetime.timedelta(
+        seconds=current_app.config['BCRM_IDEMPOTENCY_TTL'])
+    return (
+        table.update()
+        .where(table.c.key == key)
+        .where(table.c.created == created)
+        .values(
+            status=response.status_code,
+            headers=json.dumps(headers),
+            body=response.get_data(),
+            expires=expires
+        )
+    )
+
+def stored(result, key):
+    if not result.rowcount:
+        logger.warning('the claim of %s was taken over, the response is not stored', key)
+    return bool(result.rowcount)
+
+def store(key, created, response):
+    """
+    Stores the response of the claim in its own transaction, returns
+    ``False`` when the claim was taken over meanwhile
+    """
+    db.session.begin()
+    result = db.session.execute(store_statement(key, created, response))
+    db.session.commit()
+    return stored(result, key)
+
+def replay(row):
+    response = Response(row.body, status=row.status, headers=json.loads(row.headers))
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+def in_progress_response():
+    msg = "A request with this {} is in progress".format(IDEMPOTENCY_HEADER)
+    return make_response(jsonify({'message': msg}), 409)
+
+def run_chunked(func, args, kwargs, key, created):
+    try:
+        response = make_response(func(*args, **kwargs))
+    except BaseException:
+        release(key, created)
+        raise
+    if response.status_code >= 500 or response.is_streamed:
+        release(key, created)
+    else:
+        store(key, created, response)
+    return response
+
+def run_in_transaction(func, args, kwargs, key, created):
+    connection = db.get_engine(current_app).connect()
+    transaction = connection.begin()
+    try:
+        # the session joins the transaction, its commits wait for ours
+        setattr(g, WRITE_CONNECTION, connection)
+        try:
+            response = make_response(func(*args, **kwargs))
+        finally:
+            g.pop(WRITE_CONNECTION, None)
+
+        if response.status_code >= 500 or response.is_streamed:
+            if transaction.is_active:
+                transaction.rollback()
+            release(key, created)
+        elif not transaction.is_active:
+            # the request rolled back, there is no write to store with
+            store(key, created, response)
+        elif stored(connection.execute(store_statement(key, created, response)), key):
+            transaction.commit()
+        else:
+            transaction.rollback()
+            return in_progress_response()
+        return response
+    except BaseException:
+        if transaction.is_active:
+            transaction.rollback()
+        release(key, created)
+        raise
+    finally:
+        connection.close()
+
+def idempotent(func=None, chunked=False):
+    """
+    Runs the write once per ``Idempotency-Key``, see module documentation
+    """
+    if func is None:
+        return lambda func: idempotent(func, chunked)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return func(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            msg = "{} must have 1 to {} characters".format(IDEMPOTENCY_HEADER, MAX_KEY_LENGTH)
+            return make_response(jsonify({'message': msg}), 400)
+
+        digest = fingerprint()
+        created = datetime.datetime.utcnow()
+        row = claim(key, digest, created)
+        if row is not None:
+            if row.fingerprint != digest:
+                msg = "{} was used for a different request".format(IDEMPOTENCY_HEADER)
+                return make_response(jsonify({'message': msg}), 422)
+            if row.status is None:
+                return in_progress_response()
+            return replay(row)
+
+        heartbeat = Heartbeat(current_app._get_current_object(), key, created)
+        heartbeat.start()
+        try:
+            if chunked:
+                return run_chunked(func, args, kwargs, key, created)
+            return run_in_transaction(func, args, kwargs, key, created)
+        finally:
+            heartbeat.stop()
+    return wrapper
+
+def prune_idempotency_keys():
+    """
+    Deletes the expired keys, returns their number
+    """
+    table = IdempotencyKey.__table__
+    db.session.begin()
+    result = db.session.execute(
+        table.delete().where(table.c.expires <= datetime.datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount
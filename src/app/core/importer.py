@@ -0,0 +1,257 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Entity import
+    ========================
+    Loads NDJSON or CSV files of entities in chunks:
+     - records are read incrementally from the file
+     - content is validated against cached type schemas by a process pool
+     - rows are loaded with ``COPY FROM STDIN`` on PostgreSQL and with
+       executemany anywhere else
+     - every chunk commits with the checkpoint of its file, an interrupted
+       import is resumed after the last committed chunk
+     - records whose id is taken are rejected like invalid ones
+
+    CSV files need an ``entity_type_id`` and a ``content`` column holding the
+    content as json, an ``id`` column is optional.
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from collections import deque, namedtuple
+from itertools import islice
+from jsonschema import ValidationError
+from app.core.db import db
+from app.core.batch import insert_rows
+from app.core.hooks import entities_written
+from app.core.models.entity import Entity
+from app.core.models.entity_type import EntityType
+from app.core.models.import_checkpoint import ImportCheckpoint
+from app.core.validation import ValidatorRegistry
+
+DEFAULT_CHUNK_SIZE = 1000
+ID_QUERY_SIZE = 500
+
+SchemaRevision = namedtuple('SchemaRevision', ['id', 'schema'])
+
+def detect_format(path):
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+def read_records(stream, file_format):
+    """
+    Yields ``(line, record)`` pairs, ``record`` is ``None`` when the line
+    can not be parsed
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            try:
+                record['content'] = json.loads(record.get('content') or '')
+            except ValueError:
+                record = None
+            yield reader.line_num, record
+        return
+
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+def checkpoint_key(path):
+    return os.path.realpath(path)
+
+def read_checkpoint(path):
+    records = db.session.query(ImportCheckpoint.records) \
+        .filter(ImportCheckpoint.path == checkpoint_key(path)).scalar()
+    return records or 0
+
+def write_checkpoint(path, records):
+    """
+    Records the progress of the import, inside the transaction of the chunk
+    """
+    db.session.merge(ImportCheckpoint(path=checkpoint_key(path), records=records))
+
+def clear_checkpoint(path):
+    db.session.begin()
+    db.session.query(ImportCheckpoint) \
+        .filter(ImportCheckpoint.path == checkpoint_key(path)).delete(synchronize_session=False)
+    db.session.commit()
+
+def existing_ids(ids):
+    """
+    Returns the ids among ``ids`` that are taken by an entity
+    """
+    existing = set()
+    for chunk in chunked(ids, ID_QUERY_SIZE):
+        existing.update(row.id for row in db.session.query(Entity.id).filter(Entity.id.in_(chunk)))
+    return existing
+
+_registry = None
+_schemas = None
+
+def _init_worker(schemas):
+    global _registry, _schemas
+    _registry = ValidatorRegistry(maxsize=max(len(schemas), 1))
+    _schemas = schemas
+
+def validate_chunk(chunk):
+    """
+    Validates a chunk of ``(line, record)`` pairs, returns a list of
+    ``(line, row, error)`` where exactly one of ``row`` and ``error`` is set
+    """
+    results = []
+    for line, record in chunk:
+        if not isinstance(record, dict) or not isinstance(record.get('content'), dict):
+            results.append((line, None, 'record is not a valid entity'))
+            continue
+
+        schema = _schemas.get(record.get('entity_type_id'))
+        if schema is None:
+            results.append((
+                line, None,
+                "Entity type id '{}' does not exist".format(record.get('entity_type_id'))
+            ))
+            continue
+
+        try:
+            _registry.get(SchemaRevision(record['entity_type_id'], schema)).validate(record['content'])
+        except ValidationError:
+            results.append((line, None, 'Entity content does not match type schema'))
+            continue
+
+        results.append((line, {
+            'id': record.get('id') or str(uuid.uuid4()),
+            'entityTypeId': record['entity_type_id'],
+            'content': json.dumps(record['content']),
+        }, None))
+    return results
+
+def copy_rows(rows):
+    """
+    Loads the rows with ``COPY FROM STDIN``, inside the caller transaction
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow((row['id'], row['entityTypeId'], row['content']))
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY entity (id, "entityTypeId", content) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+    finally:
+        cursor.close()
+
+def load_rows(rows, chunk_size):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        copy_rows(rows)
+    else:
+        insert_rows(rows, chunk_size)
+
+def load_chunk(path, results, processed, chunk_size):
+    """
+    Loads the valid rows of a chunk with the checkpoint after it, inside the
+    caller transaction, returns the rows and the ``(line, error)`` pairs
+    """
+    taken = existing_ids([row['id'] for line, row, error in results if error is None])
+    rows = []
+    errors = []
+    for line, row, error in results:
+        if error is None and row['id'] in taken:
+            error = "Entity id '{}' already exists".format(row['id'])
+        if error is not None:
+            errors.append((line, error))
+        else:
+            taken.add(row['id'])
+            rows.append(row)
+
+    load_rows(rows, chunk_size)
+    entities_written('create', rows)
+    write_checkpoint(path, processed)
+    return rows, errors
+
+def ordered_map(pool, func, iterable, window):
+    """
+    Like ``pool.imap`` but keeps at most ``window`` tasks in flight, so the
+    input file is not read faster than the chunks are loaded
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def import_entities(path, file_format=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    workers=None, resume=False, echo=print):
+    """
+    Imports the entities of the file, returns ``(imported, rejected)``
+    """
+    file_format = file_format or detect_format(path)
+    skip = read_checkpoint(path) if resume else 0
+    if skip:
+        echo('Resuming after {} records.'.format(skip))
+
+    schemas = dict(db.session.query(EntityType.id, EntityType.schema))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    pool = None
+    if workers > 0:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(schemas,))
+        mapper = lambda func, chunks: ordered_map(pool, func, chunks, workers * 2)
+    else:
+        _init_worker(schemas)
+        mapper = map
+
+    processed = skip
+    imported = rejected = 0
+    started = time.time()
+    try:
+        with io.open(path, newline='' if file_format == 'csv' else None, encoding='utf-8') as stream:
+            records = islice(read_records(stream, file_format), skip, None)
+            for results in mapper(validate_chunk, chunked(records, chunk_size)):
+                db.session.begin()
+                try:
+                    rows, errors = load_chunk(path, results, processed + len(results), chunk_size)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+
+                for line, error in errors:
+                    echo('line {}: {}'.format(line, error))
+                processed += len(results)
+                imported += len(rows)
+                rejected += len(errors)
+
+                elapsed = max(time.time() - started, 1e-6)
+                echo('{} records imported, {:.0f} rows/sec'.format(imported, imported / elapsed))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    clear_checkpoint(path)
+    return imported, rejected
@@ -0,0 +1,169 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Declared content indexes
+    ========================
+    An entity type declares indexed content fields in its schema with
+    ``"x-bcrm-index": true`` on a property, nested object properties are
+    indexed under their dotted path::
+
+        {"properties": {"email": {"type": "string", "x-bcrm-index": true}}}
+
+    Scalar values of those fields are kept in the ``entity_index`` table,
+    which answers equality filters on them without scanning the type.
+"""
+import json
+from functools import lru_cache
+from sqlalchemy import and_
+from app.core.db import db
+from app.core.hooks import write_hook
+from app.core.models.entity import Entity
+from app.core.models.entity_index import EntityIndex
+from app.core.models.entity_type import EntityType
+
+INDEX_KEYWORD = 'x-bcrm-index'
+VALUE_LENGTH = 255
+REINDEX_BATCH_SIZE = 1000
+
+@lru_cache(maxsize=256)
+def indexed_fields(schema):
+    """
+    Returns the tuple of indexed field paths declared by a schema text
+    """
+    def walk(node, prefix):
+        fields = []
+        properties = node.get('properties') if isinstance(node, dict) else None
+        if not isinstance(properties, dict):
+            return fields
+        for name, subschema in sorted(properties.items()):
+            if not isinstance(subschema, dict):
+                continue
+            if subschema.get(INDEX_KEYWORD) is True:
+                fields.append(prefix + name)
+            fields.extend(walk(subschema, prefix + name + '.'))
+        return fields
+    return tuple(walk(json.loads(schema), ''))
+
+def index_value(value):
+    """
+    Returns the indexed form of a content value, ``None`` if the value
+    can not be indexed
+    """
+    if isinstance(value, (dict, list)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return json.dumps(value)[:VALUE_LENGTH]
+
+def extract(content, field):
+    for key in field.split('.'):
+        if not isinstance(content, dict) or key not in content:
+            return None
+        content = content[key]
+    return index_value(content)
+
+def index_rows(entity_type_id, fields, entity_id, document):
+    rows = []
+    for field in fields:
+        value = extract(document, field)
+        if value is not None:
+            rows.append({
+                'entity_type_id': entity_type_id,
+                'field': field,
+                'value': value,
+                'entity_id': entity_id,
+            })
+    return rows
+
+def type_schemas(entity_type_ids):
+    return dict(
+        db.session.query(EntityType.id, EntityType.schema)
+        .filter(EntityType.id.in_(list(entity_type_ids)))
+    )
+
+def unindex_entities(entity_ids):
+    db.session.execute(
+        EntityIndex.__table__.delete().where(EntityIndex.entity_id.in_(entity_ids))
+    )
+
+@write_hook
+def maintain_index(op, rows):
+    if op != 'create':
+        unindex_entities([row['id'] for row in rows])
+    if op == 'delete':
+        return
+
+    schemas = type_schemas(set(row['entityTypeId'] for row in rows))
+    index = []
+    for row in rows:
+        fields = indexed_fields(schemas[row['entityTypeId']])
+        if fields:
+            document = row.get('document')
+            if document is None:
+                document = json.loads(row['content'])
+            index.extend(index_rows(row['entityTypeId'], fields, row['id'], document))
+    if index:
+        db.session.execute(EntityIndex.__table__.insert(), index)
+
+def reindex_entity_type(entity_type, previous_schema):
+    """
+    Brings the index of the entity type in line with its schema after the
+    schema changed, must run inside the caller transaction
+    """
+    fields = set(indexed_fields(entity_type.schema))
+    previous = set(indexed_fields(previous_schema))
+    if fields == previous:
+        return
+
+    dropped = previous - fields
+    if dropped:
+        db.session.execute(EntityIndex.__table__.delete().where(and_(
+            EntityIndex.entity_type_id == entity_type.id,
+            EntityIndex.field.in_(list(dropped))
+        )))
+
+    added = sorted(fields - previous)
+    if not added:
+        return
+    entities = (
+        db.session.query(Entity.id, Entity.content)
+        .filter(Entity.entityTypeId == entity_type.id)
+        .yield_per(REINDEX_BATCH_SIZE)
+    )
+    index = []
+    for entity_id, content in entities:
+        index.extend(index_rows(entity_type.id, added, entity_id, json.loads(content)))
+        if len(index) >= REINDEX_BATCH_SIZE:
+            db.session.execute(EntityIndex.__table__.insert(), index)
+            index = []
+    if index:
+        db.session.execute(EntityIndex.__table__.insert(), index)
+
+def indexed_clauses(entity_type_id, filters):
+    """
+    Returns the clauses answering the equality filters on indexed fields of
+    the entity type through ``entity_index``
+    """
+    equalities = [(path, value) for path, op, value in filters if op == 'eq' and path]
+    if not equalities:
+        return []
+    schema = db.session.query(EntityType.schema).filter(EntityType.id == entity_type_id).scalar()
+    if schema is None:
+        return []
+
+    fields = indexed_fields(schema)
+    clauses = []
+    for path, value in equalities:
+        field = '.'.join(path)
+        if field not in fields or index_value(value) is None:
+            continue
+        clauses.append(Entity.id.in_(
+            db.session.query(EntityIndex.entity_id).filter(
+                EntityIndex.entity_type_id == entity_type_id,
+                EntityIndex.field == field,
+                EntityIndex.value == index_value(value),
+            )
+        ))
+    return clauses
@@ -0,0 +1,127 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Cached lookups
+    ========================
+    Read-through lookups of entities and entity types by id. Writes
+    schedule the invalidation of the ids they touch, the keys are replaced
+    by tombstones once the transaction commits, see :mod:`app.core.cache`.
+    Rows read on a replica are not cached.
+"""
+import json
+from collections import namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.core.cache import TOMBSTONE, cache
+from app.core.db import db, read_bind
+from app.core.hooks import write_hook
+from app.core.models.entity import Entity
+from app.core.models.entity_type import EntityType
+from app.core.serialization import RawJSON
+from app.instrumentation import phase
+
+
+class EntityTypeRecord(namedtuple('EntityTypeRecord', ['id', 'name', 'schema', 'version'])):
+    """ Read only **EntityType** """
+    __slots__ = ()
+
+    def toDict(self):
+        data = dict([])
+        data['id'] = self.id
+        data['name'] = self.name
+        data['schema'] = json.loads(self.schema)
+        return data
+
+    def toRawDict(self):
+        data = dict([])
+        data['id'] = self.id
+        data['name'] = self.name
+        data['schema'] = RawJSON(self.schema)
+        return data
+
+class EntityRecord(namedtuple('EntityRecord', ['id', 'entityTypeId', 'content', 'version'])):
+    """ Read only **Entity** """
+    __slots__ = ()
+
+    def toDict(self):
+        data = dict([])
+        data['id'] = self.id
+        data['entity_type_id'] = self.entityTypeId
+        data['content'] = json.loads(self.content)
+        return data
+
+    def toRawDict(self):
+        data = dict([])
+        data['id'] = self.id
+        data['entity_type_id'] = self.entityTypeId
+        data['content'] = RawJSON(self.content)
+        return data
+
+
+def read_through(key, record, query):
+    value = cache.get(key)
+    if value is not None and value != TOMBSTONE:
+        return record(*value)
+    row = query.first()
+    if row is None:
+        return None
+    if value is None and read_bind() is None:
+        cache.add(key, list(row))
+    return record(*row)
+
+def entity_type_key(entity_type_id):
+    return 'bcrm:entity_type:' + entity_type_id
+
+def entity_key(entity_id):
+    return 'bcrm:entity:' + entity_id
+
+@phase('lookup')
+def get_entity_type(entity_type_id):
+    """
+    Returns the :class:`EntityTypeRecord` of the id, ``None`` if not found
+    """
+    return read_through(
+        entity_type_key(entity_type_id),
+        EntityTypeRecord,
+        db.session.query(EntityType.id, EntityType.name, EntityType.schema, EntityType.version)
+        .filter(EntityType.id == entity_type_id)
+    )
+
+@phase('lookup')
+def get_entity(entity_id):
+    """
+    Returns the :class:`EntityRecord` of the id, ``None`` if not found
+    """
+    return read_through(
+        entity_key(entity_id),
+        EntityRecord,
+        db.session.query(Entity.id, Entity.entityTypeId, Entity.content, Entity.version)
+        .filter(Entity.id == entity_id)
+    )
+
+
+def schedule_invalidation(key):
+    db.session().info.setdefault('bcrm_invalidate', set()).add(key)
+
+def invalidate_entity_type(entity_type_id):
+    schedule_invalidation(entity_type_key(entity_type_id))
+
+def invalidate_entities(entity_ids):
+    for entity_id in entity_ids:
+        schedule_invalidation(entity_key(entity_id))
+
+@write_hook
+def invalidate_written_entities(op, rows):
+    if op != 'create':
+        invalidate_entities(row['id'] for row in rows)
+
+@event.listens_for(Session, 'after_commit')
+def drop_invalidated_keys(session):
+    for key in session.info.pop('bcrm_invalidate', ()):
+        cache.tombstone(key)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_invalidated_keys(session):
+    session.info.pop('bcrm_invalidate', None)
@@ -5,7 +5,10 @@
 import datetime
 import uuid
 import json
+from sqlalchemy import DDL, event
 from app.core.db import db
+from app.core.models.json_text import JSONText
+from app.core.serialization import RawJSON
 
 entity_schema = {
     "type": "object",
@@ -20,6 +23,9 @@ class Entity(db.Model):
     """ **EntityType** db model """
 
     __tablename__ = 'entity'
+    __table_args__ = (
+        db.Index('ix_entity_entityTypeId_id', 'entityTypeId', 'id'),
+    )
 
     id = db.Column(
         db.String(length=60),
@@ -35,10 +41,20 @@ class Entity(db.Model):
     )
 
     content = db.Column(
-        db.Text(),
+        JSONText(),
         nullable=False
     )
 
+    version = db.Column(
+        db.Integer(),
+        nullable=False,
+        server_default='1'
+    )
+
+    __mapper_args__ = {
+        'version_id_col': version
+    }
+
     def __init__(self, **kwargs):
         self.id = uuid.uuid4().__str__()
         self.entityTypeId = kwargs.get('entity_type_id')
@@ -50,3 +66,17 @@ class Entity(db.Model):
         data['entity_type_id'] = self.entityTypeId
         data['content'] = json.loads(self.content)
         return data
+
+    def toRawDict(self):
+        data = dict([])
+        data['id'] = self.id
+        data['entity_type_id'] = self.entityTypeId
+        data['content'] = RawJSON(self.content)
+        return data
+
+event.listen(
+    Entity.__table__,
+    'after_create',
+    DDL('CREATE INDEX ix_entity_content ON entity USING gin (content jsonb_path_ops)')
+    .execute_if(dialect='postgresql')
+)
@@ -0,0 +1,48 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+import datetime
+from app.core.db import db
+
+class EntityChange(db.Model):
+    """ **EntityChange** db model, one row per written entity in write order """
+
+    __tablename__ = 'entity_change'
+    __table_args__ = (
+        db.Index('ix_entity_change_entity_type_id_seq', 'entity_type_id', 'seq'),
+        db.Index('ix_entity_change_created', 'created'),
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = db.Column(
+        db.BigInteger().with_variant(db.Integer(), 'sqlite'),
+        primary_key=True,
+        autoincrement=True
+    )
+
+    op = db.Column(
+        db.String(length=10),
+        nullable=False
+    )
+
+    entity_id = db.Column(
+        db.String(length=60),
+        nullable=False
+    )
+
+    entity_type_id = db.Column(
+        db.String(length=60),
+        nullable=False
+    )
+
+    content = db.Column(
+        db.Text(),
+        nullable=True
+    )
+
+    created = db.Column(
+        db.DateTime(),
+        nullable=False,
+        default=datetime.datetime.utcnow
+    )
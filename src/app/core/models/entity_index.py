@@ -0,0 +1,35 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+from app.core.db import db
+
+class EntityIndex(db.Model):
+    """ **EntityIndex** db model, one row per indexed content field of an entity """
+
+    __tablename__ = 'entity_index'
+    __table_args__ = (
+        db.Index('ix_entity_index_entity_id', 'entity_id'),
+    )
+
+    entity_type_id = db.Column(
+        db.String(length=60),
+        db.ForeignKey('entity_type.id'),
+        primary_key=True
+    )
+
+    field = db.Column(
+        db.String(length=255),
+        primary_key=True
+    )
+
+    value = db.Column(
+        db.String(length=255),
+        primary_key=True
+    )
+
+    entity_id = db.Column(
+        db.String(length=60),
+        db.ForeignKey('entity.id'),
+        primary_key=True
+    )
@@ -0,0 +1,40 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+from app.core.db import db
+
+class EntityRef(db.Model):
+    """ **EntityRef** db model, one row per entity id held by a reference field of an entity """
+
+    __tablename__ = 'entity_ref'
+    __table_args__ = (
+        db.Index('ix_entity_ref_target_id_field', 'target_id', 'field'),
+    )
+
+    entity_id = db.Column(
+        db.String(length=60),
+        db.ForeignKey('entity.id'),
+        primary_key=True
+    )
+
+    field = db.Column(
+        db.String(length=255),
+        primary_key=True
+    )
+
+    position = db.Column(
+        db.Integer(),
+        primary_key=True
+    )
+
+    target_id = db.Column(
+        db.String(length=60),
+        nullable=False
+    )
+
+    entity_type_id = db.Column(
+        db.String(length=60),
+        db.ForeignKey('entity_type.id'),
+        nullable=False
+    )
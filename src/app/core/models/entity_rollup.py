@@ -0,0 +1,53 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+from decimal import Decimal
+from app.core.db import db
+
+class DecimalText(db.TypeDecorator):
+    """ Exact decimal stored as text, for SQLite which keeps numerics as floats """
+
+    impl = db.Text
+
+    def process_bind_param(self, value, dialect):
+        return str(value) if value is not None else None
+
+    def process_result_value(self, value, dialect):
+        return Decimal(value) if value is not None else None
+
+class EntityRollup(db.Model):
+    """ **EntityRollup** db model, running count and total of a declared rollup group """
+
+    __tablename__ = 'entity_rollup'
+
+    entity_type_id = db.Column(
+        db.String(length=60),
+        db.ForeignKey('entity_type.id'),
+        primary_key=True
+    )
+
+    rollup = db.Column(
+        db.String(length=80),
+        primary_key=True
+    )
+
+    group_key = db.Column(
+        db.Text(),
+        primary_key=True
+    )
+
+    field = db.Column(
+        db.String(length=255),
+        primary_key=True
+    )
+
+    count = db.Column(
+        db.BigInteger(),
+        nullable=False
+    )
+
+    total = db.Column(
+        db.Numeric().with_variant(DecimalText(), 'sqlite'),
+        nullable=False
+    )
@@ -6,6 +6,8 @@ import datetime
 import uuid
 import json
 from app.core.db import db
+from app.core.models.json_text import JSONText
+from app.core.serialization import RawJSON
 
 entity_type_schema = {
     "type": "object",
@@ -36,10 +38,20 @@ class EntityType(db.Model):
     )
 
     schema = db.Column(
-        db.Text(),
+        JSONText(),
         nullable=False
     )
 
+    version = db.Column(
+        db.Integer(),
+        nullable=False,
+        server_default='1'
+    )
+
+    __mapper_args__ = {
+        'version_id_col': version
+    }
+
     def __init__(self, **kwargs):
         self.id = uuid.uuid4().__str__()
         self.name = kwargs.get('name')
@@ -51,3 +63,10 @@ class EntityType(db.Model):
         data['name'] = self.name
         data['schema'] = json.loads(self.schema)
         return data
+
+    def toRawDict(self):
+        data = dict([])
+        data['id'] = self.id
+        data['name'] = self.name
+        data['schema'] = RawJSON(self.schema)
+        return data
@@ -0,0 +1,48 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+from app.core.db import db
+
+class IdempotencyKey(db.Model):
+    """ **IdempotencyKey** db model, the stored response of a keyed write """
+
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (
+        db.Index('ix_idempotency_key_expires', 'expires'),
+    )
+
+    key = db.Column(
+        db.String(length=255),
+        primary_key=True
+    )
+
+    fingerprint = db.Column(
+        db.String(length=64),
+        nullable=False
+    )
+
+    status = db.Column(
+        db.Integer(),
+        nullable=True
+    )
+
+    headers = db.Column(
+        db.Text(),
+        nullable=True
+    )
+
+    body = db.Column(
+        db.LargeBinary(),
+        nullable=True
+    )
+
+    created = db.Column(
+        db.DateTime(),
+        nullable=False
+    )
+
+    expires = db.Column(
+        db.DateTime(),
+        nullable=False
+    )
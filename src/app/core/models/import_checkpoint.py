@@ -0,0 +1,20 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+from app.core.db import db
+
+class ImportCheckpoint(db.Model):
+    """ **ImportCheckpoint** db model, the records of an import file committed so far """
+
+    __tablename__ = 'import_checkpoint'
+
+    path = db.Column(
+        db.String(length=1024),
+        primary_key=True
+    )
+
+    records = db.Column(
+        db.Integer(),
+        nullable=False
+    )
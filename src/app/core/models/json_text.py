@@ -0,0 +1,49 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    JSON document column
+    ========================
+    Stored as ``JSONB`` on PostgreSQL and as ``TEXT`` anywhere else.
+    On the python side the value is always the json text: it is cast to
+    ``JSONB`` when bound and back to text when selected, so stored documents
+    can be written to responses without being parsed.
+"""
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.types import UserDefinedType
+
+
+class JSONText(UserDefinedType):
+    """ JSON document column type, see module documentation """
+
+    def get_col_spec(self, **kw):
+        return 'TEXT'
+
+    def bind_expression(self, bindvalue):
+        return pg_cast(bindvalue, 'JSONB')
+
+    def column_expression(self, col):
+        return pg_cast(col, 'TEXT')
+
+@compiles(JSONText, 'postgresql')
+def compile_json_text_postgresql(type_, compiler, **kw):
+    return 'JSONB'
+
+
+class pg_cast(ColumnElement):
+    """ ``CAST(clause AS target)`` on PostgreSQL, ``clause`` anywhere else """
+
+    def __init__(self, clause, target):
+        self.clause = clause
+        self.target = target
+        self.type = clause.type
+
+@compiles(pg_cast)
+def compile_pg_cast(element, compiler, **kw):
+    return compiler.process(element.clause, **kw)
+
+@compiles(pg_cast, 'postgresql')
+def compile_pg_cast_postgresql(element, compiler, **kw):
+    return 'CAST({} AS {})'.format(compiler.process(element.clause, **kw), element.target)
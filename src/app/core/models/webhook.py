@@ -0,0 +1,73 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+import uuid
+from app.core.db import db
+
+WEBHOOK_EVENTS = ['create', 'update', 'delete']
+
+webhook_schema = {
+    "type": "object",
+    "properties": {
+        "url": {"type": "string", "pattern": "^https?://"},
+        "events": {
+            "type": "array",
+            "items": {"enum": WEBHOOK_EVENTS},
+            "minItems": 1,
+            "uniqueItems": True,
+        },
+        "secret": {"type": "string"},
+    },
+    "required": [ "url" ],
+}
+
+class Webhook(db.Model):
+    """ **Webhook** db model, a subscription to the entity writes of a type """
+
+    __tablename__ = 'webhook'
+    __table_args__ = (
+        db.Index('ix_webhook_entity_type_id', 'entity_type_id'),
+    )
+
+    id = db.Column(
+        db.String(length=60),
+        nullable=False,
+        primary_key=True
+    )
+
+    entity_type_id = db.Column(
+        db.String(length=60),
+        db.ForeignKey('entity_type.id'),
+        nullable=False
+    )
+
+    url = db.Column(
+        db.String(length=2048),
+        nullable=False
+    )
+
+    events = db.Column(
+        db.String(length=80),
+        nullable=False
+    )
+
+    secret = db.Column(
+        db.String(length=255),
+        nullable=True
+    )
+
+    def __init__(self, **kwargs):
+        self.id = uuid.uuid4().__str__()
+        self.entity_type_id = kwargs.get('entity_type_id')
+        self.url = kwargs.get('url')
+        self.events = ','.join(kwargs.get('events') or WEBHOOK_EVENTS)
+        self.secret = kwargs.get('secret')
+
+    def toDict(self):
+        data = dict([])
+        data['id'] = self.id
+        data['entity_type_id'] = self.entity_type_id
+        data['url'] = self.url
+        data['events'] = self.events.split(',')
+        return data
@@ -0,0 +1,91 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+import datetime
+from app.core.db import db
+
+PENDING = 'pending'
+DEAD = 'dead'
+
+class WebhookDelivery(db.Model):
+    """ **WebhookDelivery** db model, outbox row of an event to deliver """
+
+    __tablename__ = 'webhook_delivery'
+    __table_args__ = (
+        db.Index('ix_webhook_delivery_status_next_attempt', 'status', 'next_attempt'),
+        db.Index('ix_webhook_delivery_webhook_id', 'webhook_id'),
+        {'sqlite_autoincrement': True},
+    )
+
+    id = db.Column(
+        db.BigInteger().with_variant(db.Integer(), 'sqlite'),
+        primary_key=True,
+        autoincrement=True
+    )
+
+    webhook_id = db.Column(
+        db.String(length=60),
+        db.ForeignKey('webhook.id'),
+        nullable=False
+    )
+
+    event = db.Column(
+        db.String(length=10),
+        nullable=False
+    )
+
+    entity_id = db.Column(
+        db.String(length=60),
+        nullable=False
+    )
+
+    entity_type_id = db.Column(
+        db.String(length=60),
+        nullable=False
+    )
+
+    content = db.Column(
+        db.Text(),
+        nullable=True
+    )
+
+    status = db.Column(
+        db.String(length=10),
+        nullable=False,
+        default=PENDING
+    )
+
+    attempts = db.Column(
+        db.Integer(),
+        nullable=False,
+        default=0
+    )
+
+    next_attempt = db.Column(
+        db.DateTime(),
+        nullable=False,
+        default=datetime.datetime.utcnow
+    )
+
+    last_error = db.Column(
+        db.Text(),
+        nullable=True
+    )
+
+    created = db.Column(
+        db.DateTime(),
+        nullable=False,
+        default=datetime.datetime.utcnow
+    )
+
+    def toDict(self):
+        data = dict([])
+        data['id'] = self.id
+        data['event'] = self.event
+        data['entity_id'] = self.entity_id
+        data['status'] = self.status
+        data['attempts'] = self.attempts
+        data['last_error'] = self.last_error
+        data['created'] = self.created.isoformat() + 'Z'
+        return data
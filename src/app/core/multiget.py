@@ -0,0 +1,75 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Batched reads
+    ========================
+    Reads a list of entities or entity types by id in one request::
+
+        POST /api/entities:batchGet
+        {"ids": ["<id>", "<id>"]}
+
+    The distinct ids are read with ``WHERE id IN (...)``, one statement per
+    ``BCRM_BATCH_CHUNK_SIZE`` ids. The results follow the order of the
+    request, an id repeated in the request is repeated in the results and a
+    missing id gets a ``404`` result in its place::
+
+        {"results": [{"index": 0, "status": 200, "entity": {...}},
+                     {"index": 1, "status": 404, "id": "<id>", "message": "Not found"}]}
+
+    The reads bypass the lookup cache, a batch costs the same whether its
+    ids were read recently or not.
+"""
+from app.core.db import db
+from app.core.lookups import EntityTypeRecord
+from app.core.models.entity import Entity
+from app.core.models.entity_type import EntityType
+from app.core.projection import entity_query
+
+batch_get_schema = {
+    "type": "object",
+    "properties": {
+        "ids": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["ids"],
+}
+
+def read_chunks(query, column, ids, chunk_size):
+    """
+    Returns the rows of the distinct ``ids`` in a dict by id
+    """
+    ids = sorted(set(ids))
+    found = {}
+    for start in range(0, len(ids), chunk_size):
+        for row in query.filter(column.in_(ids[start:start + chunk_size])):
+            found[row.id] = row
+    return found
+
+def ordered_results(ids, found, name, to_dict):
+    results = []
+    for index, item_id in enumerate(ids):
+        row = found.get(item_id)
+        if row is None:
+            results.append({'index': index, 'status': 404, 'id': item_id, 'message': 'Not found'})
+        else:
+            results.append({'index': index, 'status': 200, name: to_dict(row)})
+    return results
+
+def batch_get_entities(ids, paths, chunk_size):
+    """
+    Returns one result per id in the request order, the entities are
+    projected on ``paths`` as in :func:`app.core.projection.entity_query`
+    """
+    query, to_dict = entity_query(paths)
+    return ordered_results(ids, read_chunks(query, Entity.id, ids, chunk_size), 'entity', to_dict)
+
+def batch_get_entity_types(ids, chunk_size):
+    """
+    Returns one result per id in the request order
+    """
+    query = db.session.query(EntityType.id, EntityType.name, EntityType.schema, EntityType.version)
+    found = read_chunks(query, EntityType.id, ids, chunk_size)
+    return ordered_results(
+        ids, found, 'entity_type', lambda row: EntityTypeRecord(*row).toRawDict()
+    )
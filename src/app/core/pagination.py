@@ -0,0 +1,63 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Keyset pagination
+    ========================
+    List endpoints seek past the last returned key instead of using OFFSET,
+    so every page costs the same no matter how deep the client reads.
+    The cursor of the next page is sent in the ``Link`` response header.
+"""
+from flask import request, url_for
+from app.core.serialization import json_response
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+class PaginationError(ValueError):
+    """ Raised when the pagination arguments are not valid """
+
+def page_args(args=None):
+    """
+    Returns ``(after, limit)`` from the query string ``args``, the request
+    query string by default
+    """
+    if args is None:
+        args = request.args
+    after = args.get('after')
+    limit = args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise PaginationError("limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+    return after, limit
+
+def seek(query, key, after, limit):
+    """
+    Returns one page of ``query`` ordered by ``key`` and the cursor
+    of the next page, ``None`` on the last page
+    """
+    if after is not None:
+        query = query.filter(key > after)
+    rows = query.order_by(key).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, getattr(rows[-1], key.key)
+
+def page_response(items, cursor):
+    """
+    Returns the page as a json list with the next page link
+    """
+    response = json_response(items)
+    if cursor is not None:
+        args = request.args.to_dict(flat=False)
+        args.update(request.view_args or {})
+        args['after'] = cursor
+        response.headers['Link'] = '<{}>; rel="next"'.format(
+            url_for(request.endpoint, **args)
+        )
+    return response
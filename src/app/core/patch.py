@@ -0,0 +1,236 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Entity content patches
+    ========================
+    ``PATCH /entities/<id>`` changes part of the entity content with
+     - a JSON Merge Patch (RFC 7396), ``application/merge-patch+json``
+     - a JSON Patch (RFC 6902), ``application/json-patch+json``
+
+    On PostgreSQL merge patches are applied by the database with ``||`` and
+    ``-``: the patched document is selected from the locked row and
+    validated, then the ``UPDATE`` applies the same expression, the stored
+    document is never sent back to the database. JSON Patches, and merge
+    patches on other databases, are applied in python to the locked row.
+"""
+import copy
+from sqlalchemy import Text, case, cast, func, literal, select, type_coerce
+from app.core.filters import json_literal
+from app.core.models.entity import Entity
+from app.core.models.json_text import JSONText
+
+MERGE_PATCH = 'application/merge-patch+json'
+JSON_PATCH = 'application/json-patch+json'
+
+class PatchError(ValueError):
+    """ Raised when a patch document is not valid """
+
+class PatchConflict(PatchError):
+    """ Raised when a patch can not be applied to the document """
+
+
+def merge_patch(target, patch):
+    """
+    Returns ``target`` with the merge patch applied, ``target`` is not
+    modified
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+def merge_patch_expression(target, patch, top=True):
+    """
+    Returns the SQL expression of the ``JSONB`` ``target`` with the merge
+    patch applied, PostgreSQL only
+    """
+    expression = target if top else case(
+        [(func.jsonb_typeof(target) == 'object', target)],
+        else_=json_literal({})
+    )
+    values = {}
+    for key, value in patch.items():
+        if value is None:
+            expression = expression.op('-')(cast(literal(key), Text))
+        elif isinstance(value, dict):
+            nested = merge_patch_expression(target.op('->')(cast(literal(key), Text)), value, False)
+            expression = expression.op('||')(
+                func.jsonb_build_object(cast(literal(key), Text), nested))
+        else:
+            values[key] = value
+    if values:
+        expression = expression.op('||')(json_literal(values))
+    return expression
+
+def merge_patch_select(entity_id, patch):
+    """
+    Returns the query locking the entity row, it selects the current type,
+    content and version and the ``patched`` content
+    """
+    entity = Entity.__table__
+    patched = type_coerce(merge_patch_expression(entity.c.content, patch), JSONText())
+    return (
+        select([
+            entity.c.entityTypeId, entity.c.content, entity.c.version,
+            patched.label('patched')
+        ])
+        .where(entity.c.id == entity_id)
+        .with_for_update()
+    )
+
+def merge_patch_statement(entity_id, version, patch):
+    """
+    Returns the ``UPDATE`` applying a merge patch to the entity content
+    when the entity is still at ``version``, it returns the new version
+    """
+    entity = Entity.__table__
+    return (
+        entity.update()
+        .where(entity.c.id == entity_id)
+        .where(entity.c.version == version)
+        .values(
+            content=merge_patch_expression(entity.c.content, patch),
+            version=entity.c.version + 1
+        )
+        .returning(entity.c.version)
+    )
+
+
+def parse_pointer(pointer):
+    if pointer == '':
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith('/'):
+        raise PatchError("invalid json pointer '{}'".format(pointer))
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+def array_index(array, token, pointer, append=False):
+    if append and token == '-':
+        return len(array)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise PatchConflict("invalid array index in '{}'".format(pointer))
+    index = int(token)
+    if index > len(array) or (index == len(array) and not append):
+        raise PatchConflict("array index out of range in '{}'".format(pointer))
+    return index
+
+def resolve(document, tokens, pointer):
+    for token in tokens:
+        if isinstance(document, dict):
+            if token not in document:
+                raise PatchConflict("path '{}' does not exist".format(pointer))
+            document = document[token]
+        elif isinstance(document, list):
+            document = document[array_index(document, token, pointer)]
+        else:
+            raise PatchConflict("path '{}' does not exist".format(pointer))
+    return document
+
+def json_equal(a, b):
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(json_equal(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(json_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, (dict, list)) or isinstance(b, (dict, list)):
+        return False
+    return a == b
+
+def add(document, tokens, value, pointer):
+    if not tokens:
+        return value
+    parent = resolve(document, tokens[:-1], pointer)
+    if isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    elif isinstance(parent, list):
+        parent.insert(array_index(parent, tokens[-1], pointer, append=True), value)
+    else:
+        raise PatchConflict("path '{}' does not exist".format(pointer))
+    return document
+
+def remove(document, tokens, pointer):
+    if not tokens:
+        raise PatchError("the whole document can not be removed")
+    parent = resolve(document, tokens[:-1], pointer)
+    if isinstance(parent, dict):
+        if tokens[-1] not in parent:
+            raise PatchConflict("path '{}' does not exist".format(pointer))
+        return parent.pop(tokens[-1])
+    if isinstance(parent, list):
+        return parent.pop(array_index(parent, tokens[-1], pointer))
+    raise PatchConflict("path '{}' does not exist".format(pointer))
+
+def check_operation(operation):
+    if not isinstance(operation, dict):
+        raise PatchError("patch operation must be a json object")
+    op = operation.get('op')
+    if op not in ('add', 'remove', 'replace', 'move', 'copy', 'test'):
+        raise PatchError("unsupported patch operation '{}'".format(op))
+    if 'path' not in operation:
+        raise PatchError("patch operation '{}' has no path".format(op))
+    if op in ('add', 'replace', 'test') and 'value' not in operation:
+        raise PatchError("patch operation '{}' has no value".format(op))
+    if op in ('move', 'copy') and 'from' not in operation:
+        raise PatchError("patch operation '{}' has no from".format(op))
+    return op
+
+def json_patch(document, operations):
+    """
+    Returns ``document`` with the JSON Patch operations applied,
+    ``document`` is not modified
+    """
+    if not isinstance(operations, list):
+        raise PatchError("json patch must be a json array")
+    document = copy.deepcopy(document)
+    for operation in operations:
+        op = check_operation(operation)
+        pointer = operation['path']
+        tokens = parse_pointer(pointer)
+        if op == 'add':
+            document = add(document, tokens, copy.deepcopy(operation['value']), pointer)
+        elif op == 'remove':
+            remove(document, tokens, pointer)
+        elif op == 'replace':
+            if tokens:
+                remove(document, tokens, pointer)
+            document = add(document, tokens, copy.deepcopy(operation['value']), pointer)
+        elif op == 'test':
+            if not json_equal(resolve(document, tokens, pointer), operation['value']):
+                raise PatchConflict("test failed at '{}'".format(pointer))
+        else:
+            source = parse_pointer(operation['from'])
+            if op == 'move':
+                if tokens[:len(source)] == source and len(tokens) > len(source):
+                    raise PatchError("'{}' can not be moved into itself".format(operation['from']))
+                value = remove(document, source, operation['from']) if source else document
+            else:
+                value = copy.deepcopy(resolve(document, source, operation['from']))
+            document = add(document, tokens, value, pointer)
+    return document
+
+def changed_keys(kind, patch):
+    """
+    Returns the top level content keys a patch may change, ``None`` when
+    it may change the whole document
+    """
+    if kind == MERGE_PATCH:
+        return set(patch.keys())
+    keys = set()
+    for operation in patch:
+        if operation['op'] == 'test':
+            continue
+        for pointer in (operation['path'], operation.get('from')):
+            if pointer is None:
+                continue
+            tokens = parse_pointer(pointer)
+            if not tokens:
+                return None
+            keys.add(tokens[0])
+    return keys
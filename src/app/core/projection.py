@@ -0,0 +1,123 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Sparse fieldsets
+    ========================
+    ``fields=content.name,content.address.city`` limits the content of the
+    returned entities to the listed paths (dot separated), ``id`` and
+    ``entity_type_id`` are always returned. Paths missing from a document
+    are left out of its projection.
+
+    On PostgreSQL the paths are selected with ``#>`` and only the projected
+    values leave the database, as json text spliced into the response.
+    Anywhere else the stored content is parsed and projected in python.
+"""
+import json
+from sqlalchemy import literal
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import Text
+from app.core.db import db
+from app.core.lookups import get_entity
+from app.core.models.entity import Entity
+from app.core.models.json_text import JSONText
+from app.core.serialization import RawJSON
+
+class ProjectionError(ValueError):
+    """ Raised when the ``fields`` argument can not be parsed """
+
+def parse_fields(args):
+    """
+    Returns the content paths selected by the ``fields`` query string
+    argument, ``None`` when the whole content is selected
+    """
+    value = args.get('fields')
+    if value is None:
+        return None
+    paths = []
+    for name in value.split(','):
+        name = name.strip()
+        if name in ('id', 'entity_type_id'):
+            continue
+        if name == 'content':
+            return None
+        path = name.split('.')[1:]
+        if not name.startswith('content.') or not all(path):
+            raise ProjectionError("invalid field '{}'".format(name))
+        paths.append(path)
+
+    # a selected object already holds the paths below it
+    selected = []
+    for path in sorted(paths, key=len):
+        if not any(path[:len(prefix)] == prefix for prefix in selected):
+            selected.append(path)
+    return selected
+
+def place(target, path, value):
+    for key in path[:-1]:
+        target = target.setdefault(key, {})
+    target[path[-1]] = value
+
+def project(document, paths):
+    """
+    Returns the projection of a parsed content document on ``paths``
+    """
+    projected = {}
+    for path in paths:
+        value = document
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            place(projected, path, value)
+    return projected
+
+def pushdown():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+def content_path(path):
+    return Entity.content.op('#>', return_type=JSONText())(literal(path, ARRAY(Text)))
+
+def projected_dict(row, paths):
+    content = {}
+    for path, value in zip(paths, row[3:]):
+        if value is not None:
+            place(content, path, RawJSON(value))
+    return {'id': row.id, 'entity_type_id': row.entityTypeId, 'content': content}
+
+def python_dict(entity, paths):
+    return {
+        'id': entity.id,
+        'entity_type_id': entity.entityTypeId,
+        'content': project(json.loads(entity.content), paths),
+    }
+
+def entity_query(paths):
+    """
+    Returns an entity query selecting ``paths`` and the function turning
+    its rows into response dicts
+    """
+    if paths is None:
+        return Entity.query, Entity.toRawDict
+    if pushdown():
+        query = db.session.query(
+            Entity.id, Entity.entityTypeId, Entity.version,
+            *[content_path(path).label('field_{}'.format(index))
+              for index, path in enumerate(paths)]
+        )
+        return query, lambda row: projected_dict(row, paths)
+    return Entity.query, lambda entity: python_dict(entity, paths)
+
+def get_projected_entity(entity_id, paths):
+    """
+    Returns ``(version, dict)`` of the entity projected on ``paths``,
+    ``None`` if not found
+    """
+    if pushdown():
+        query, to_dict = entity_query(paths)
+        row = query.filter(Entity.id == entity_id).first()
+        return None if row is None else (row.version, to_dict(row))
+    entity = get_entity(entity_id)
+    return None if entity is None else (entity.version, python_dict(entity, paths))
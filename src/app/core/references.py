@@ -0,0 +1,238 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Entity references
+    ========================
+    A property holding the id of another entity, or an array of ids, is
+    declared a reference with ``"x-bcrm-ref": true``, nested object
+    properties under their dotted path::
+
+        {"properties": {"company": {"type": "string", "x-bcrm-ref": true},
+                        "deals": {"type": "array", "x-bcrm-ref": true}}}
+
+    The ids are kept in the ``entity_ref`` table, by referring entity for
+    includes and by referenced id for reverse lookups. References are not
+    checked, an id may point to an entity that does not exist (any more).
+    Strings longer than an entity id can not be the id of an entity, they
+    are not kept.
+
+    Reads of entities expand reference fields with ``include``, the
+    referenced entities are read with one ``IN`` query per chunk of ids for
+    the whole page::
+
+        GET /api/entities/<id>?include=company,deals
+
+        {"id": ..., "content": {...},
+         "included": {"company": {"id": ..., "content": {...}},
+                      "deals": [{"id": ..., "content": {...}}]}}
+
+    A reference field without a found entity is included as ``null``, an
+    array field lists the found entities in the order of its ids. The
+    entities referring to one entity are listed with::
+
+        GET /api/entities/<id>/referrers?field=company&entity_type_id=<id>
+"""
+import json
+from functools import lru_cache
+from sqlalchemy import and_
+from app.core.db import db
+from app.core.hooks import write_hook
+from app.core.indexing import type_schemas
+from app.core.lookups import EntityRecord
+from app.core.models.entity import Entity
+from app.core.models.entity_ref import EntityRef
+from app.core.multiget import read_chunks
+
+REF_KEYWORD = 'x-bcrm-ref'
+MAX_INCLUDES = 10
+REINDEX_BATCH_SIZE = 1000
+MAX_ID_LENGTH = EntityRef.target_id.type.length
+
+class IncludeError(ValueError):
+    """ Raised when the ``include`` argument can not be parsed """
+
+@lru_cache(maxsize=256)
+def ref_fields(schema):
+    """
+    Returns the tuple of ``(field, many)`` reference fields declared by a
+    schema text, ``many`` is true for arrays of ids
+    """
+    def walk(node, prefix):
+        fields = []
+        properties = node.get('properties') if isinstance(node, dict) else None
+        if not isinstance(properties, dict):
+            return fields
+        for name, subschema in sorted(properties.items()):
+            if not isinstance(subschema, dict):
+                continue
+            if subschema.get(REF_KEYWORD) is True:
+                fields.append((prefix + name, subschema.get('type') == 'array'))
+            fields.extend(walk(subschema, prefix + name + '.'))
+        return fields
+    return tuple(walk(json.loads(schema), ''))
+
+def referenced_ids(document, field):
+    value = document
+    for key in field.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return []
+        value = value[key]
+    values = value if isinstance(value, list) else [value]
+    return [
+        value for value in values if isinstance(value, str) and len(value) <= MAX_ID_LENGTH
+    ]
+
+def ref_rows(entity_type_id, fields, entity_id, document):
+    rows = []
+    for field, _ in fields:
+        for position, target_id in enumerate(referenced_ids(document, field)):
+            rows.append({
+                'entity_id': entity_id,
+                'field': field,
+                'position': position,
+                'target_id': target_id,
+                'entity_type_id': entity_type_id,
+            })
+    return rows
+
+@write_hook
+def maintain_refs(op, rows):
+    if op != 'create':
+        db.session.execute(EntityRef.__table__.delete().where(
+            EntityRef.entity_id.in_([row['id'] for row in rows])
+        ))
+    if op == 'delete':
+        return
+
+    schemas = type_schemas(set(row['entityTypeId'] for row in rows))
+    refs = []
+    for row in rows:
+        fields = ref_fields(schemas[row['entityTypeId']])
+        if fields:
+            document = row.get('document')
+            if document is None:
+                document = json.loads(row['content'])
+            refs.extend(ref_rows(row['entityTypeId'], fields, row['id'], document))
+    if refs:
+        db.session.execute(EntityRef.__table__.insert(), refs)
+
+def reindex_refs(entity_type, previous_schema):
+    """
+    Brings the references of the entity type in line with its schema after
+    the schema changed, must run inside the caller transaction
+    """
+    fields = set(ref_fields(entity_type.schema))
+    previous = set(ref_fields(previous_schema))
+    if fields == previous:
+        return
+
+    dropped = previous - fields
+    if dropped:
+        db.session.execute(EntityRef.__table__.delete().where(and_(
+            EntityRef.entity_type_id == entity_type.id,
+            EntityRef.field.in_([field for field, _ in dropped])
+        )))
+
+    added = sorted(fields - previous)
+    if not added:
+        return
+    entities = (
+        db.session.query(Entity.id, Entity.content)
+        .filter(Entity.entityTypeId == entity_type.id)
+        .yield_per(REINDEX_BATCH_SIZE)
+    )
+    refs = []
+    for entity_id, content in entities:
+        refs.extend(ref_rows(entity_type.id, added, entity_id, json.loads(content)))
+        if len(refs) >= REINDEX_BATCH_SIZE:
+            db.session.execute(EntityRef.__table__.insert(), refs)
+            refs = []
+    if refs:
+        db.session.execute(EntityRef.__table__.insert(), refs)
+
+def parse_includes(args):
+    """
+    Returns the reference fields listed by the ``include`` query string
+    argument, ``None`` when nothing is included
+    """
+    value = args.get('include')
+    if value is None:
+        return None
+    names = []
+    for name in value.split(','):
+        name = name.strip()
+        if not name or not all(name.split('.')):
+            raise IncludeError("invalid include '{}'".format(name))
+        if name not in names:
+            names.append(name)
+    if len(names) > MAX_INCLUDES:
+        raise IncludeError("include is limited to {} fields".format(MAX_INCLUDES))
+    return names
+
+def read_edges(entity_ids, names, chunk_size):
+    """
+    Returns the referenced ids of the ``names`` fields of the entities in a
+    dict by ``(entity_id, field)``, in position order
+    """
+    entity_ids = sorted(set(entity_ids))
+    edges = {}
+    for start in range(0, len(entity_ids), chunk_size):
+        rows = (
+            db.session.query(EntityRef.entity_id, EntityRef.field, EntityRef.target_id)
+            .filter(EntityRef.entity_id.in_(entity_ids[start:start + chunk_size]))
+            .filter(EntityRef.field.in_(names))
+            .order_by(EntityRef.entity_id, EntityRef.field, EntityRef.position)
+        )
+        for entity_id, field, target_id in rows:
+            edges.setdefault((entity_id, field), []).append(target_id)
+    return edges
+
+def include_references(items, names, chunk_size):
+    """
+    Adds the ``included`` entities of the ``names`` reference fields to the
+    entity response dicts ``items``
+    """
+    if not items:
+        return items
+    schemas = type_schemas(set(item['entity_type_id'] for item in items))
+    edges = read_edges([item['id'] for item in items], names, chunk_size)
+    targets = read_chunks(
+        db.session.query(Entity.id, Entity.entityTypeId, Entity.content, Entity.version),
+        Entity.id,
+        [target_id for target_ids in edges.values() for target_id in target_ids],
+        chunk_size
+    )
+
+    for item in items:
+        fields = dict(ref_fields(schemas[item['entity_type_id']]))
+        included = {}
+        for name in names:
+            if name not in fields:
+                continue
+            found = [
+                EntityRecord(*targets[target_id]).toRawDict()
+                for target_id in edges.get((item['id'], name), ())
+                if target_id in targets
+            ]
+            if fields[name]:
+                included[name] = found
+            else:
+                included[name] = found[0] if found else None
+        item['included'] = included
+    return items
+
+def referrers_clause(entity_id, args):
+    """
+    Returns the clause selecting the entities referring to ``entity_id``,
+    through the ``field`` reference field only when it is given
+    """
+    refs = db.session.query(EntityRef.entity_id).filter(EntityRef.target_id == entity_id)
+    field = args.get('field')
+    if field is not None:
+        refs = refs.filter(EntityRef.field == field)
+    entity_type_id = args.get('entity_type_id')
+    if entity_type_id is not None:
+        refs = refs.filter(EntityRef.entity_type_id == entity_type_id)
+    return Entity.id.in_(refs)
@@ -0,0 +1,241 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Read replicas
+    ========================
+    Entity reads can be served by PostgreSQL streaming replicas, listed
+    comma separated in ``BCRM_DB_REPLICAS``. Every replica is the
+    SQLAlchemy bind ``replica_<n>`` with the pool settings of the primary.
+
+    The handlers decorated with :func:`replica_read` run their reads
+    outside of a transaction on the next healthy replica, round robin.
+    Writes and everything inside ``db.session.begin()`` stay on the
+    primary, and so does a request when no replica is healthy.
+
+    A replica is checked by the first request after
+    ``BCRM_DB_REPLICA_CHECK_INTERVAL`` seconds, it is left out while it
+    can not be reached or while its replay lags more than
+    ``BCRM_DB_REPLICA_MAX_LAG`` seconds. The check connects on its own,
+    outside of the pool, and gives up after
+    ``BCRM_DB_REPLICA_CHECK_TIMEOUT`` seconds, an unreachable host does not
+    hold the checking request for the TCP timeout. A read losing its replica
+    connection takes the replica out and runs again on the primary.
+
+    Read your writes: a response to a request that committed a write
+    carries the time of the write in the ``bcrm_last_write`` cookie and the
+    ``X-BCRM-Last-Write`` header. A request sending either of them back
+    reads from the primary until the replicas have replayed the write, for
+    the maximum lag plus the check interval.
+
+    Lookups read on a replica do not fill the cache, the key of a write is
+    dropped when it commits on the primary and a lagging replica could put
+    the previous row back for the whole TTL.
+"""
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from app.core.db import READ_BIND, db
+
+logger = logging.getLogger(__name__)
+
+LAST_WRITE_COOKIE = 'bcrm_last_write'
+LAST_WRITE_HEADER = 'X-BCRM-Last-Write'
+WROTE = 'bcrm_wrote'
+
+# a replica that replayed everything it received is not lagging, however
+# old its last replayed transaction is
+POSTGRESQL_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+class Replica(object):
+    """ Health of one replica bind """
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.healthy = False
+        self.checked = None
+        self.lock = threading.Lock()
+
+class ReplicaSet(object):
+    """ Round robin over the healthy replicas """
+
+    def __init__(self, binds, max_lag=5, interval=5, timeout=2):
+        self.replicas = [Replica(bind) for bind in binds]
+        self.max_lag = max_lag
+        self.interval = interval
+        self.timeout = timeout
+        self.engines = {}
+        self._next = itertools.count()
+
+    def check_engine(self, bind):
+        """
+        Returns the engine checking ``bind``, a new connection for every
+        check bounded by the check timeout
+        """
+        engine = self.engines.get(bind)
+        if engine is None:
+            url = make_url(current_app.config['SQLALCHEMY_BINDS'][bind])
+            if url.drivername.startswith('postgresql'):
+                # libpq takes whole seconds
+                connect_args = {'connect_timeout': max(1, int(math.ceil(self.timeout)))}
+            elif url.drivername.startswith('sqlite'):
+                connect_args = {'timeout': self.timeout}
+            else:
+                connect_args = {}
+            engine = self.engines.setdefault(
+                bind, create_engine(url, poolclass=NullPool, connect_args=connect_args))
+        return engine
+
+    def lag(self, bind):
+        engine = self.check_engine(bind)
+        with engine.begin() as connection:
+            if engine.dialect.name == 'postgresql':
+                connection.execute(text('SET LOCAL statement_timeout = {:d}'.format(
+                    int(self.timeout * 1000))))
+                return float(connection.execute(POSTGRESQL_LAG).scalar() or 0)
+            connection.execute(text('SELECT 1'))
+            return 0
+
+    def check(self, replica):
+        if replica.checked is not None and time.monotonic() - replica.checked < self.interval:
+            return
+        # one request checks a replica, the others go on with its last state
+        if not replica.lock.acquire(False):
+            return
+        try:
+            try:
+                lag = self.lag(replica.bind)
+            except exc.DBAPIError:
+                logger.warning('replica %s is not reachable', replica.bind, exc_info=True)
+                replica.healthy = False
+            else:
+                replica.healthy = lag <= self.max_lag
+                if not replica.healthy:
+                    logger.warning('replica %s lags %.1f seconds', replica.bind, lag)
+            replica.checked = time.monotonic()
+        finally:
+            replica.lock.release()
+
+    def pick(self):
+        """
+        Returns the bind key of the next healthy replica, ``None`` if there
+        is none
+        """
+        for replica in self.replicas:
+            self.check(replica)
+        healthy = [replica.bind for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def fail(self, bind):
+        for replica in self.replicas:
+            if replica.bind == bind:
+                replica.healthy = False
+                replica.checked = time.monotonic()
+
+    @property
+    def window(self):
+        """ Seconds after a write during which its writer reads from the primary """
+        return self.max_lag + self.interval
+
+def replica_set():
+    return current_app.extensions['bcrm_replicas']
+
+def last_write():
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def reads_own_write(replicas):
+    written = last_write()
+    return written is not None and time.time() - written < replicas.window
+
+def replica_read(func):
+    """
+    Runs the reads of the handler on a replica unless the client wrote
+    recently
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        replicas = replica_set()
+        if not replicas.replicas or reads_own_write(replicas):
+            return func(*args, **kwargs)
+        bind = replicas.pick()
+        if bind is None:
+            return func(*args, **kwargs)
+
+        # kept for the whole request, streamed responses read after the handler returned
+        setattr(g, READ_BIND, bind)
+        try:
+            return func(*args, **kwargs)
+        except exc.DBAPIError as e:
+            if not e.connection_invalidated:
+                raise
+            logger.warning('replica %s failed, reading from the primary', bind, exc_info=True)
+            replicas.fail(bind)
+            g.pop(READ_BIND, None)
+            db.session.expunge_all()
+            return func(*args, **kwargs)
+    return wrapper
+
+@event.listens_for(Session, 'after_commit')
+def remember_write(session):
+    if has_request_context():
+        setattr(g, WROTE, True)
+
+def mark_write(response):
+    replicas = replica_set()
+    if replicas.replicas and g.get(WROTE):
+        written = '{:.3f}'.format(time.time())
+        response.headers[LAST_WRITE_HEADER] = written
+        response.set_cookie(
+            LAST_WRITE_COOKIE, written, max_age=int(replicas.window) + 1, httponly=True
+        )
+    return response
+
+def forget_request(error=None):
+    g.pop(READ_BIND, None)
+    g.pop(WROTE, None)
+
+def init_replicas(app):
+    """
+    Configures the replica binds from the environment
+    """
+    urls = [url.strip() for url in (os.environ.get('BCRM_DB_REPLICAS') or '').split(',')]
+    binds = dict(
+        ('replica_{}'.format(index), url) for index, url in enumerate(url for url in urls if url)
+    )
+    if binds:
+        app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **binds)
+    app.config['BCRM_DB_REPLICAS'] = sorted(binds)
+    app.config['BCRM_DB_REPLICA_MAX_LAG'] = float(
+        os.environ.get('BCRM_DB_REPLICA_MAX_LAG') or 5)
+    app.config['BCRM_DB_REPLICA_CHECK_INTERVAL'] = float(
+        os.environ.get('BCRM_DB_REPLICA_CHECK_INTERVAL') or 5)
+    app.config['BCRM_DB_REPLICA_CHECK_TIMEOUT'] = float(
+        os.environ.get('BCRM_DB_REPLICA_CHECK_TIMEOUT') or 2)
+    app.extensions['bcrm_replicas'] = ReplicaSet(
+        app.config['BCRM_DB_REPLICAS'],
+        app.config['BCRM_DB_REPLICA_MAX_LAG'],
+        app.config['BCRM_DB_REPLICA_CHECK_INTERVAL'],
+        app.config['BCRM_DB_REPLICA_CHECK_TIMEOUT']
+    )
+    app.after_request(mark_write)
+    app.teardown_request(forget_request)
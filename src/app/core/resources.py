@@ -1,24 +1,93 @@
 import uuid
 import json
-from flask import Blueprint, jsonify, request, make_response
-from jsonschema import validate, ValidationError
+from flask import Blueprint, Response, current_app, jsonify, request, make_response, \
+    stream_with_context, url_for
+from jsonschema import ValidationError, validate
+from sqlalchemy import exists
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from app.decorators.rest import validate_payload_is_json, validate_payload_with_schema
 from app.core.models.entity import Entity, entity_schema
+from app.core.models.entity_index import EntityIndex
 from app.core.models.entity_type import EntityType, entity_type_schema
+from app.core.models.webhook import Webhook, webhook_schema
+from app.core.models.webhook_delivery import WebhookDelivery, DEAD, PENDING
+from app.core.validation import validators, validate_content, validate_changes
+from app.core.pagination import PaginationError, page_args, seek, page_response
+from app.core.batch import BatchError, parse_items, prepare_rows, insert_rows, not_created
+from app.core.export import export_ndjson
+from app.core.changes import EVENT_STREAM, ChangeFeedError, change_args, poll_changes, \
+    event_stream
+from app.core.filters import FilterError, apply_filters, parse_filters
+from app.core.bulk import InvalidEntity, bulk_delete_schema, bulk_update_schema, selection, \
+    delete_entities, delete_rows, type_selection, update_entities
+from app.core.hooks import entities_written, entity_row
+from app.core.indexing import reindex_entity_type
+from app.core.webhooks import delete_webhooks, retry_dead
+from app.core.search import SearchError, reindex_search, search_entities
+from app.core.aggregation import AggregationError, aggregate, reindex_rollups
+from app.core.multiget import batch_get_schema, batch_get_entities, batch_get_entity_types
+from app.core.references import IncludeError, include_references, parse_includes, reindex_refs, \
+    referrers_clause
+from app.core.models.entity_rollup import EntityRollup
+from app.core.lookups import EntityRecord, get_entity, get_entity_type, invalidate_entity_type
+from app.core.idempotency import idempotent
+from app.core.replicas import replica_read
+from app.core.conditional import not_modified, not_modified_response, precondition_failed, \
+    precondition_failed_response, with_etag
+from app.core.serialization import json_response
+from app.core.projection import ProjectionError, parse_fields, entity_query, \
+    get_projected_entity, pushdown
+from app.core.patch import MERGE_PATCH, JSON_PATCH, PatchConflict, PatchError, merge_patch, \
+    json_patch, changed_keys, merge_patch_select, merge_patch_statement
+from app.instrumentation import phase
 
 from app.core.db import db
 
 core_api = Blueprint('core_api', __name__, url_prefix='/api')
+@core_api.route('/entity-types', methods=['GET'])
+def list_entity_types():
+    try:
+        after, limit = page_args()
+    except PaginationError as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+
+    entity_types, cursor = seek(EntityType.query, EntityType.id, after, limit)
+    return page_response([entity_type.toRawDict() for entity_type in entity_types], cursor)
+
 @core_api.route('/entity-types/<string:entity_type_id>', methods=['GET'])
 def get_entity_type_by_id(entity_type_id):
-    entity_type = EntityType.query.get(entity_type_id)
+    entity_type = get_entity_type(entity_type_id)
     if not entity_type:
         return make_response(jsonify({'message': 'Not found'}), 404)
+    if not_modified(entity_type.version):
+        return not_modified_response(entity_type.version)
+
+    return with_etag(json_response(entity_type.toRawDict()), entity_type.version)
 
-    return jsonify(entity_type.toDict())
+def too_many_batch_ids(ids):
+    max_ids = current_app.config['BCRM_BATCH_GET_MAX_IDS']
+    if len(ids) <= max_ids:
+        return None
+    return make_response(
+        jsonify({'message': "batchGet is limited to {} ids".format(max_ids)}),
+        413
+    )
+
+@core_api.route('/entity-types:batchGet', methods=['POST'])
+@validate_payload_is_json
+@validate_payload_with_schema(batch_get_schema)
+def batch_get_entity_types_by_id():
+    ids = request.json['ids']
+    limited = too_many_batch_ids(ids)
+    if limited is not None:
+        return limited
+
+    results = batch_get_entity_types(ids, current_app.config['BCRM_BATCH_CHUNK_SIZE'])
+    return json_response({'results': results})
 
 @core_api.route('/entity-types', methods=['POST'])
+@idempotent
 @validate_payload_is_json
 @validate_payload_with_schema(entity_type_schema)
 def create_entity_type():
@@ -39,49 +108,308 @@ def create_entity_type():
             jsonify({'message': "Entity Type '{}' is not unique".format(entity_type.name)}),
             409
         )
-    return jsonify(entity_type.toDict()), 201
+    return with_etag(json_response(entity_type.toRawDict()), entity_type.version), 201
 
 @core_api.route('/entity-types/<string:entity_type_id>', methods=['PUT'])
+@idempotent
 @validate_payload_is_json
 @validate_payload_with_schema(entity_type_schema)
 def update_entity_type(entity_type_id):
     entity_type = EntityType.query.get(entity_type_id)
     if not entity_type:
         return make_response(jsonify({'message': 'Not found'}), 404)
+    if precondition_failed(entity_type.version):
+        return precondition_failed_response()
 
+    previous_schema = entity_type.schema
     db.session.begin()
     entity_type.name = request.json['name']
     entity_type.schema = json.dumps(request.json['schema'])
-    db.session.commit()
-    return jsonify(entity_type.toDict())
+    try:
+        db.session.flush()
+        reindex_entity_type(entity_type, previous_schema)
+        reindex_search(entity_type, previous_schema)
+        reindex_rollups(entity_type, previous_schema)
+        reindex_refs(entity_type, previous_schema)
+        invalidate_entity_type(entity_type.id)
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed_response()
+    validators.invalidate(entity_type.id)
+    return with_etag(json_response(entity_type.toRawDict()), entity_type.version)
 
 @core_api.route('/entity-types/<string:entity_type_id>', methods=['DELETE'])
 def delete_entity_type(entity_type_id):
     entity_type = EntityType.query.get(entity_type_id)
     if not entity_type:
         return make_response(jsonify({'message': 'Not found'}), 404)
+    if precondition_failed(entity_type.version):
+        return precondition_failed_response()
+
+    cascade = request.args.get('cascade') == 'true'
+    if cascade:
+        if any(name == 'content' or name.startswith('content.') for name in request.args):
+            return make_response(
+                jsonify({'message': "cascade deletes every entity of the type, "
+                                    "content filters are not allowed"}),
+                400
+            )
+        # the chunks commit one by one, deleting again resumes a failed cascade
+        delete_entities(
+            type_selection(entity_type.id), None, current_app.config['BCRM_BATCH_CHUNK_SIZE']
+        )
 
     db.session.begin()
+    if cascade:
+        # entities written while the chunks were deleted
+        delete_rows(type_selection(entity_type.id).with_for_update().all())
+    elif db.session.query(exists().where(Entity.entityTypeId == entity_type.id)).scalar():
+        db.session.rollback()
+        return make_response(
+            jsonify({'message': "Entity type has entities, delete them first or use cascade=true"}),
+            409
+        )
+    invalidate_entity_type(entity_type.id)
+    db.session.execute(
+        EntityIndex.__table__.delete().where(EntityIndex.entity_type_id == entity_type.id)
+    )
+    delete_webhooks(Webhook.entity_type_id == entity_type.id)
+    db.session.execute(
+        EntityRollup.__table__.delete().where(EntityRollup.entity_type_id == entity_type.id)
+    )
     db.session.delete(entity_type)
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed_response()
+    validators.invalidate(entity_type_id)
+    return jsonify({'acknowledge': True})
+
+@core_api.route('/entity-types/<string:entity_type_id>/webhooks', methods=['GET'])
+def list_webhooks(entity_type_id):
+    if not get_entity_type(entity_type_id):
+        return make_response(jsonify({'message': 'Not found'}), 404)
+    webhooks = Webhook.query.filter(Webhook.entity_type_id == entity_type_id) \
+        .order_by(Webhook.id)
+    return json_response([webhook.toDict() for webhook in webhooks])
+
+@core_api.route('/entity-types/<string:entity_type_id>/webhooks', methods=['POST'])
+@idempotent
+@validate_payload_is_json
+@validate_payload_with_schema(webhook_schema)
+def create_webhook(entity_type_id):
+    if not get_entity_type(entity_type_id):
+        return make_response(jsonify({'message': 'Not found'}), 404)
+
+    webhook = Webhook(
+        entity_type_id=entity_type_id,
+        url=request.json['url'],
+        events=request.json.get('events'),
+        secret=request.json.get('secret')
+    )
+
+    db.session.begin()
+    db.session.add(webhook)
+    db.session.commit()
+    return json_response(webhook.toDict()), 201
+
+def find_webhook(entity_type_id, webhook_id):
+    return Webhook.query.filter(
+        Webhook.entity_type_id == entity_type_id,
+        Webhook.id == webhook_id
+    ).first()
+
+@core_api.route('/entity-types/<string:entity_type_id>/webhooks/<string:webhook_id>',
+                methods=['DELETE'])
+def delete_webhook(entity_type_id, webhook_id):
+    if not find_webhook(entity_type_id, webhook_id):
+        return make_response(jsonify({'message': 'Not found'}), 404)
+
+    db.session.begin()
+    delete_webhooks(Webhook.id == webhook_id)
     db.session.commit()
     return jsonify({'acknowledge': True})
 
+@core_api.route('/entity-types/<string:entity_type_id>/webhooks/<string:webhook_id>/deliveries',
+                methods=['GET'])
+def list_webhook_deliveries(entity_type_id, webhook_id):
+    status = request.args.get('status', DEAD)
+    if status not in (DEAD, PENDING):
+        return make_response(
+            jsonify({'message': "status must be '{}' or '{}'".format(DEAD, PENDING)}),
+            400
+        )
+    try:
+        after, limit = page_args()
+    except PaginationError as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+    if after is not None and not after.isdigit():
+        return make_response(jsonify({'message': "after must be an integer"}), 400)
+    if not find_webhook(entity_type_id, webhook_id):
+        return make_response(jsonify({'message': 'Not found'}), 404)
+
+    query = WebhookDelivery.query.filter(
+        WebhookDelivery.webhook_id == webhook_id,
+        WebhookDelivery.status == status
+    )
+    deliveries, cursor = seek(query, WebhookDelivery.id, after and int(after), limit)
+    return page_response([delivery.toDict() for delivery in deliveries], cursor)
+
+@core_api.route(
+    '/entity-types/<string:entity_type_id>/webhooks/<string:webhook_id>/deliveries:retry',
+    methods=['POST'])
+def retry_webhook_deliveries(entity_type_id, webhook_id):
+    if not find_webhook(entity_type_id, webhook_id):
+        return make_response(jsonify({'message': 'Not found'}), 404)
+    return jsonify({'retried': retry_dead(webhook_id)})
+
+def entity_page(query, to_dict, after, limit, names):
+    entities, cursor = seek(query, Entity.id, after, limit)
+    items = [to_dict(entity) for entity in entities]
+    if names is not None:
+        include_references(items, names, current_app.config['BCRM_BATCH_CHUNK_SIZE'])
+    return page_response(items, cursor)
+
+@core_api.route('/entities', methods=['GET'])
+@replica_read
+def list_entities():
+    try:
+        after, limit = page_args()
+        paths = parse_fields(request.args)
+        names = parse_includes(request.args)
+    except (PaginationError, ProjectionError, IncludeError) as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+
+    query, to_dict = entity_query(paths)
+    entity_type_id = request.args.get('entity_type_id')
+    if entity_type_id is not None:
+        query = query.filter(Entity.entityTypeId == entity_type_id)
+    try:
+        query = apply_filters(query, request.args, entity_type_id)
+    except FilterError as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+
+    return entity_page(query, to_dict, after, limit, names)
+
+@core_api.route('/entities/<string:entity_id>/referrers', methods=['GET'])
+@replica_read
+def list_referrers(entity_id):
+    try:
+        after, limit = page_args()
+        paths = parse_fields(request.args)
+        names = parse_includes(request.args)
+    except (PaginationError, ProjectionError, IncludeError) as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+
+    query, to_dict = entity_query(paths)
+    query = query.filter(referrers_clause(entity_id, request.args))
+    return entity_page(query, to_dict, after, limit, names)
+
+@core_api.route('/search', methods=['GET'])
+@replica_read
+def search():
+    try:
+        after, limit = page_args()
+    except PaginationError as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+
+    try:
+        entities, cursor = search_entities(
+            request.args.get('q'), request.args.get('entity_type_id'), after, limit)
+    except SearchError as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+    return page_response([entity.toRawDict() for entity in entities], cursor)
+
+@core_api.route('/entities:aggregate', methods=['GET'])
+@replica_read
+def aggregate_entities():
+    entity_type_id = request.args.get('entity_type_id')
+    if entity_type_id is None:
+        return make_response(jsonify({'message': "entity_type_id is required"}), 400)
+    entity_type = get_entity_type(entity_type_id)
+    if not entity_type:
+        return make_response(jsonify({'message': 'Not found'}), 404)
+
+    try:
+        results = aggregate(entity_type, request.args)
+    except (AggregationError, FilterError) as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+    return json_response(results)
+
+@core_api.route('/entities:export', methods=['GET'])
+@replica_read
+def export_entities():
+    entity_type_id = request.args.get('entity_type_id')
+    return Response(
+        stream_with_context(export_ndjson(entity_type_id)),
+        mimetype='application/x-ndjson'
+    )
 
 @core_api.route('/entities/<string:entity_id>', methods=['GET'])
+@replica_read
 def get_entity_by_id(entity_id):
-    entity = Entity.query.get(entity_id)
+    try:
+        paths = parse_fields(request.args)
+        names = parse_includes(request.args)
+    except (ProjectionError, IncludeError) as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+    if names is not None:
+        # the included entities are not covered by the entity version
+        query, to_dict = entity_query(paths)
+        entity = query.filter(Entity.id == entity_id).first()
+        if not entity:
+            return make_response(jsonify({'message': 'Not found'}), 404)
+        items = include_references(
+            [to_dict(entity)], names, current_app.config['BCRM_BATCH_CHUNK_SIZE'])
+        return json_response(items[0])
+    if paths is not None:
+        projected = get_projected_entity(entity_id, paths)
+        if not projected:
+            return make_response(jsonify({'message': 'Not found'}), 404)
+        version, data = projected
+        if not_modified(version):
+            return not_modified_response(version)
+        return with_etag(json_response(data), version)
+
+    entity = get_entity(entity_id)
     if not entity:
         return make_response(jsonify({'message': 'Not found'}), 404)
+    if not_modified(entity.version):
+        return not_modified_response(entity.version)
+
+    return with_etag(json_response(entity.toRawDict()), entity.version)
+
+@core_api.route('/entities:batchGet', methods=['POST'])
+@validate_payload_is_json
+@validate_payload_with_schema(batch_get_schema)
+def batch_get_entities_by_id():
+    try:
+        paths = parse_fields(request.args)
+        names = parse_includes(request.args)
+    except (ProjectionError, IncludeError) as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+    ids = request.json['ids']
+    limited = too_many_batch_ids(ids)
+    if limited is not None:
+        return limited
 
-    return jsonify(entity.toDict())
+    chunk_size = current_app.config['BCRM_BATCH_CHUNK_SIZE']
+    results = batch_get_entities(ids, paths, chunk_size)
+    if names is not None:
+        include_references(
+            [result['entity'] for result in results if 'entity' in result], names, chunk_size)
+    return json_response({'results': results})
 
 @core_api.route('/entities', methods=['POST'])
+@idempotent
 @validate_payload_is_json
 @validate_payload_with_schema(entity_schema)
 def create_entity():
     entity_type_id = request.json['entity_type_id']
     content = request.json['content']
-    entity_type = EntityType.query.get(entity_type_id)
+    entity_type = get_entity_type(entity_type_id)
     if not entity_type:
         return make_response(
             jsonify({'message': "Entity type id '{}' does not exist".format(entity_type_id)}),
@@ -89,7 +417,7 @@ def create_entity():
         )
 
     try:
-        validate(instance=content, schema=entity_type.toDict()['schema'])
+        validate_content(entity_type, content)
     except ValidationError:
         return make_response(
             jsonify({'message': "Entity content does not match type schema"}),
@@ -103,33 +431,142 @@ def create_entity():
 
     db.session.begin()
     db.session.add(entity)
-    
+    db.session.flush()
+    entities_written('create', [entity_row(entity, document=content)])
+    db.session.commit()
+    return with_etag(json_response(entity.toRawDict()), entity.version), 201
+
+@core_api.route('/entities:batch', methods=['POST'])
+@idempotent
+def create_entities_batch():
+    mode = request.args.get('mode', 'atomic')
+    if mode not in ('atomic', 'partial'):
+        return make_response(jsonify({'message': "mode must be 'atomic' or 'partial'"}), 400)
+
+    try:
+        items = parse_items(request)
+    except BatchError as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+
+    max_items = current_app.config['BCRM_BATCH_MAX_ITEMS']
+    if len(items) > max_items:
+        return make_response(
+            jsonify({'message': "batch is limited to {} entities".format(max_items)}),
+            413
+        )
+
+    rows, results = prepare_rows(items)
+    if mode == 'atomic' and len(rows) != len(items):
+        return make_response(
+            jsonify({'message': 'Batch contains invalid entities',
+                     'results': not_created(results)}),
+            400
+        )
+
+    db.session.begin()
+    insert_rows(rows, current_app.config['BCRM_BATCH_CHUNK_SIZE'])
+    entities_written('create', rows)
     db.session.commit()
-    return jsonify(entity.toDict()), 201
+
+    status = 201 if len(rows) == len(items) else 207
+    return jsonify({'created': len(rows), 'results': results}), status
+
+def bulk_ids(schema):
+    """
+    Returns the ``(payload, ids)`` of a bulk request, ``ids`` is ``None``
+    when the entities are selected by filters only
+    """
+    payload = request.get_json(silent=True)
+    if payload is None and not request.get_data():
+        payload = {}
+    if payload is None:
+        raise ValidationError("payload is not json")
+    validate(instance=payload, schema=schema)
+    ids = payload.get('ids')
+    if ids is None and 'entity_type_id' not in request.args and not parse_filters(request.args):
+        raise ValidationError("bulk operations need ids, entity_type_id or a content filter")
+    return payload, ids
+
+def too_many_ids(ids):
+    max_items = current_app.config['BCRM_BATCH_MAX_ITEMS']
+    if ids is None or len(ids) <= max_items:
+        return None
+    return make_response(
+        jsonify({'message': "bulk operations are limited to {} ids".format(max_items)}),
+        413
+    )
+
+@core_api.route('/entities:bulkDelete', methods=['POST'])
+@idempotent(chunked=True)
+def bulk_delete_entities():
+    try:
+        _, ids = bulk_ids(bulk_delete_schema)
+        query = selection(request.args)
+    except (ValidationError, FilterError) as e:
+        return make_response(jsonify({'message': getattr(e, 'message', str(e))}), 400)
+    limited = too_many_ids(ids)
+    if limited is not None:
+        return limited
+
+    deleted = delete_entities(query, ids, current_app.config['BCRM_BATCH_CHUNK_SIZE'])
+    return jsonify({'deleted': deleted})
+
+@core_api.route('/entities:bulkUpdate', methods=['POST'])
+@idempotent(chunked=True)
+def bulk_update_entities():
+    try:
+        payload, ids = bulk_ids(bulk_update_schema)
+        query = selection(request.args)
+    except (ValidationError, FilterError) as e:
+        return make_response(jsonify({'message': getattr(e, 'message', str(e))}), 400)
+    limited = too_many_ids(ids)
+    if limited is not None:
+        return limited
+
+    try:
+        updated = update_entities(
+            query, ids, payload['patch'], current_app.config['BCRM_BATCH_CHUNK_SIZE']
+        )
+    except InvalidEntity as e:
+        return make_response(
+            jsonify({'message': str(e), 'id': e.entity_id, 'updated': e.updated}),
+            400
+        )
+    return jsonify({'updated': updated})
 
 @core_api.route('/entities/<string:entity_id>', methods=['DELETE'])
 def delete_entity(entity_id):
     entity = Entity.query.get(entity_id)
     if not entity:
         return make_response(jsonify({'message': 'Not found'}), 404)
+    if precondition_failed(entity.version):
+        return precondition_failed_response()
 
     db.session.begin()
+    entities_written('delete', [entity_row(entity)])
     db.session.delete(entity)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed_response()
     return jsonify({'acknowledge': True})
 
 
 @core_api.route('/entities/<string:entity_id>', methods=['PUT'])
+@idempotent
 @validate_payload_is_json
 @validate_payload_with_schema(entity_schema)
 def update_entity(entity_id):
     entity = Entity.query.get(entity_id)
     if not entity:
         return make_response(jsonify({'message': 'Not found'}), 404)
+    if precondition_failed(entity.version):
+        return precondition_failed_response()
 
     entity_type_id = request.json['entity_type_id']
     content = request.json['content']
-    entity_type = EntityType.query.get(entity_type_id)
+    entity_type = get_entity_type(entity_type_id)
     if not entity_type:
         return make_response(
             jsonify({'message': "Entity type id '{}' does not exist".format(entity_type_id)}),
@@ -137,15 +574,136 @@ def update_entity(entity_id):
         )
 
     try:
-        validate(instance=content, schema=entity_type.toDict()['schema'])
+        validate_content(entity_type, content)
     except ValidationError:
         return make_response(
             jsonify({'message': "Entity content does not match type schema"}),
             400
         )
 
+    previous = {'entityTypeId': entity.entityTypeId, 'content': entity.content}
     db.session.begin()
     entity.entityTypeId = entity_type_id
     entity.content = json.dumps(content)
+    try:
+        db.session.flush()
+        entities_written('update', [entity_row(entity, previous, content)])
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed_response()
+    return with_etag(json_response(entity.toRawDict()), entity.version)
+
+@core_api.route('/entities/<string:entity_id>', methods=['PATCH'])
+@idempotent
+def patch_entity(entity_id):
+    kind = request.mimetype
+    if kind not in (MERGE_PATCH, JSON_PATCH):
+        return make_response(
+            jsonify({'message': "patch must be {} or {}".format(MERGE_PATCH, JSON_PATCH)}),
+            415
+        )
+    with phase('json'):
+        patch = request.get_json(silent=True)
+    if patch is None:
+        return make_response(jsonify({'message': "payload is not json"}), 400)
+    if kind == MERGE_PATCH and not isinstance(patch, dict):
+        return make_response(jsonify({'message': "merge patch must be a json object"}), 400)
+
+    if kind == MERGE_PATCH and pushdown():
+        return merge_patch_entity_in_database(entity_id, patch)
+
+    db.session.begin()
+    entity = Entity.query.filter(Entity.id == entity_id).with_for_update().first()
+    if not entity:
+        db.session.rollback()
+        return make_response(jsonify({'message': 'Not found'}), 404)
+    if precondition_failed(entity.version):
+        db.session.rollback()
+        return precondition_failed_response()
+
+    try:
+        document = json.loads(entity.content)
+        if kind == MERGE_PATCH:
+            content = merge_patch(document, patch)
+        else:
+            content = json_patch(document, patch)
+        if not isinstance(content, dict):
+            raise PatchError("content must be a json object")
+        validate_changes(get_entity_type(entity.entityTypeId), content, changed_keys(kind, patch))
+    except PatchConflict as e:
+        db.session.rollback()
+        return make_response(jsonify({'message': str(e)}), 409)
+    except PatchError as e:
+        db.session.rollback()
+        return make_response(jsonify({'message': str(e)}), 400)
+    except ValidationError:
+        db.session.rollback()
+        return make_response(
+            jsonify({'message': "Entity content does not match type schema"}),
+            400
+        )
+
+    previous = {'entityTypeId': entity.entityTypeId, 'content': entity.content}
+    entity.content = json.dumps(content)
+    try:
+        db.session.flush()
+        entities_written('update', [entity_row(entity, previous, content)])
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return precondition_failed_response()
+    return with_etag(json_response(entity.toRawDict()), entity.version)
+
+def merge_patch_entity_in_database(entity_id, patch):
+    db.session.begin()
+    row = db.session.execute(merge_patch_select(entity_id, patch)).first()
+    if row is None:
+        db.session.rollback()
+        return make_response(jsonify({'message': 'Not found'}), 404)
+    if precondition_failed(row.version):
+        db.session.rollback()
+        return precondition_failed_response()
+
+    content = json.loads(row.patched)
+    try:
+        validate_changes(
+            get_entity_type(row.entityTypeId), content, changed_keys(MERGE_PATCH, patch))
+    except ValidationError:
+        db.session.rollback()
+        return make_response(
+            jsonify({'message': "Entity content does not match type schema"}),
+            400
+        )
+
+    version = db.session.execute(merge_patch_statement(entity_id, row.version, patch)).scalar()
+    if version is None:
+        db.session.rollback()
+        return precondition_failed_response()
+    entity = EntityRecord(entity_id, row.entityTypeId, row.patched, version)
+    previous = {'entityTypeId': row.entityTypeId, 'content': row.content}
+    entities_written('update', [entity_row(entity, previous, content)])
     db.session.commit()
-    return jsonify(entity.toDict())
+    return with_etag(json_response(entity.toRawDict()), entity.version)
+
+@core_api.route('/changes', methods=['GET'])
+def list_changes():
+    try:
+        since, limit, wait, entity_type_id = change_args(
+            request.args, request.headers.get('Last-Event-ID'))
+    except ChangeFeedError as e:
+        return make_response(jsonify({'message': str(e)}), 400)
+
+    if request.accept_mimetypes.best_match(['application/json', EVENT_STREAM]) == EVENT_STREAM:
+        return Response(
+            stream_with_context(event_stream(since, limit, entity_type_id, wait)),
+            mimetype=EVENT_STREAM,
+            headers={'Cache-Control': 'no-cache'}
+        )
+
+    changes = poll_changes(since, limit, entity_type_id, wait)
+    response = json_response([change.toRawDict() for change in changes])
+    args = request.args.to_dict(flat=False)
+    args['since'] = changes[-1].seq if changes else since
+    response.headers['Link'] = '<{}>; rel="next"'.format(url_for(request.endpoint, **args))
+    return response
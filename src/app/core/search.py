@@ -0,0 +1,231 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Full-text search
+    ========================
+    The string fields of an entity are searched, nested object properties
+    included. A property is left out with ``"x-bcrm-search": false`` and a
+    property of another type is searched with ``"x-bcrm-search": true``::
+
+        {"properties": {"name": {"type": "string"},
+                        "notes": {"type": "string", "x-bcrm-search": false}}}
+
+    The text of the searched fields is kept in ``entity_search``:
+     - a ``tsvector`` column with a GIN index on PostgreSQL
+     - a FTS5 table anywhere else, for local and test use
+
+    Both use the ``simple`` tokenization without stemming. Every word of
+    the query must match as a prefix, so partial names find the entity
+    while they are typed::
+
+        GET /api/search?q=jo smi&entity_type_id=<id>
+
+    Results are ranked, best first. Pages seek past the rank and the id of
+    the last result read, the cursor is ``<rank>:<id>``. The rank is
+    computed per query, a write between two pages can move a result across
+    the cursor.
+"""
+import json
+import re
+from functools import lru_cache
+from sqlalchemy import DDL, Float, and_, bindparam, cast, event, func, or_, text
+from sqlalchemy.sql import column, literal_column, table
+from app.core.db import db
+from app.core.hooks import write_hook
+from app.core.indexing import type_schemas
+from app.core.lookups import EntityRecord
+from app.core.models.entity import Entity
+
+SEARCH_KEYWORD = 'x-bcrm-search'
+MAX_TERMS = 8
+MAX_TEXT_LENGTH = 65536
+REINDEX_BATCH_SIZE = 1000
+
+search_table = table(
+    'entity_search',
+    column('entity_id'),
+    column('entity_type_id'),
+    column('document'),
+)
+
+for statement in (
+        'CREATE TABLE entity_search ('
+        'entity_id VARCHAR(60) PRIMARY KEY, '
+        'entity_type_id VARCHAR(60) NOT NULL, '
+        'document TSVECTOR NOT NULL)',
+        'CREATE INDEX ix_entity_search_document ON entity_search USING gin (document)',
+        'CREATE INDEX ix_entity_search_entity_type_id ON entity_search (entity_type_id)'):
+    event.listen(
+        Entity.__table__, 'after_create',
+        DDL(statement).execute_if(dialect='postgresql')
+    )
+event.listen(
+    Entity.__table__, 'after_create',
+    DDL(
+        "CREATE VIRTUAL TABLE entity_search USING fts5("
+        "entity_id UNINDEXED, entity_type_id UNINDEXED, document, "
+        "tokenize='unicode61 remove_diacritics 1', prefix='2 3')"
+    ).execute_if(dialect='sqlite')
+)
+event.listen(Entity.__table__, 'before_drop', DDL('DROP TABLE IF EXISTS entity_search'))
+
+class SearchError(ValueError):
+    """ Raised when the search query is not valid """
+
+def postgresql():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+@lru_cache(maxsize=256)
+def searched_fields(schema):
+    """
+    Returns the tuple of searched field paths of a schema text
+    """
+    def walk(node, prefix):
+        fields = []
+        properties = node.get('properties') if isinstance(node, dict) else None
+        if not isinstance(properties, dict):
+            return fields
+        for name, subschema in sorted(properties.items()):
+            if not isinstance(subschema, dict):
+                continue
+            searched = subschema.get(SEARCH_KEYWORD)
+            if searched is True or (searched is None and subschema.get('type') == 'string'):
+                fields.append(prefix + name)
+            if searched is not False:
+                fields.extend(walk(subschema, prefix + name + '.'))
+        return fields
+    return tuple(walk(json.loads(schema), ''))
+
+def search_text(fields, document):
+    """
+    Returns the searched text of a content document
+    """
+    words = []
+    for field in fields:
+        value = document
+        for key in field.split('.'):
+            value = value.get(key) if isinstance(value, dict) else None
+        values = value if isinstance(value, list) else [value]
+        words.extend(value for value in values if isinstance(value, str))
+    return ' '.join(words)[:MAX_TEXT_LENGTH]
+
+def insert_search_rows(rows):
+    if not rows:
+        return
+    document = bindparam('text')
+    if postgresql():
+        document = func.to_tsvector('simple', document)
+    db.session.execute(search_table.insert().values(document=document), rows)
+
+def search_row(entity_type_id, fields, entity_id, document):
+    searched = search_text(fields, document)
+    if not searched:
+        return None
+    return {'entity_id': entity_id, 'entity_type_id': entity_type_id, 'text': searched}
+
+@write_hook
+def maintain_search(op, rows):
+    if op != 'create':
+        db.session.execute(search_table.delete().where(
+            search_table.c.entity_id.in_([row['id'] for row in rows])
+        ))
+    if op == 'delete':
+        return
+
+    schemas = type_schemas(set(row['entityTypeId'] for row in rows))
+    searched = []
+    for row in rows:
+        fields = searched_fields(schemas[row['entityTypeId']])
+        if not fields:
+            continue
+        document = row.get('document')
+        if document is None:
+            document = json.loads(row['content'])
+        searched_row = search_row(row['entityTypeId'], fields, row['id'], document)
+        if searched_row is not None:
+            searched.append(searched_row)
+    insert_search_rows(searched)
+
+def reindex_search(entity_type, previous_schema=None):
+    """
+    Rebuilds the search rows of the entity type when its searched fields
+    changed, must run inside the caller transaction
+    """
+    fields = searched_fields(entity_type.schema)
+    if previous_schema is not None and fields == searched_fields(previous_schema):
+        return
+
+    db.session.execute(search_table.delete().where(
+        search_table.c.entity_type_id == entity_type.id
+    ))
+    if not fields:
+        return
+    entities = (
+        db.session.query(Entity.id, Entity.content)
+        .filter(Entity.entityTypeId == entity_type.id)
+        .yield_per(REINDEX_BATCH_SIZE)
+    )
+    searched = []
+    for entity_id, content in entities:
+        searched_row = search_row(entity_type.id, fields, entity_id, json.loads(content))
+        if searched_row is not None:
+            searched.append(searched_row)
+        if len(searched) >= REINDEX_BATCH_SIZE:
+            insert_search_rows(searched)
+            searched = []
+    insert_search_rows(searched)
+
+def search_terms(q):
+    terms = re.findall(r'\w+', (q or '').lower(), re.UNICODE)
+    if not terms:
+        raise SearchError("q must contain a word")
+    return terms[:MAX_TERMS]
+
+def search_cursor(after):
+    """
+    Returns the ``(rank, id)`` seek key of a search cursor
+    """
+    rank, _, entity_id = after.partition(':')
+    try:
+        rank = float(rank)
+    except ValueError:
+        raise SearchError("after is not a search cursor")
+    if not entity_id:
+        raise SearchError("after is not a search cursor")
+    return rank, entity_id
+
+def search_entities(q, entity_type_id, after, limit):
+    """
+    Returns one page of the entities matching ``q`` best first and the
+    cursor of the next page, ``None`` on the last page
+    """
+    terms = search_terms(q)
+    if postgresql():
+        tsquery = func.to_tsquery('simple', ' & '.join(term + ':*' for term in terms))
+        # negated so that both dialects seek upwards, best first
+        rank = -cast(func.ts_rank(search_table.c.document, tsquery), Float)
+        matched = search_table.c.document.op('@@')(tsquery)
+    else:
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        rank = literal_column('bm25(entity_search)', Float)
+        matched = text('entity_search MATCH :match').bindparams(match=match)
+
+    query = (
+        db.session.query(Entity.id, Entity.entityTypeId, Entity.content, Entity.version,
+                         rank.label('rank'))
+        .join(search_table, search_table.c.entity_id == Entity.id)
+        .filter(matched)
+    )
+    if entity_type_id is not None:
+        query = query.filter(search_table.c.entity_type_id == entity_type_id)
+    if after is not None:
+        after_rank, after_id = search_cursor(after)
+        query = query.filter(or_(rank > after_rank, and_(rank == after_rank, Entity.id > after_id)))
+
+    rows = query.order_by(rank, Entity.id).limit(limit + 1).all()
+    records = [EntityRecord(*row[:4]) for row in rows[:limit]]
+    if len(rows) <= limit:
+        return records, None
+    return records, '{!r}:{}'.format(rows[limit - 1].rank, rows[limit - 1].id)
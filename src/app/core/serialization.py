@@ -0,0 +1,137 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    JSON responses
+    ========================
+    Entity and entity type responses are rendered by :func:`json_response`
+    instead of ``jsonify``:
+     - stored documents are kept as json text, wrapped in :class:`RawJSON`
+       they are spliced into the response as is, never parsed and encoded
+       again
+     - with ``orjson`` (3.9 or later) the whole response is encoded by one
+       ``orjson.dumps`` call, raw documents pass as ``orjson.Fragment``
+     - with the standard library the containers are walked in python and
+       the raw documents spliced between the encoded values
+
+    ``orjson`` is used when it is installed, ``BCRM_JSON_BACKEND=json``
+    forces the standard library. Both backends write the same json: dict
+    keys are coerced like ``json.dumps`` does and ``Decimal`` values are
+    written as exact numbers.
+"""
+import json
+import os
+from decimal import Decimal
+from json.encoder import encode_basestring_ascii
+from flask import current_app
+from app.instrumentation import phase
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+class RawJSON(str):
+    """ Json text written to responses as is """
+    __slots__ = ()
+
+def decimal_text(value):
+    if not value.is_finite():
+        raise TypeError("Out of range decimal values are not JSON serializable: {}".format(value))
+    return str(value)
+
+def stdlib_key(key):
+    if isinstance(key, str):
+        return str(key)
+    if key is None or isinstance(key, (bool, int, float)):
+        return json.dumps(key)
+    raise TypeError("keys must be str, int, float, bool or None, not {}".format(type(key).__name__))
+
+def stdlib_render(value):
+    if isinstance(value, RawJSON):
+        return value
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, dict):
+        return '{' + ','.join(
+            encode_basestring_ascii(stdlib_key(key)) + ':' + stdlib_render(item)
+            for key, item in value.items()
+        ) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ','.join(stdlib_render(item) for item in value) + ']'
+    if isinstance(value, Decimal):
+        return decimal_text(value)
+    return json.dumps(value, separators=(',', ':'))
+
+def str_keys(value):
+    """
+    Returns ``value`` with the dict keys coerced by :func:`stdlib_key`
+    """
+    if isinstance(value, dict):
+        return {stdlib_key(key): str_keys(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [str_keys(item) for item in value]
+    return value
+
+def orjson_default(value):
+    # subclasses are passed through to here, RawJSON is the one spliced as is
+    if isinstance(value, RawJSON):
+        return orjson.Fragment(str(value))
+    if isinstance(value, Decimal):
+        return orjson.Fragment(decimal_text(value))
+    for base in (str, dict, list, int, float):
+        if isinstance(value, base):
+            return base(value)
+    raise TypeError("Type is not JSON serializable: {}".format(type(value).__name__))
+
+def orjson_render(value):
+    try:
+        text = orjson.dumps(value, default=orjson_default, option=orjson.OPT_PASSTHROUGH_SUBCLASS)
+    except orjson.JSONEncodeError:
+        # non str keys are rare, they are coerced on a second try only
+        text = orjson.dumps(
+            str_keys(value), default=orjson_default, option=orjson.OPT_PASSTHROUGH_SUBCLASS
+        )
+    return text.decode('utf-8')
+
+def orjson_supported():
+    return orjson is not None and hasattr(orjson, 'Fragment')
+
+_backend = [stdlib_render]
+
+def set_backend(name):
+    """
+    Selects the json backend, ``orjson`` or ``json``
+    """
+    if name == 'orjson':
+        if not orjson_supported():
+            raise ValueError("the orjson package 3.9 or later is not installed")
+        _backend[0] = orjson_render
+    elif name == 'json':
+        _backend[0] = stdlib_render
+    else:
+        raise ValueError("unsupported json backend '{}'".format(name))
+
+def init_serialization(app):
+    """
+    Configures the json backend from the environment
+    """
+    name = os.environ.get('BCRM_JSON_BACKEND') or ('orjson' if orjson_supported() else 'json')
+    set_backend(name)
+    app.config['BCRM_JSON_BACKEND'] = name
+
+def render(value):
+    """
+    Returns the json text of ``value``, :class:`RawJSON` values are
+    written as is
+    """
+    return _backend[0](value)
+
+def json_response(value, status=200):
+    """
+    Returns a json response of ``value`` rendered by :func:`render`
+    """
+    with phase('serialize'):
+        body = render(value) + '\n'
+    return current_app.response_class(body, status=status, mimetype='application/json')
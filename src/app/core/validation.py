@@ -0,0 +1,138 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Entity content validation
+    ========================
+    Keeps compiled jsonschema validators for
+     - EntityType schemas
+"""
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from jsonschema import ValidationError
+from jsonschema.validators import validator_for
+from app.instrumentation import phase
+
+FLAT_KEYWORDS = ('$schema', 'type', 'properties', 'required', 'additionalProperties',
+                 'title', 'description')
+
+FlatSchema = namedtuple('FlatSchema', ['properties', 'additional', 'required'])
+
+def flat_schema(cls, schema, revision):
+    """
+    Returns the per property validators of a schema that only constrains
+    its properties one by one, ``None`` for any other schema
+    """
+    if schema.get('type') != 'object' or '"$ref"' in revision:
+        return None
+    if not all(keyword in FLAT_KEYWORDS or keyword.startswith('x-') for keyword in schema):
+        return None
+    additional = schema.get('additionalProperties', True)
+    if isinstance(additional, dict):
+        additional = cls(additional)
+    return FlatSchema(
+        dict((name, cls(subschema)) for name, subschema in schema.get('properties', {}).items()),
+        additional,
+        frozenset(schema.get('required', ())),
+    )
+
+
+class ValidatorRegistry(object):
+    """
+    LRU registry of compiled validators keyed by entity type id.
+
+    Every entry remembers the schema revision it was compiled from, so a
+    worker that still holds a validator for an older schema recompiles it as
+    soon as it sees the new revision coming from the database.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def entry(self, entity_type):
+        revision = entity_type.schema
+        with self._lock:
+            entry = self._entries.get(entity_type.id)
+            if entry is not None and entry[0] == revision:
+                self._entries.move_to_end(entity_type.id)
+                return entry
+
+        schema = json.loads(revision)
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        entry = (revision, cls(schema), flat_schema(cls, schema, revision))
+
+        with self._lock:
+            self._entries[entity_type.id] = entry
+            self._entries.move_to_end(entity_type.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, entity_type):
+        """
+        Returns the validator for the entity type, compiling it on a miss
+        """
+        return self.entry(entity_type)[1]
+
+    def flat(self, entity_type):
+        """
+        Returns the :class:`FlatSchema` of the entity type, ``None`` when
+        its schema is not flat
+        """
+        return self.entry(entity_type)[2]
+
+    def invalidate(self, entity_type_id):
+        with self._lock:
+            self._entries.pop(entity_type_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entity_type_id):
+        return entity_type_id in self._entries
+
+
+validators = ValidatorRegistry()
+
+@phase('validate')
+def validate_content(entity_type, content):
+    """
+    Validates entity content against the entity type schema
+
+    Raises :exc:`jsonschema.ValidationError` if the content is invalid
+    """
+    validators.get(entity_type).validate(content)
+
+@phase('validate')
+def validate_changes(entity_type, content, keys):
+    """
+    Validates the top level ``keys`` of a patched entity content. Only the
+    changed properties are checked when the schema is flat, the whole
+    content otherwise or when ``keys`` is ``None``
+
+    Raises :exc:`jsonschema.ValidationError` if the content is invalid
+    """
+    flat = validators.flat(entity_type)
+    if flat is None or keys is None:
+        validators.get(entity_type).validate(content)
+        return
+    for key in keys:
+        if key not in content:
+            if key in flat.required:
+                raise ValidationError("'{}' is a required property".format(key))
+            continue
+        validator = flat.properties.get(key, flat.additional)
+        if validator is False:
+            raise ValidationError(
+                "Additional properties are not allowed ('{}' was unexpected)".format(key))
+        if validator is not True:
+            validator.validate(content[key])
@@ -0,0 +1,296 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Outbound webhooks
+    ========================
+    Entity types take webhook subscriptions for the ``create``, ``update``
+    and ``delete`` writes of their entities. Writes only append the events
+    to the ``webhook_delivery`` outbox inside their transaction, the remote
+    calls are made by a separate dispatcher process::
+
+        flask dispatch-webhooks --concurrency 8 --batch-size 50
+
+    The dispatcher posts the due events of a webhook together as
+    ``{"events": [...]}``, at most ``concurrency`` requests at a time. A
+    free slot takes a batch of the webhook with the oldest due events among
+    the ones without a request in flight, a webhook with a long backlog or
+    a slow receiver does not hold up the others.
+    Delivered events are deleted, failed ones are retried with exponential
+    backoff and kept as ``dead`` after ``max_attempts``, until they are
+    retried through the api. Delivery is at least once, receivers drop
+    event ids they have seen. A webhook with a ``secret`` gets the body
+    signed as ``X-BCRM-Signature: sha256=<hex HMAC>``.
+
+    Claimed events are leased for twice the request timeout, dispatchers
+    running side by side skip them, on PostgreSQL without waiting for the
+    claiming transaction (``SKIP LOCKED``). A request is given up once its
+    response body is still read after ``timeout`` seconds, the connection
+    and the response headers are bounded by the socket timeout only. The
+    outcome of a batch is recorded only while its lease is held, a batch
+    taken over by another dispatcher is left to it.
+"""
+import datetime
+import hashlib
+import hmac
+import random
+import time
+import urllib.request
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.client import HTTPException
+from urllib.error import HTTPError, URLError
+from sqlalchemy import and_, func
+from app.core.db import db
+from app.core.hooks import write_hook
+from app.core.models.webhook import Webhook
+from app.core.models.webhook_delivery import WebhookDelivery, PENDING, DEAD
+from app.core.serialization import RawJSON, render
+
+SIGNATURE_HEADER = 'X-BCRM-Signature'
+BACKOFF_BASE = 2
+BACKOFF_MAX = 3600
+READ_SIZE = 16384
+
+Batch = namedtuple('Batch', ['webhook_id', 'url', 'secret', 'deliveries', 'leased_until'])
+
+@write_hook
+def queue_deliveries(op, rows):
+    entity_type_ids = set(row['entityTypeId'] for row in rows)
+    subscribed = defaultdict(list)
+    for webhook_id, entity_type_id, events in (
+            db.session.query(Webhook.id, Webhook.entity_type_id, Webhook.events)
+            .filter(Webhook.entity_type_id.in_(list(entity_type_ids)))):
+        if op in events.split(','):
+            subscribed[entity_type_id].append(webhook_id)
+    if not subscribed:
+        return
+
+    now = datetime.datetime.utcnow()
+    deliveries = [
+        {
+            'webhook_id': webhook_id,
+            'event': op,
+            'entity_id': row['id'],
+            'entity_type_id': row['entityTypeId'],
+            'content': row['content'] if op != 'delete' else None,
+            'status': PENDING,
+            'attempts': 0,
+            'next_attempt': now,
+            'created': now,
+        }
+        for row in rows
+        for webhook_id in subscribed.get(row['entityTypeId'], ())
+    ]
+    if deliveries:
+        db.session.execute(WebhookDelivery.__table__.insert(), deliveries)
+
+def event_document(delivery):
+    data = dict([])
+    data['id'] = delivery.id
+    data['event'] = delivery.event
+    data['created'] = delivery.created.isoformat() + 'Z'
+    data['entity'] = {
+        'id': delivery.entity_id,
+        'entity_type_id': delivery.entity_type_id,
+        'content': RawJSON(delivery.content) if delivery.content is not None else None,
+    }
+    return data
+
+def sign(secret, body):
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+def backoff(attempts):
+    """
+    Returns the seconds to wait before the next attempt, doubling with
+    every failed attempt and jittered so failed batches spread out
+    """
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * (0.5 + random.random() / 2)
+
+def claimed_webhooks(webhook_ids):
+    """
+    Returns the ``(url, secret)`` of the webhooks by id, deleted ones are
+    left out
+    """
+    return dict(
+        (webhook_id, (url, secret)) for webhook_id, url, secret in
+        db.session.query(Webhook.id, Webhook.url, Webhook.secret)
+        .filter(Webhook.id.in_(webhook_ids))
+    )
+
+def claim_batches(batch_size, max_batches, lease, busy=()):
+    """
+    Returns the batches of due deliveries of at most ``max_batches``
+    webhooks, the ones with the oldest due deliveries, at most
+    ``batch_size`` per webhook, leased for ``lease`` seconds. The webhooks
+    in ``busy`` are skipped, their events are delivered in order.
+    """
+    now = datetime.datetime.utcnow()
+    leased_until = now + datetime.timedelta(seconds=lease)
+    db.session.begin()
+    due = and_(WebhookDelivery.status == PENDING, WebhookDelivery.next_attempt <= now)
+    if busy:
+        due = and_(due, WebhookDelivery.webhook_id.notin_(list(busy)))
+    webhook_ids = [
+        webhook_id for webhook_id, _ in
+        db.session.query(WebhookDelivery.webhook_id, func.min(WebhookDelivery.id))
+        .filter(due)
+        .group_by(WebhookDelivery.webhook_id)
+        .order_by(func.min(WebhookDelivery.id))
+        .limit(max_batches)
+    ]
+    skip_locked = db.session.get_bind().dialect.name == 'postgresql'
+    claimed = OrderedDict()
+    for webhook_id in webhook_ids:
+        query = (
+            db.session.query(WebhookDelivery.id)
+            .filter(WebhookDelivery.webhook_id == webhook_id, due)
+            .order_by(WebhookDelivery.id)
+            .limit(batch_size)
+        )
+        if skip_locked:
+            query = query.with_for_update(skip_locked=True)
+        delivery_ids = [delivery_id for delivery_id, in query]
+        if delivery_ids:
+            claimed[webhook_id] = delivery_ids
+    ids = [delivery_id for delivery_ids in claimed.values() for delivery_id in delivery_ids]
+    if not ids:
+        db.session.commit()
+        return []
+
+    db.session.execute(
+        WebhookDelivery.__table__.update()
+        .where(WebhookDelivery.id.in_(ids))
+        .values(next_attempt=leased_until)
+    )
+    deliveries = defaultdict(list)
+    for delivery in (
+            db.session.query(
+                WebhookDelivery.id, WebhookDelivery.webhook_id, WebhookDelivery.event,
+                WebhookDelivery.entity_id, WebhookDelivery.entity_type_id,
+                WebhookDelivery.content, WebhookDelivery.attempts, WebhookDelivery.created
+            )
+            .filter(WebhookDelivery.id.in_(ids))
+            .order_by(WebhookDelivery.id)):
+        deliveries[delivery.webhook_id].append(delivery)
+    webhooks = claimed_webhooks(list(claimed))
+    db.session.commit()
+    # a webhook deleted meanwhile took its deliveries along
+    return [
+        Batch(webhook_id, webhooks[webhook_id][0], webhooks[webhook_id][1],
+              deliveries[webhook_id], leased_until)
+        for webhook_id in claimed if webhook_id in webhooks
+    ]
+
+def deliver(batch, timeout):
+    """
+    Posts the events of the batch, returns the error or ``None`` when the
+    webhook accepted them within ``timeout`` seconds
+    """
+    deadline = time.monotonic() + timeout
+    body = render({'events': [event_document(delivery) for delivery in batch.deliveries]})
+    body = body.encode('utf-8')
+    headers = {'Content-Type': 'application/json', 'User-Agent': 'bcrm-webhooks'}
+    if batch.secret:
+        headers[SIGNATURE_HEADER] = sign(batch.secret, body)
+    request = urllib.request.Request(batch.url, data=body, headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            while response.read1(READ_SIZE):
+                if time.monotonic() > deadline:
+                    return 'timed out'
+    except HTTPError as e:
+        return 'HTTP {}'.format(e.code)
+    except (URLError, HTTPException, OSError) as e:
+        return str(e) or e.__class__.__name__
+    return None
+
+def record(batch, error, max_attempts):
+    """
+    Deletes the delivered events of the batch or schedules their retry,
+    the events whose lease was taken over meanwhile are left as they are
+    """
+    ids = [delivery.id for delivery in batch.deliveries]
+    table = WebhookDelivery.__table__
+    leased = table.c.next_attempt == batch.leased_until
+    db.session.begin()
+    if error is None:
+        db.session.execute(table.delete().where(table.c.id.in_(ids)).where(leased))
+    else:
+        now = datetime.datetime.utcnow()
+        for delivery in batch.deliveries:
+            attempts = delivery.attempts + 1
+            values = {'attempts': attempts, 'last_error': error[:1000]}
+            if attempts >= max_attempts:
+                values.update(status=DEAD, next_attempt=now)
+            else:
+                values['next_attempt'] = now + datetime.timedelta(seconds=backoff(attempts))
+            db.session.execute(
+                table.update().where(table.c.id == delivery.id).where(leased).values(**values)
+            )
+    db.session.commit()
+
+def dispatch(concurrency=8, batch_size=50, max_attempts=8, timeout=10, poll_interval=1,
+             once=False, echo=None):
+    """
+    Delivers the outbox until interrupted, with ``once`` until no
+    delivery is due, returns the numbers of delivered and failed events
+    """
+    delivered = failed = 0
+    in_flight = {}
+    with ThreadPoolExecutor(concurrency) as pool:
+        while True:
+            if len(in_flight) < concurrency:
+                batches = claim_batches(
+                    batch_size, concurrency - len(in_flight), timeout * 2,
+                    busy=[batch.webhook_id for batch in in_flight.values()]
+                )
+                for batch in batches:
+                    in_flight[pool.submit(deliver, batch, timeout)] = batch
+            if not in_flight:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            # each batch is recorded as soon as it is done, within its lease
+            done, _ = wait(list(in_flight), timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                error = future.result()
+                record(batch, error, max_attempts)
+                if error is None:
+                    delivered += len(batch.deliveries)
+                else:
+                    failed += len(batch.deliveries)
+                    if echo is not None:
+                        echo('Delivery to {} failed: {}'.format(batch.url, error))
+    return delivered, failed
+
+def retry_dead(webhook_id):
+    """
+    Schedules the dead deliveries of a webhook again, returns their number
+    """
+    table = WebhookDelivery.__table__
+    db.session.begin()
+    result = db.session.execute(
+        table.update()
+        .where(table.c.webhook_id == webhook_id)
+        .where(table.c.status == DEAD)
+        .values(status=PENDING, attempts=0, next_attempt=datetime.datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount
+
+def delete_webhooks(condition):
+    """
+    Deletes the webhooks matching ``condition`` and their deliveries, must
+    run inside the caller transaction
+    """
+    webhook_ids = db.session.query(Webhook.id).filter(condition)
+    db.session.execute(
+        WebhookDelivery.__table__.delete().where(WebhookDelivery.webhook_id.in_(webhook_ids))
+    )
+    db.session.execute(Webhook.__table__.delete().where(condition))
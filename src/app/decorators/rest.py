@@ -13,6 +13,7 @@
 from functools import wraps
 from flask import jsonify, request, make_response
 from jsonschema import validate, ValidationError
+from app.instrumentation import phase
 
 
 def validate_payload_is_json(func):
@@ -21,7 +22,9 @@ def validate_payload_is_json(func):
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        if not request.json:
+        with phase('json'):
+            payload = request.json
+        if not payload:
             msg = "payload is not json"
             return make_response(jsonify({"message": msg}), 400)
         return func(*args, **kwargs)
@@ -35,7 +38,8 @@ def validate_payload_with_schema(schema):
         @wraps(func)
         def wrapper(*args, **kwargs):
             try:
-                validate(instance=request.json, schema=schema)
+                with phase('schema'):
+                    validate(instance=request.json, schema=schema)
             except ValidationError as e:
                 msg = e.message
                 return make_response(jsonify({"message": msg}), 400)
@@ -0,0 +1,266 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+
+"""
+    Request instrumentation
+    ========================
+    Opt-in timing of the request hot path, enabled with
+    ``BCRM_INSTRUMENTATION=1``:
+     - phases (``json``, ``schema``, ``lookup``, ``validate``, ``flush``,
+       ``commit``, ``serialize``) and SQL statements are timed per request
+       and returned in a ``Server-Timing`` header
+     - per process counters and histograms are served in the Prometheus
+       text format on ``/metrics``
+     - ``BCRM_PROFILE_SAMPLE_RATE`` of the requests run under cProfile, the
+       ones slower than ``BCRM_PROFILE_SLOW_MS`` are dumped as ``.prof``
+       files in ``BCRM_PROFILE_DIR``
+
+    Every uWSGI worker keeps its own metrics, a scrape reports the worker
+    that answered it.
+"""
+import cProfile
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request
+from flask.json import JSONEncoder
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def timings():
+    """
+    Returns the phase timings of the current request, ``None`` when the
+    request is not instrumented
+    """
+    if not has_request_context():
+        return None
+    return g.get('bcrm_timings')
+
+def record(name, elapsed):
+    current = timings()
+    if current is not None:
+        current[name] = current.get(name, 0.0) + elapsed
+
+@contextmanager
+def phase(name):
+    """
+    Times the block, or the decorated function, as a phase of the request
+    """
+    if timings() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+class TimedJSONEncoder(JSONEncoder):
+    """ Flask json encoder timing the ``serialize`` phase """
+
+    def encode(self, o):
+        with phase('serialize'):
+            return super(TimedJSONEncoder, self).encode(o)
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if timings() is not None:
+        conn.info.setdefault('bcrm_query_start', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('bcrm_query_start')
+    if not started or timings() is None:
+        return
+    record('sql', time.perf_counter() - started.pop())
+    g.bcrm_statements += 1
+
+def start_session_phase(name):
+    def listener(session, *args):
+        if timings() is not None:
+            session.info['bcrm_' + name] = time.perf_counter()
+    return listener
+
+def end_session_phase(name):
+    def listener(session, *args):
+        started = session.info.pop('bcrm_' + name, None)
+        if started is not None:
+            record(name, time.perf_counter() - started)
+    return listener
+
+_listening = []
+
+def listen_once():
+    if _listening:
+        return
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(Session, 'before_flush', start_session_phase('flush'))
+    event.listen(Session, 'after_flush_postexec', end_session_phase('flush'))
+    event.listen(Session, 'before_commit', start_session_phase('commit'))
+    event.listen(Session, 'after_commit', end_session_phase('commit'))
+    event.listen(Session, 'after_rollback', end_session_phase('commit'))
+    _listening.append(True)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**values):
+    return '{' + ','.join(
+        '{}="{}"'.format(name, escape(value)) for name, value in sorted(values.items())
+    ) + '}'
+
+class Metrics(object):
+    """ Per process request metrics """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.durations = {}
+        self.phases = {}
+        self.statements = {}
+
+    def observe(self, method, endpoint, status, elapsed, phases, statements):
+        with self._lock:
+            key = (method, endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            histogram = self.durations.setdefault(
+                (method, endpoint), [0] * len(self.buckets) + [0, 0.0])
+            for index, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += elapsed
+
+            for name, seconds in phases.items():
+                total = self.phases.setdefault((endpoint, name), [0, 0.0])
+                total[0] += 1
+                total[1] += seconds
+
+            self.statements[endpoint] = self.statements.get(endpoint, 0) + statements
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            lines = [
+                '# HELP bcrm_requests_total Requests answered.',
+                '# TYPE bcrm_requests_total counter',
+            ]
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append('bcrm_requests_total{} {}'.format(
+                    labels(method=method, endpoint=endpoint, status=status), count))
+
+            lines.append('# HELP bcrm_request_duration_seconds Request duration.')
+            lines.append('# TYPE bcrm_request_duration_seconds histogram')
+            for (method, endpoint), histogram in sorted(self.durations.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append('bcrm_request_duration_seconds_bucket{} {}'.format(
+                        labels(method=method, endpoint=endpoint, le=repr(bound)), count))
+                lines.append('bcrm_request_duration_seconds_bucket{} {}'.format(
+                    labels(method=method, endpoint=endpoint, le='+Inf'), histogram[-2]))
+                lines.append('bcrm_request_duration_seconds_count{} {}'.format(
+                    labels(method=method, endpoint=endpoint), histogram[-2]))
+                lines.append('bcrm_request_duration_seconds_sum{} {!r}'.format(
+                    labels(method=method, endpoint=endpoint), histogram[-1]))
+
+            lines.append('# HELP bcrm_request_phase_seconds Time spent per request phase.')
+            lines.append('# TYPE bcrm_request_phase_seconds summary')
+            for (endpoint, name), (count, seconds) in sorted(self.phases.items()):
+                lines.append('bcrm_request_phase_seconds_count{} {}'.format(
+                    labels(endpoint=endpoint, phase=name), count))
+                lines.append('bcrm_request_phase_seconds_sum{} {!r}'.format(
+                    labels(endpoint=endpoint, phase=name), seconds))
+
+            lines.append('# HELP bcrm_sql_statements_total SQL statements executed.')
+            lines.append('# TYPE bcrm_sql_statements_total counter')
+            for endpoint, count in sorted(self.statements.items()):
+                lines.append('bcrm_sql_statements_total{} {}'.format(
+                    labels(endpoint=endpoint), count))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def server_timing(phases, statements, elapsed):
+    entries = []
+    for name, seconds in phases.items():
+        entry = '{};dur={:.2f}'.format(name, seconds * 1000)
+        if name == 'sql':
+            entry += ';desc="{} statements"'.format(statements)
+        entries.append(entry)
+    entries.append('total;dur={:.2f}'.format(elapsed * 1000))
+    return ', '.join(entries)
+
+
+def init_instrumentation(app):
+    """
+    Configures the instrumentation from the environment, does nothing
+    unless ``BCRM_INSTRUMENTATION`` is set
+    """
+    from app.core.db import env_flag
+    app.config['BCRM_INSTRUMENTATION'] = env_flag('BCRM_INSTRUMENTATION')
+    if not app.config['BCRM_INSTRUMENTATION']:
+        return
+    app.config['BCRM_PROFILE_SAMPLE_RATE'] = float(
+        os.environ.get('BCRM_PROFILE_SAMPLE_RATE') or 0)
+    app.config['BCRM_PROFILE_SLOW_MS'] = float(os.environ.get('BCRM_PROFILE_SLOW_MS') or 500)
+    app.config['BCRM_PROFILE_DIR'] = os.environ.get('BCRM_PROFILE_DIR') \
+        or os.path.join(tempfile.gettempdir(), 'bcrm-profiles')
+
+    listen_once()
+    app.json_encoder = TimedJSONEncoder
+
+    @app.before_request
+    def start_timing():
+        g.bcrm_timings = OrderedDict()
+        g.bcrm_statements = 0
+        g.bcrm_started = time.perf_counter()
+        if random.random() < app.config['BCRM_PROFILE_SAMPLE_RATE']:
+            g.bcrm_profile = cProfile.Profile()
+            g.bcrm_profile.enable()
+
+    @app.after_request
+    def report_timing(response):
+        phases = g.get('bcrm_timings')
+        if phases is None:
+            return response
+        elapsed = time.perf_counter() - g.bcrm_started
+        response.headers['Server-Timing'] = server_timing(phases, g.bcrm_statements, elapsed)
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe(request.method, endpoint, response.status_code, elapsed,
+                        phases, g.bcrm_statements)
+        return response
+
+    @app.teardown_request
+    def dump_profile(exc):
+        profile = g.pop('bcrm_profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        elapsed = time.perf_counter() - g.bcrm_started
+        if elapsed * 1000 < app.config['BCRM_PROFILE_SLOW_MS']:
+            return
+        directory = app.config['BCRM_PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{}-{}-{}.prof'.format(
+            int(time.time() * 1000), request.method, request.endpoint or 'unmatched'))
+        profile.dump_stats(path)
+        logger.info('slow request profile written to %s', path)
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
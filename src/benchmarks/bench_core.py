@@ -0,0 +1,80 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+"""
+Core Micro Benchmarks
+=====================
+
+Run with::
+
+    pip install -r benchmarks/requirements.txt
+    pytest benchmarks/bench_core.py
+
+Compare against a saved run with ``--benchmark-autosave`` and
+``--benchmark-compare``.
+"""
+import json
+from flask import jsonify
+from jsonschema import validate
+from app.core.models.entity import Entity, entity_schema
+from app.core.models.entity_type import EntityType
+from app.core.validation import ValidatorRegistry
+from app.decorators.rest import validate_payload_is_json, validate_payload_with_schema
+from benchmarks.documents import contact_schema, contact_content
+
+def test_entity_to_dict(benchmark):
+    entity = Entity(entity_type_id='bench', content=contact_content())
+    benchmark(entity.toDict)
+
+def test_entity_json_dumps(benchmark):
+    content = contact_content()
+    benchmark(json.dumps, content)
+
+def test_jsonify_entity(benchmark, app):
+    data = Entity(entity_type_id='bench', content=contact_content()).toDict()
+    with app.test_request_context():
+        benchmark(jsonify, data)
+
+def test_validate_payload_with_schema(benchmark, app):
+    payload = json.dumps({'entity_type_id': 'bench', 'content': contact_content()})
+
+    @validate_payload_is_json
+    @validate_payload_with_schema(entity_schema)
+    def view():
+        return 'ok'
+
+    def run():
+        with app.test_request_context('/api/entities', method='POST',
+                                      data=payload, content_type='application/json'):
+            return view()
+    benchmark(run)
+
+def test_content_validation_uncached(benchmark):
+    content = contact_content()
+    benchmark(validate, content, contact_schema)
+
+def test_content_validation_cached(benchmark):
+    registry = ValidatorRegistry()
+    entity_type = EntityType(name='bench', schema=contact_schema)
+    content = contact_content()
+    benchmark(lambda: registry.get(entity_type).validate(content))
+
+def test_create_entity_request(benchmark, client, entity_type_id):
+    payload = json.dumps({'entity_type_id': entity_type_id, 'content': contact_content()})
+    response = benchmark(client.post, '/api/entities',
+                         data=payload, content_type='application/json')
+    assert response.status_code == 201
+
+def test_update_entity_request(benchmark, client, entity_type_id, entity_id):
+    payload = json.dumps({'entity_type_id': entity_type_id, 'content': contact_content()})
+    response = benchmark(client.put, '/api/entities/{}'.format(entity_id),
+                         data=payload, content_type='application/json')
+    assert response.status_code == 200
+
+def test_get_entity_request(benchmark, client, entity_id):
+    response = benchmark(client.get, '/api/entities/{}'.format(entity_id))
+    assert response.status_code == 200
+
+def test_list_entities_request(benchmark, client, entity_type_id):
+    response = benchmark(client.get, '/api/entities?entity_type_id={}&limit=50'.format(entity_type_id))
+    assert response.status_code == 200
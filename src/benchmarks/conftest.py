@@ -0,0 +1,51 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+"""
+Benchmark Fixtures
+==================
+
+Benchmarks run against in-memory SQLite unless ``BCRM_BENCH_DATABASE_URI``
+points to another database, e.g. a local PostgreSQL::
+
+    BCRM_BENCH_DATABASE_URI=postgresql://bcrm@localhost/bcrm_bench \\
+        pytest benchmarks/bench_core.py
+"""
+import json
+import os
+import pytest
+
+from app import create_app
+from app.core.db import db as _db
+from benchmarks.documents import contact_schema, contact_content
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=os.environ.get('BCRM_BENCH_DATABASE_URI') or 'sqlite:///:memory:'
+    )
+    with app.app_context():
+        _db.create_all()
+        yield app
+        _db.session.remove()
+        _db.drop_all()
+
+@pytest.fixture(scope='session')
+def client(app):
+    return app.test_client()
+
+@pytest.fixture(scope='session')
+def entity_type_id(client):
+    response = client.post('/api/entity-types',
+        data=json.dumps({'name': 'bench_contact', 'schema': contact_schema}),
+        content_type='application/json')
+    return response.get_json()['id']
+
+@pytest.fixture(scope='session')
+def entity_id(client, entity_type_id):
+    response = client.post('/api/entities',
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': contact_content()}),
+        content_type='application/json')
+    return response.get_json()['id']
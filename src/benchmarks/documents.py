@@ -0,0 +1,60 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+"""
+Benchmark Documents
+===================
+
+A CRM contact type and contents shaped like production records: a few
+indexed scalar fields and a large notes history.
+"""
+import random
+import string
+
+contact_schema = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+        'email': {'type': 'string', 'x-bcrm-index': True},
+        'phone': {'type': 'string'},
+        'stage': {'type': 'string', 'enum': ['lead', 'qualified', 'customer', 'lost']},
+        'amount': {'type': 'number', 'minimum': 0},
+        'company': {
+            'type': 'object',
+            'properties': {
+                'name': {'type': 'string'},
+                'size': {'type': 'integer'},
+            },
+        },
+        'notes': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'at': {'type': 'string'},
+                    'text': {'type': 'string'},
+                },
+                'required': ['at', 'text'],
+            },
+        },
+    },
+    'required': ['name', 'email'],
+}
+
+def random_text(length, rng=random):
+    return ''.join(rng.choice(string.ascii_lowercase + ' ') for _ in range(length))
+
+def contact_content(notes=20, rng=random):
+    name = random_text(12, rng).strip() or 'contact'
+    return {
+        'name': name,
+        'email': '{}@example.com'.format(name.replace(' ', '.')),
+        'phone': ''.join(rng.choice(string.digits) for _ in range(10)),
+        'stage': rng.choice(['lead', 'qualified', 'customer', 'lost']),
+        'amount': round(rng.random() * 10000, 2),
+        'company': {'name': random_text(10, rng), 'size': rng.randint(1, 5000)},
+        'notes': [
+            {'at': '2019-03-{:02d}T10:00:00Z'.format(i % 28 + 1), 'text': random_text(200, rng)}
+            for i in range(notes)
+        ],
+    }
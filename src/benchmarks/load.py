@@ -0,0 +1,209 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+"""
+Scenario Load Generator
+=======================
+
+Drives the core api with a weighted mix of create, read, update and list
+requests from concurrent clients and reports throughput and p50/p95/p99
+latency per operation.
+
+Against a running server (flask run, uWSGI behind nginx, ...)::
+
+    python -m benchmarks.load --url http://127.0.0.1:5000 --duration 30
+
+In process, against a throwaway SQLite file or any database url::
+
+    python -m benchmarks.load --in-process --database-uri postgresql://bcrm@localhost/bcrm_bench
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from benchmarks.documents import contact_schema, contact_content
+
+DEFAULT_MIX = 'create=20,read=50,update=20,list=10'
+
+class HttpClient(object):
+    """ Minimal json client over urllib """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = Request(self.url + path, data=data, method=method,
+                          headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(request) as response:
+                return response.status, json.loads(response.read().decode('utf-8') or 'null')
+        except HTTPError as error:
+            return error.code, None
+
+class AppClient(object):
+    """ Same interface as :class:`HttpClient` over the Flask test client """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, payload=None):
+        data = None if payload is None else json.dumps(payload)
+        response = self.client.open(path, method=method, data=data,
+                                    content_type='application/json')
+        return response.status_code, response.get_json()
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = int(weight)
+    return weights
+
+class Scenario(object):
+    """ Weighted mix of core api operations """
+
+    def __init__(self, client, mix, seed_entities=100):
+        self.client = client
+        self.operations = list(mix.keys())
+        self.cumulative = list(itertools.accumulate(mix[name] for name in self.operations))
+        self.entity_ids = []
+        self.lock = threading.Lock()
+
+        status, entity_type = client.request('POST', '/api/entity-types', {
+            'name': 'load_contact_{}'.format(uuid.uuid4().hex[:8]),
+            'schema': contact_schema,
+        })
+        if status != 201:
+            raise RuntimeError('could not create the entity type, status {}'.format(status))
+        self.entity_type_id = entity_type['id']
+        for _ in range(seed_entities):
+            self.create(random)
+
+    def pick_operation(self, rng):
+        return self.operations[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+    def pick_entity(self, rng):
+        with self.lock:
+            return rng.choice(self.entity_ids)
+
+    def create(self, rng):
+        status, entity = self.client.request('POST', '/api/entities', {
+            'entity_type_id': self.entity_type_id,
+            'content': contact_content(rng=rng),
+        })
+        if status == 201:
+            with self.lock:
+                self.entity_ids.append(entity['id'])
+        return status
+
+    def read(self, rng):
+        return self.client.request('GET', '/api/entities/{}'.format(self.pick_entity(rng)))[0]
+
+    def update(self, rng):
+        return self.client.request('PUT', '/api/entities/{}'.format(self.pick_entity(rng)), {
+            'entity_type_id': self.entity_type_id,
+            'content': contact_content(rng=rng),
+        })[0]
+
+    def list(self, rng):
+        return self.client.request(
+            'GET', '/api/entities?entity_type_id={}&limit=50'.format(self.entity_type_id)
+        )[0]
+
+    def run(self, concurrency, duration):
+        """
+        Returns ``{operation: (latencies, errors)}`` with sorted latencies in
+        seconds, and the wall time of the run
+        """
+        results = dict((name, ([], [0])) for name in self.operations)
+        deadline = time.time() + duration
+
+        def worker(seed):
+            rng = random.Random(seed)
+            while time.time() < deadline:
+                name = self.pick_operation(rng)
+                started = time.perf_counter()
+                status = getattr(self, name)(rng)
+                elapsed = time.perf_counter() - started
+                latencies, errors = results[name]
+                latencies.append(elapsed)
+                if status >= 400:
+                    errors[0] += 1
+
+        started = time.time()
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.time() - started
+
+        for latencies, _ in results.values():
+            latencies.sort()
+        return results, wall
+
+def report(results, wall):
+    lines = ['{:<8} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}'.format(
+        'op', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms')]
+    total = 0
+    for name, (latencies, errors) in sorted(results.items()):
+        total += len(latencies)
+        lines.append('{:<8} {:>8} {:>7} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            name, len(latencies), errors[0], len(latencies) / wall,
+            percentile(latencies, 0.50) * 1000,
+            percentile(latencies, 0.95) * 1000,
+            percentile(latencies, 0.99) * 1000,
+        ))
+    lines.append('total {} requests in {:.1f}s, {:.1f} req/s'.format(total, wall, total / wall))
+    return '\n'.join(lines)
+
+def in_process_client(database_uri):
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_uri
+    from app import create_app
+    from app.core.db import db
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+    return AppClient(app)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[4])
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Server to load.')
+    parser.add_argument('--in-process', action='store_true',
+                        help='Drive a Flask app in this process instead of a server.')
+    parser.add_argument('--database-uri', default=None,
+                        help='Database of the in process app, a temporary SQLite file by default.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Operation weights.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--seed-entities', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.in_process:
+        database_uri = args.database_uri or 'sqlite:///{}'.format(
+            os.path.join(tempfile.mkdtemp(), 'bcrm_load.db'))
+        client = in_process_client(database_uri)
+    else:
+        client = HttpClient(args.url)
+
+    scenario = Scenario(client, parse_mix(args.mix), args.seed_entities)
+    results, wall = scenario.run(args.concurrency, args.duration)
+    print(report(results, wall))
+
+if __name__ == '__main__':
+    main()
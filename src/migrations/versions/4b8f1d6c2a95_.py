@@ -0,0 +1,33 @@
+"""exact rollup totals on sqlite
+
+Revision ID: 4b8f1d6c2a95
+Revises: 7c1e4a9b3f28
+Create Date: 2019-05-11 10:05:12.418220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8f1d6c2a95'
+down_revision = '7c1e4a9b3f28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the column is NUMERIC on PostgreSQL already
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('entity_rollup') as batch_op:
+        batch_op.alter_column('total', existing_type=sa.Float(), type_=sa.Text(),
+                              existing_nullable=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('entity_rollup') as batch_op:
+        batch_op.alter_column('total', existing_type=sa.Text(), type_=sa.Float(),
+                              existing_nullable=False)
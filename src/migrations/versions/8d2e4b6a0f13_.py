@@ -0,0 +1,39 @@
+"""jsonb content
+
+Revision ID: 8d2e4b6a0f13
+Revises: 3f5a1c9d2b7e
+Create Date: 2019-03-09 11:42:27.108446
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e4b6a0f13'
+down_revision = '3f5a1c9d2b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # content stays TEXT on databases without JSONB, queried with JSON1 functions
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.alter_column('entity', 'content', type_=postgresql.JSONB(),
+                    postgresql_using='content::jsonb')
+    op.alter_column('entity_type', 'schema', type_=postgresql.JSONB(),
+                    postgresql_using='schema::jsonb')
+    op.create_index('ix_entity_content', 'entity', ['content'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'content': 'jsonb_path_ops'})
+
+
+def downgrade():
+    if op.get_context().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_entity_content', table_name='entity')
+    op.alter_column('entity_type', 'schema', type_=sa.Text(),
+                    postgresql_using='schema::text')
+    op.alter_column('entity', 'content', type_=sa.Text(),
+                    postgresql_using='content::text')
@@ -0,0 +1,42 @@
+"""entity search
+
+Revision ID: a6d31f08be47
+Revises: 2f8e6a3c7d95
+Create Date: 2019-04-20 11:26:53.470182
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d31f08be47'
+down_revision = '2f8e6a3c7d95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tsvector with a GIN index on PostgreSQL, a FTS5 table anywhere else,
+    # existing entities are indexed with flask reindex-search
+    if op.get_context().dialect.name == 'postgresql':
+        op.execute(
+            'CREATE TABLE entity_search ('
+            'entity_id VARCHAR(60) PRIMARY KEY, '
+            'entity_type_id VARCHAR(60) NOT NULL, '
+            'document TSVECTOR NOT NULL)'
+        )
+        op.create_index('ix_entity_search_document', 'entity_search', ['document'], unique=False,
+                        postgresql_using='gin')
+        op.create_index('ix_entity_search_entity_type_id', 'entity_search', ['entity_type_id'],
+                        unique=False)
+    else:
+        op.execute(
+            "CREATE VIRTUAL TABLE entity_search USING fts5("
+            "entity_id UNINDEXED, entity_type_id UNINDEXED, document, "
+            "tokenize='unicode61 remove_diacritics 1', prefix='2 3')"
+        )
+
+
+def downgrade():
+    op.execute('DROP TABLE entity_search')
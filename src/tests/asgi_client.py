@@ -0,0 +1,101 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+"""
+ASGI Test Client
+================
+Drives an ASGI application through the interface of the Flask test client,
+so the ASGI entry point is tested like the Flask application.
+"""
+import asyncio
+from flask import Response
+from werkzeug.test import EnvironBuilder
+
+def scope_headers(environ):
+    headers = []
+    for key, value in environ.items():
+        if key in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+            continue
+        if key.startswith('HTTP_'):
+            name = key[5:]
+        elif key in ('CONTENT_TYPE', 'CONTENT_LENGTH') and value:
+            name = key
+        else:
+            continue
+        headers.append((name.lower().replace('_', '-').encode('latin-1'), value.encode('latin-1')))
+    return headers
+
+class AsgiClient(object):
+    """ Flask test client interface over an ASGI application """
+
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+        self.loop = asyncio.new_event_loop()
+
+    def open(self, *args, **kwargs):
+        builder = EnvironBuilder(*args, **kwargs)
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+        body = environ['wsgi.input'].read()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': environ['REQUEST_METHOD'],
+            'scheme': 'http',
+            'path': environ['PATH_INFO'].encode('latin-1').decode('utf-8'),
+            'query_string': environ['QUERY_STRING'].encode('latin-1'),
+            'root_path': environ['SCRIPT_NAME'].encode('latin-1').decode('utf-8'),
+            'headers': scope_headers(environ),
+            'server': ('localhost', 80),
+            'client': ('127.0.0.1', 0),
+        }
+        messages = []
+        received = []
+
+        async def receive():
+            if received:
+                # the client stays connected until the response is complete
+                await asyncio.Event().wait()
+            received.append(body)
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(self.asgi_app(scope, receive, send))
+        start = messages[0]
+        return Response(
+            b''.join(message.get('body', b'') for message in messages[1:]),
+            status=start['status'],
+            headers=[
+                (name.decode('latin-1'), value.decode('latin-1'))
+                for name, value in start['headers']
+            ]
+        )
+
+    def get(self, *args, **kwargs):
+        kwargs['method'] = 'GET'
+        return self.open(*args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        kwargs['method'] = 'POST'
+        return self.open(*args, **kwargs)
+
+    def put(self, *args, **kwargs):
+        kwargs['method'] = 'PUT'
+        return self.open(*args, **kwargs)
+
+    def patch(self, *args, **kwargs):
+        kwargs['method'] = 'PATCH'
+        return self.open(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        kwargs['method'] = 'DELETE'
+        return self.open(*args, **kwargs)
+
+    def close(self):
+        self.loop.run_until_complete(self.asgi_app.shutdown())
+        self.loop.close()
@@ -0,0 +1,193 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Aggregation Tests
+==============
+'''
+import json
+from app.core import aggregation
+from app.core.db import db
+from app.core.models.entity_rollup import EntityRollup
+
+deal_schema = {
+    'type': 'object',
+    'properties': {
+        'stage': {'type': 'string'},
+        'owner': {'type': 'string'},
+        'amount': {'type': ['number', 'string']},
+    },
+}
+
+rollup_schema = dict(deal_schema, **{
+    'x-bcrm-rollups': {
+        'by_stage': {'group_by': ['stage'], 'sum': ['amount']},
+        'total': {'sum': ['amount']},
+    }
+})
+
+deals = [
+    {'stage': 'won', 'owner': 'ada', 'amount': 100},
+    {'stage': 'won', 'owner': 'bob', 'amount': 200.5},
+    {'stage': 'lost', 'owner': 'ada', 'amount': 50},
+    {'stage': 'open', 'owner': 'bob'},
+    {'owner': 'bob', 'amount': 'n/a'},
+]
+
+def create_deals(client, name, schema=deal_schema, contents=deals):
+    response = client.post('/api/entity-types',
+        data=json.dumps({'name': name, 'schema': schema}),
+        content_type='application/json')
+    assert response.status_code == 201
+    entity_type_id = response.get_json()['id']
+    response = client.post('/api/entities:batch',
+        data=json.dumps([
+            {'entity_type_id': entity_type_id, 'content': content} for content in contents
+        ]),
+        content_type='application/json')
+    assert response.status_code == 201
+    return entity_type_id, [item['id'] for item in response.get_json()['results']]
+
+def aggregate(client, entity_type_id, **args):
+    args['entity_type_id'] = entity_type_id
+    response = client.get('/api/entities:aggregate', query_string=args)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def rollup_rows(entity_type_id):
+    return db.session.query(EntityRollup).filter(EntityRollup.entity_type_id == entity_type_id).count()
+
+def test_aggregate_count(client):
+    entity_type_id, _ = create_deals(client, 'test_aggregate_count')
+    assert aggregate(client, entity_type_id) == [{'group': {}, 'count': 5}]
+    assert aggregate(client, entity_type_id, **{'content.owner': 'ada'}) == [
+        {'group': {}, 'count': 2}
+    ]
+
+def test_aggregate_group_by(client):
+    entity_type_id, _ = create_deals(client, 'test_aggregate_group_by')
+    results = aggregate(client, entity_type_id, group_by='content.stage', metric=[
+        'count', 'sum:content.amount', 'min:content.amount', 'max:content.amount',
+        'avg:content.amount'
+    ])
+    assert results == [
+        {'group': {'content.stage': 'lost'}, 'count': 1, 'sum:content.amount': 50,
+         'min:content.amount': 50, 'max:content.amount': 50, 'avg:content.amount': 50},
+        {'group': {'content.stage': 'open'}, 'count': 1, 'sum:content.amount': None,
+         'min:content.amount': None, 'max:content.amount': None, 'avg:content.amount': None},
+        {'group': {'content.stage': 'won'}, 'count': 2, 'sum:content.amount': 300.5,
+         'min:content.amount': 100, 'max:content.amount': 200.5, 'avg:content.amount': 150.25},
+        {'group': {'content.stage': None}, 'count': 1, 'sum:content.amount': None,
+         'min:content.amount': None, 'max:content.amount': None, 'avg:content.amount': None},
+    ]
+
+    results = aggregate(client, entity_type_id, group_by=['content.owner', 'content.stage'],
+        **{'content.amount': 'gt:60'})
+    assert results == [
+        {'group': {'content.owner': 'ada', 'content.stage': 'won'}, 'count': 1},
+        {'group': {'content.owner': 'bob', 'content.stage': 'won'}, 'count': 1},
+    ]
+
+def test_aggregate_invalid_arguments(client):
+    entity_type_id, _ = create_deals(client, 'test_aggregate_invalid_arguments', contents=[{}])
+    for args in ({'group_by': 'stage'}, {'metric': 'median:content.amount'},
+                 {'metric': 'sum'}, {'metric': 'sum:content.'},
+                 {'group_by': ['content.a', 'content.b', 'content.c', 'content.d']},
+                 {'content': 'x'}):
+        args['entity_type_id'] = entity_type_id
+        assert client.get('/api/entities:aggregate', query_string=args).status_code == 400, args
+    assert client.get('/api/entities:aggregate').status_code == 400
+    assert client.get('/api/entities:aggregate?entity_type_id=unknown').status_code == 404
+
+def test_rollups_match_aggregation(client):
+    entity_type_id, ids = create_deals(client, 'test_rollups_match_aggregation', rollup_schema)
+    assert rollup_rows(entity_type_id) > 0
+
+    def computed(**args):
+        # max is not kept by rollups, the aggregation runs over the entities
+        results = aggregate(client, entity_type_id,
+            metric=args.pop('metric') + ['max:content.amount'], **args)
+        for result in results:
+            del result['max:content.amount']
+        return results
+
+    def check():
+        metrics = ['count', 'sum:content.amount', 'avg:content.amount']
+        from_rollup = aggregate(client, entity_type_id, group_by='content.stage', metric=metrics)
+        assert from_rollup == computed(group_by='content.stage', metric=metrics)
+        assert aggregate(client, entity_type_id, metric=metrics) == computed(metric=metrics)
+        return from_rollup
+
+    check()
+    response = client.put('/api/entities/{}'.format(ids[0]),
+        data=json.dumps({'entity_type_id': entity_type_id,
+                         'content': {'stage': 'lost', 'amount': 30}}),
+        content_type='application/json')
+    assert response.status_code == 200
+    response = client.patch('/api/entities/{}'.format(ids[3]),
+        data=json.dumps({'stage': 'won', 'amount': 7}),
+        content_type='application/merge-patch+json')
+    assert response.status_code == 200
+    assert client.delete('/api/entities/{}'.format(ids[2])).status_code == 200
+    response = client.post('/api/entities:bulkUpdate?entity_type_id={}&content.stage=won'
+        .format(entity_type_id),
+        data=json.dumps({'patch': {'owner': 'eve'}}),
+        content_type='application/json')
+    assert response.status_code == 200
+    results = check()
+    assert results[0] == {'group': {'content.stage': 'lost'}, 'count': 1,
+                          'sum:content.amount': 30, 'avg:content.amount': 30}
+
+    response = client.post('/api/entities:bulkDelete?entity_type_id={}&content.stage=lost'
+        .format(entity_type_id))
+    assert response.status_code == 200
+    assert [result['group'] for result in check()] == [
+        {'content.stage': 'won'}, {'content.stage': None}
+    ]
+
+def test_rollups_follow_schema_changes(client):
+    name = 'test_rollups_follow_schema_changes'
+    entity_type_id, _ = create_deals(client, name)
+    assert rollup_rows(entity_type_id) == 0
+
+    response = client.put('/api/entity-types/{}'.format(entity_type_id),
+        data=json.dumps({'name': name, 'schema': rollup_schema}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert rollup_rows(entity_type_id) > 0
+    assert aggregate(client, entity_type_id, metric='sum:content.amount') == [
+        {'group': {}, 'sum:content.amount': 350.5}
+    ]
+
+    table = EntityRollup.__table__
+    db.session.begin()
+    db.session.execute(table.update().where(table.c.entity_type_id == entity_type_id)
+        .where(table.c.rollup == 'total').where(table.c.field == 'amount').values(total=1))
+    db.session.commit()
+    assert aggregate(client, entity_type_id, metric='sum:content.amount') == [
+        {'group': {}, 'sum:content.amount': 1}
+    ]
+
+    response = client.delete('/api/entity-types/{}?cascade=true'.format(entity_type_id))
+    assert response.status_code == 200
+    assert rollup_rows(entity_type_id) == 0
+
+def test_rollup_totals_are_exact(client):
+    contents = [{'stage': 'won', 'amount': 0.1} for _ in range(3)] + [{'stage': 'won', 'amount': 1}]
+    entity_type_id, ids = create_deals(client, 'test_rollup_totals_are_exact', rollup_schema, contents)
+    for entity_id in ids[:3]:
+        assert client.delete('/api/entities/{}'.format(entity_id)).status_code == 200
+    assert aggregate(client, entity_type_id, group_by='content.stage',
+                     metric=['count', 'sum:content.amount']) == [
+        {'group': {'content.stage': 'won'}, 'count': 1, 'sum:content.amount': 1}
+    ]
+    assert db.session.query(EntityRollup.total).filter(
+        EntityRollup.entity_type_id == entity_type_id,
+        EntityRollup.field == 'amount').distinct().all() == [(1,)]
+
+def test_rollup_groups_are_bounded(client, monkeypatch):
+    entity_type_id, _ = create_deals(client, 'test_rollup_groups_are_bounded', rollup_schema)
+    monkeypatch.setattr(aggregation, 'MAX_GROUPS', 2)
+    response = client.get('/api/entities:aggregate', query_string={
+        'entity_type_id': entity_type_id, 'group_by': 'content.stage'})
+    assert response.status_code == 400
@@ -0,0 +1,90 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Entity Batch Api Tests
+==============
+'''
+import json
+from test_entity_types import create_entity_type
+from test_entities import entity_stub
+
+def test_create_entities_batch_success(client):
+    entity_type_id = create_entity_type(client, 'test_create_entities_batch_success')
+    items = [{'entity_type_id': entity_type_id, 'content': {'n': i}} for i in range(5)]
+
+    response = client.post('/api/entities:batch',
+        data=json.dumps(items),
+        content_type='application/json')
+    json_data = response.get_json()
+    assert response.status_code == 201
+    assert json_data['created'] == 5
+    assert [result['index'] for result in json_data['results']] == list(range(5))
+
+    entity_id = json_data['results'][3]['id']
+    response = client.get('/api/entities/{}'.format(entity_id))
+    assert response.get_json()['content'] == {'n': 3}
+
+def test_create_entities_batch_ndjson(client):
+    entity_type_id = create_entity_type(client, 'test_create_entities_batch_ndjson')
+    lines = [json.dumps({'entity_type_id': entity_type_id, 'content': {'n': i}}) for i in range(3)]
+
+    response = client.post('/api/entities:batch',
+        data='\n'.join(lines) + '\n',
+        content_type='application/x-ndjson')
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 3
+
+def test_create_entities_batch_atomic_rejects_all(client):
+    entity_type_id = create_entity_type(client, 'test_create_entities_batch_atomic')
+    items = [
+        {'entity_type_id': entity_type_id, 'content': entity_stub['content']},
+        {'entity_type_id': entity_type_id, 'content': {'crap': 'crap'}},
+        {'entity_type_id': 'unknown', 'content': entity_stub['content']},
+        {'content': entity_stub['content']},
+    ]
+
+    response = client.post('/api/entities:batch',
+        data=json.dumps(items),
+        content_type='application/json')
+    json_data = response.get_json()
+    assert response.status_code == 400
+    assert [result['status'] for result in json_data['results']] == [424, 400, 400, 400]
+    assert 'id' not in json_data['results'][0]
+    assert json_data['results'][1]['message'] == "Entity content does not match type schema"
+    assert json_data['results'][2]['message'] == "Entity type id 'unknown' does not exist"
+    assert json_data['results'][3]['message'] == "'entity_type_id' is a required property"
+
+    response = client.get('/api/entities?entity_type_id={}'.format(entity_type_id))
+    assert response.get_json() == []
+
+def test_create_entities_batch_partial(client):
+    entity_type_id = create_entity_type(client, 'test_create_entities_batch_partial')
+    items = [
+        {'entity_type_id': entity_type_id, 'content': entity_stub['content']},
+        {'entity_type_id': entity_type_id, 'content': {'crap': 'crap'}},
+    ]
+
+    response = client.post('/api/entities:batch?mode=partial',
+        data=json.dumps(items),
+        content_type='application/json')
+    json_data = response.get_json()
+    assert response.status_code == 207
+    assert json_data['created'] == 1
+
+    response = client.get('/api/entities?entity_type_id={}'.format(entity_type_id))
+    assert [entity['id'] for entity in response.get_json()] == [json_data['results'][0]['id']]
+
+def test_create_entities_batch_not_array(client):
+    response = client.post('/api/entities:batch',
+        data=json.dumps(entity_stub),
+        content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'payload is not a json array'
+
+def test_create_entities_batch_invalid_ndjson(client):
+    response = client.post('/api/entities:batch',
+        data='{}\n{nope\n',
+        content_type='application/x-ndjson')
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'line 2 is not json'
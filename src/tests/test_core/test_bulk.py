@@ -0,0 +1,149 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Bulk Update and Delete Tests
+==============
+'''
+import json
+import pytest
+from app.core.db import db
+from app.core.models.entity import Entity
+from app.core.models.entity_index import EntityIndex
+
+lead_schema = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string', 'x-bcrm-index': True},
+        'status': {'enum': ['new', 'stale', 'lost']},
+    },
+    'required': ['name'],
+}
+
+def create_leads(client, name, statuses):
+    response = client.post('/api/entity-types',
+        data=json.dumps({'name': name, 'schema': lead_schema}),
+        content_type='application/json')
+    assert response.status_code == 201
+    entity_type_id = response.get_json()['id']
+    response = client.post('/api/entities:batch',
+        data=json.dumps([
+            {'entity_type_id': entity_type_id, 'content': {'name': str(index), 'status': status}}
+            for index, status in enumerate(statuses)
+        ]),
+        content_type='application/json')
+    assert response.status_code == 201
+    return entity_type_id, [result['id'] for result in response.get_json()['results']]
+
+def statuses(client, entity_type_id):
+    response = client.get('/api/entities?entity_type_id={}'.format(entity_type_id))
+    return sorted(entity['content'].get('status') for entity in response.get_json())
+
+@pytest.fixture
+def small_chunks(app):
+    chunk_size = app.config['BCRM_BATCH_CHUNK_SIZE']
+    app.config['BCRM_BATCH_CHUNK_SIZE'] = 2
+    yield
+    app.config['BCRM_BATCH_CHUNK_SIZE'] = chunk_size
+
+def test_bulk_delete_by_filter(client, small_chunks):
+    entity_type_id, _ = create_leads(client, 'test_bulk_delete_by_filter',
+        ['new', 'lost', 'lost', 'stale', 'lost'])
+    response = client.post('/api/entities:bulkDelete?entity_type_id={}&content.status=lost'
+        .format(entity_type_id))
+    assert response.status_code == 200
+    assert response.get_json() == {'deleted': 3}
+    assert statuses(client, entity_type_id) == ['new', 'stale']
+
+def test_bulk_delete_by_ids(client, small_chunks):
+    entity_type_id, ids = create_leads(client, 'test_bulk_delete_by_ids', ['new', 'lost', 'stale'])
+    response = client.post('/api/entities:bulkDelete',
+        data=json.dumps({'ids': ids[:2] + ['missing']}),
+        content_type='application/json')
+    assert response.get_json() == {'deleted': 2}
+    assert statuses(client, entity_type_id) == ['stale']
+    assert db.session.query(EntityIndex).filter(EntityIndex.entity_id.in_(ids[:2])).count() == 0
+
+def test_bulk_update(client, small_chunks):
+    entity_type_id, ids = create_leads(client, 'test_bulk_update', ['new', 'stale', 'stale'])
+    response = client.get('/api/entities/{}'.format(ids[1]))
+    assert response.get_json()['content']['status'] == 'stale'
+
+    response = client.post('/api/entities:bulkUpdate?entity_type_id={}&content.status=stale'
+        .format(entity_type_id),
+        data=json.dumps({'patch': {'status': 'lost', 'name': 'archived'}}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert response.get_json() == {'updated': 2}
+    assert statuses(client, entity_type_id) == ['lost', 'lost', 'new']
+
+    response = client.get('/api/entities/{}'.format(ids[1]))
+    assert response.get_json()['content'] == {'name': 'archived', 'status': 'lost'}
+    assert response.headers['ETag'] == '"2"'
+    response = client.get('/api/entities?entity_type_id={}&content.name=archived'
+        .format(entity_type_id))
+    assert len(response.get_json()) == 2
+
+def test_bulk_update_stores_hook_content(client):
+    entity_type_id, ids = create_leads(client, 'test_bulk_update_stores_hook_content', ['new'])
+    patch = {'owner': {'name': 'ann', 'phone': None}, 'tags': ['a', {'b': None}]}
+    response = client.post('/api/entities:bulkUpdate',
+        data=json.dumps({'ids': ids, 'patch': patch}),
+        content_type='application/json')
+    assert response.get_json() == {'updated': 1}
+
+    stored = client.get('/api/entities/{}'.format(ids[0])).get_json()['content']
+    assert stored['owner'] == {'name': 'ann'}
+    assert stored['tags'] == ['a', {'b': None}]
+    changes = client.get('/api/changes?entity_type_id={}'.format(entity_type_id)).get_json()
+    assert [change['op'] for change in changes] == ['create', 'update']
+    assert changes[-1]['content'] == stored
+
+def test_bulk_update_invalid_content(client):
+    entity_type_id, ids = create_leads(client, 'test_bulk_update_invalid', ['new'])
+    response = client.post('/api/entities:bulkUpdate',
+        data=json.dumps({'ids': ids, 'patch': {'name': None}}),
+        content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json() == {
+        'message': 'Entity content does not match type schema',
+        'id': ids[0],
+        'updated': 0,
+    }
+    assert statuses(client, entity_type_id) == ['new']
+
+@pytest.mark.parametrize('path, payload, message', [
+    ('/api/entities:bulkDelete', None, 'bulk operations need ids, entity_type_id or a content filter'),
+    ('/api/entities:bulkDelete', {'ids': 'a'}, "'a' is not of type 'array'"),
+    ('/api/entities:bulkUpdate', {'ids': ['a']}, "'patch' is a required property"),
+])
+def test_bulk_invalid_request(client, path, payload, message):
+    response = client.post(path,
+        data=None if payload is None else json.dumps(payload),
+        content_type='application/json')
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
+
+def test_delete_entity_type_with_entities(client):
+    entity_type_id, _ = create_leads(client, 'test_delete_entity_type_with_entities', ['new'])
+    response = client.delete('/api/entity-types/{}'.format(entity_type_id))
+    assert response.status_code == 409
+
+def test_delete_entity_type_cascade(client, small_chunks):
+    entity_type_id, _ = create_leads(client, 'test_delete_entity_type_cascade',
+        ['new', 'lost', 'stale'])
+    response = client.delete('/api/entity-types/{}?cascade=true'.format(entity_type_id))
+    assert response.status_code == 200
+    assert client.get('/api/entity-types/{}'.format(entity_type_id)).status_code == 404
+    assert db.session.query(Entity).filter(Entity.entityTypeId == entity_type_id).count() == 0
+    assert db.session.query(EntityIndex) \
+        .filter(EntityIndex.entity_type_id == entity_type_id).count() == 0
+
+def test_delete_entity_type_cascade_with_filter(client):
+    entity_type_id, _ = create_leads(client, 'test_delete_entity_type_cascade_with_filter',
+        ['new', 'lost', 'stale'])
+    response = client.delete('/api/entity-types/{}?cascade=true&content.status=lost'
+        .format(entity_type_id))
+    assert response.status_code == 400
+    assert statuses(client, entity_type_id) == ['lost', 'new', 'stale']
+    assert client.get('/api/entity-types/{}'.format(entity_type_id)).status_code == 200
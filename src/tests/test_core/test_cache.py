@@ -0,0 +1,96 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Read Cache Tests
+==============
+'''
+import json
+import time
+from app.core.cache import TOMBSTONE, LocalCache, TieredCache, cache
+from app.core.db import db
+from app.core.lookups import entity_key, get_entity
+from app.core.models.entity import Entity
+from test_entities import create_entity
+
+def test_local_cache_lru():
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+def test_local_cache_ttl():
+    cache = LocalCache(ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+def test_tiered_cache_fills_local_from_shared():
+    shared = LocalCache(ttl=60)
+    cache = TieredCache(LocalCache(ttl=60), shared)
+    shared.set('a', [1, 2])
+    assert cache.get('a') == [1, 2]
+    assert cache.local.get('a') == [1, 2]
+
+    cache.delete('a')
+    assert cache.get('a') is None
+    assert shared.get('a') is None
+
+def test_tiered_cache_add_and_tombstone():
+    shared = LocalCache(ttl=60)
+    cache = TieredCache(LocalCache(ttl=60), shared)
+    cache.add('a', [1])
+    cache.add('a', [2])
+    assert cache.get('a') == [1]
+
+    cache.tombstone('a')
+    cache.add('a', [3])
+    assert cache.get('a') == TOMBSTONE
+    assert shared.get('a') == TOMBSTONE
+
+    cache.local.delete('a')
+    shared.set('b', [4])
+    cache.add('b', [5])
+    assert cache.local.get('b') is None
+
+def test_read_through_does_not_fill_over_tombstone(client):
+    entity_id = create_entity(client, 'test_read_through_does_not_fill_over_tombstone')
+    key = entity_key(entity_id)
+    cache.delete(key)
+    # a write committed while the entity was read
+    cache.tombstone(key)
+    assert get_entity(entity_id).id == entity_id
+    assert cache.get(key) == TOMBSTONE
+
+    cache.delete(key)
+    assert get_entity(entity_id).id == entity_id
+    assert cache.get(key)[0] == entity_id
+
+def test_entity_read_through_and_invalidation(client):
+    entity_id = create_entity(client, 'test_entity_read_through')
+    url = '/api/entities/{}'.format(entity_id)
+    assert client.get(url).get_json()['content'] == {'content': 'content'}
+
+    db.session.execute(
+        Entity.__table__.update().where(Entity.id == entity_id).values(content='{"behind": "cache"}')
+    )
+    assert client.get(url).get_json()['content'] == {'content': 'content'}
+
+    entity_type_id = client.get(url).get_json()['entity_type_id']
+    response = client.put(url,
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': {'test': 'new'}}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert client.get(url).get_json()['content'] == {'test': 'new'}
+
+def test_entity_delete_invalidates(client):
+    entity_id = create_entity(client, 'test_entity_delete_invalidates')
+    url = '/api/entities/{}'.format(entity_id)
+    assert client.get(url).status_code == 200
+
+    client.delete(url)
+    assert client.get(url).status_code == 404
@@ -0,0 +1,136 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Change Feed Tests
+==============
+'''
+import datetime
+import json
+import threading
+import time
+from sqlalchemy import func
+from app.core.changes import prune_changes
+from app.core.db import db
+from app.core.hooks import entities_written
+from app.core.models.entity_change import EntityChange
+from test_entities import create_entity
+
+def head():
+    return db.session.query(func.max(EntityChange.seq)).scalar() or 0
+
+def test_changes_follow_writes(client):
+    since = head()
+    entity_id = create_entity(client, 'test_changes_follow_writes')
+    entity_type_id = client.get('/api/entities/{}'.format(entity_id)).get_json()['entity_type_id']
+    response = client.put('/api/entities/{}'.format(entity_id),
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': {'content': 'updated'}}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert client.delete('/api/entities/{}'.format(entity_id)).status_code == 200
+
+    response = client.get('/api/changes?since={}'.format(since))
+    assert response.status_code == 200
+    changes = response.get_json()
+    assert [(change['op'], change['id'], change['content']) for change in changes] == [
+        ('create', entity_id, {'content': 'content'}),
+        ('update', entity_id, {'content': 'updated'}),
+        ('delete', entity_id, None),
+    ]
+    assert all(change['entity_type_id'] == entity_type_id for change in changes)
+    assert [change['seq'] for change in changes] == sorted(change['seq'] for change in changes)
+    assert 'since={}'.format(changes[-1]['seq']) in response.headers['Link']
+
+    response = client.get('/api/changes?since={}'.format(changes[-1]['seq']))
+    assert response.get_json() == []
+    assert 'since={}'.format(changes[-1]['seq']) in response.headers['Link']
+
+def test_changes_are_appended_on_commit(app):
+    since = head()
+    row = {'id': 'test_changes_are_appended_on_commit', 'entityTypeId': 'unknown', 'content': '{}'}
+    db.session.begin()
+    entities_written('delete', [row])
+    assert head() == since
+    db.session.rollback()
+    assert head() == since
+
+    db.session.begin()
+    entities_written('delete', [row])
+    db.session.commit()
+    change = db.session.query(EntityChange).filter(EntityChange.seq > since).one()
+    assert (change.op, change.entity_id) == ('delete', row['id'])
+
+def test_changes_by_entity_type(client):
+    since = head()
+    first = create_entity(client, 'test_changes_by_entity_type')
+    create_entity(client, 'test_changes_by_entity_type_other')
+    entity_type_id = client.get('/api/entities/{}'.format(first)).get_json()['entity_type_id']
+    second = client.post('/api/entities',
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': {'content': 'second'}}),
+        content_type='application/json').get_json()['id']
+
+    response = client.get('/api/changes?since={}&entity_type_id={}&limit=1'
+        .format(since, entity_type_id))
+    changes = response.get_json()
+    assert [change['id'] for change in changes] == [first]
+    assert 'entity_type_id={}'.format(entity_type_id) in response.headers['Link']
+
+    response = client.get('/api/changes?since={}&entity_type_id={}'
+        .format(changes[0]['seq'], entity_type_id))
+    assert [change['id'] for change in response.get_json()] == [second]
+
+def test_changes_invalid_arguments(client):
+    for query in ('since=x', 'since=-1', 'limit=0', 'limit=x', 'wait=x', 'wait=3600'):
+        response = client.get('/api/changes?{}'.format(query))
+        assert response.status_code == 400, query
+
+def test_changes_long_poll(app, client):
+    since = head()
+    writer = threading.Timer(0.2, create_entity, (app.test_client(), 'test_changes_long_poll'))
+    writer.start()
+    started = time.time()
+    response = client.get('/api/changes?since={}&wait=10'.format(since))
+    writer.join()
+    assert time.time() - started < 5
+    assert [change['op'] for change in response.get_json()] == ['create']
+
+def test_changes_long_poll_timeout(client):
+    since = head()
+    started = time.time()
+    response = client.get('/api/changes?since={}&wait=0.3'.format(since))
+    assert time.time() - started >= 0.3
+    assert response.get_json() == []
+
+def test_changes_event_stream(client):
+    since = head()
+    first = create_entity(client, 'test_changes_event_stream')
+    second = create_entity(client, 'test_changes_event_stream_second')
+
+    response = client.get('/api/changes?since={}&wait=0.2'.format(since),
+        headers={'Accept': 'text/event-stream'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = [
+        dict(line.split(': ', 1) for line in event.split('\n'))
+        for event in response.get_data(as_text=True).split('\n\n')
+        if event.startswith('id:')
+    ]
+    assert [json.loads(event['data'])['id'] for event in events] == [first, second]
+
+    response = client.get('/api/changes?wait=0',
+        headers={'Accept': 'text/event-stream', 'Last-Event-ID': events[0]['id']})
+    assert 'id: {}\n'.format(events[1]['id']) in response.get_data(as_text=True)
+
+def test_prune_changes(client):
+    since = head()
+    create_entity(client, 'test_prune_changes')
+    create_entity(client, 'test_prune_changes_recent')
+    db.session.begin()
+    db.session.execute(EntityChange.__table__.update()
+        .where(EntityChange.seq == since + 1)
+        .values(created=datetime.datetime.utcnow() - datetime.timedelta(days=31)))
+    db.session.commit()
+
+    assert prune_changes(30) == 1
+    response = client.get('/api/changes?since={}'.format(since))
+    assert [change['seq'] for change in response.get_json()] == [since + 2]
@@ -0,0 +1,88 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Conditional Request Tests
+==============
+'''
+import json
+from test_entity_types import create_entity_type, entity_type_stub
+from test_entities import create_entity
+
+def test_get_entity_not_modified(client):
+    entity_id = create_entity(client, 'test_get_entity_not_modified')
+    response = client.get('/api/entities/{}'.format(entity_id))
+    etag = response.headers['ETag']
+    assert etag == '"1"'
+
+    response = client.get('/api/entities/{}'.format(entity_id), headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == b''
+
+def test_get_entity_modified(client):
+    name = 'test_get_entity_modified'
+    entity_id = create_entity(client, name)
+    etag = client.get('/api/entities/{}'.format(entity_id)).headers['ETag']
+
+    entity_type_id = create_entity_type(client, name + '_updated')
+    response = client.put('/api/entities/{}'.format(entity_id),
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': {'test': 'new'}}),
+        content_type='application/json')
+    assert response.headers['ETag'] == '"2"'
+
+    response = client.get('/api/entities/{}'.format(entity_id), headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['content'] == {'test': 'new'}
+
+def test_get_entity_not_found_with_etag(client):
+    response = client.get('/api/entities/unknown', headers={'If-None-Match': '"1"'})
+    assert response.status_code == 404
+
+def test_update_entity_precondition_failed(client):
+    name = 'test_update_entity_precondition_failed'
+    entity_id = create_entity(client, name)
+    entity_type_id = create_entity_type(client, name + '_updated')
+
+    response = client.put('/api/entities/{}'.format(entity_id),
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': {'test': 'new'}}),
+        content_type='application/json',
+        headers={'If-Match': '"7"'})
+    assert response.status_code == 412
+    assert response.get_json()['message'] == 'Precondition failed'
+
+    response = client.put('/api/entities/{}'.format(entity_id),
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': {'test': 'new'}}),
+        content_type='application/json',
+        headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+
+def test_delete_entity_if_match(client):
+    entity_id = create_entity(client, 'test_delete_entity_if_match')
+
+    response = client.delete('/api/entities/{}'.format(entity_id), headers={'If-Match': '"2"'})
+    assert response.status_code == 412
+
+    response = client.delete('/api/entities/{}'.format(entity_id), headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+
+def test_entity_type_conditional(client):
+    name = 'test_entity_type_conditional'
+    entity_type_id = create_entity_type(client, name)
+    url = '/api/entity-types/{}'.format(entity_type_id)
+
+    response = client.get(url, headers={'If-None-Match': '"1"'})
+    assert response.status_code == 304
+
+    response = client.put(url,
+        data=json.dumps({'name': name, 'schema': entity_type_stub['schema']}),
+        content_type='application/json',
+        headers={'If-Match': '"2"'})
+    assert response.status_code == 412
+
+    response = client.put(url,
+        data=json.dumps({'name': name, 'schema': {'type': 'object'}}),
+        content_type='application/json',
+        headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"2"'
@@ -0,0 +1,56 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Database Engine Tests
+==============
+'''
+import os
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+from app.core.db import db
+
+def engine_options(uri, **config):
+    # an explicit root path, Flask 1.0 can not look it up through the
+    # import hook of pytest
+    app = Flask(__name__, root_path=os.path.dirname(os.path.abspath(__file__)))
+    app.config.update(
+        SQLALCHEMY_NATIVE_UNICODE=None,
+        SQLALCHEMY_POOL_PRE_PING=True,
+        BCRM_DB_STATEMENT_TIMEOUT=None,
+        BCRM_DB_PGBOUNCER=False,
+    )
+    app.config.update(config)
+    options = {'pool_size': 10}
+    db.apply_driver_hacks(app, make_url(uri), options)
+    return options
+
+def test_engine_options_postgresql():
+    options = engine_options('postgresql://bcrm@localhost/bcrm', BCRM_DB_STATEMENT_TIMEOUT=5000)
+    assert options['pool_size'] == 10
+    assert options['pool_pre_ping'] is True
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+
+def test_engine_options_pgbouncer():
+    options = engine_options('postgresql://bcrm@localhost/bcrm',
+        BCRM_DB_PGBOUNCER=True, BCRM_DB_STATEMENT_TIMEOUT=5000)
+    assert options['poolclass'] is NullPool
+    assert 'pool_size' not in options
+    assert 'connect_args' not in options
+
+def test_connection_from_other_process_is_replaced(tmpdir):
+    engine = create_engine('sqlite:///{}'.format(tmpdir.join('pid.db')), poolclass=QueuePool)
+    connection = engine.connect()
+    record = connection.connection._connection_record
+    first = record.connection
+    record.info['pid'] = -1
+    connection.close()
+
+    connection = engine.connect()
+    record = connection.connection._connection_record
+    assert record.connection is not first
+    assert record.info['pid'] == os.getpid()
+    connection.close()
+    engine.dispose()
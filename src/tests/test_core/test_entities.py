@@ -213,3 +213,38 @@ def test_update_entity_invalid_content(client):
     json_data = response.get_json()
     assert response.status_code == 400
     assert json_data['message'] == 'Entity content does not match type schema'
+
+def test_list_entities_by_type(client):
+    entity_type_id = create_entity_type(client, 'test_list_entities_by_type')
+    created = set()
+    for _ in range(3):
+        response = client.post('/api/entities',
+            data=json.dumps({'entity_type_id': entity_type_id, 'content': entity_stub['content']}),
+            content_type='application/json')
+        created.add(response.get_json()['id'])
+
+    response = client.get('/api/entities?entity_type_id={}&limit=2'.format(entity_type_id))
+    first_page = response.get_json()
+    assert response.status_code == 200
+    assert len(first_page) == 2
+    assert 'rel="next"' in response.headers['Link']
+
+    next_url = response.headers['Link'].split(';')[0].strip('<>')
+    response = client.get(next_url)
+    second_page = response.get_json()
+    assert response.status_code == 200
+    assert len(second_page) == 1
+    assert 'Link' not in response.headers
+    assert set(item['id'] for item in first_page + second_page) == created
+    assert all(item['entity_type_id'] == entity_type_id for item in first_page + second_page)
+
+def test_list_entities_unknown_type(client):
+    response = client.get('/api/entities?entity_type_id=unknown')
+    assert response.status_code == 200
+    assert response.get_json() == []
+
+def test_list_entities_invalid_limit(client):
+    response = client.get('/api/entities?limit=0')
+    json_data = response.get_json()
+    assert response.status_code == 400
+    assert json_data['message'] == 'limit must be between 1 and 500'
@@ -203,4 +203,33 @@ def test_delete_entity_type_not_found(client):
     response = client.delete('/api/entity-types/' + entity_type_id)
     json_data = response.get_json()
     assert response.status_code == 404
-    assert json_data['message'] == 'Not found'
\ No newline at end of file
+    assert json_data['message'] == 'Not found'
+
+def test_list_entity_types(client):
+    '''
+    Tests that entity types can be listed page by page
+    '''
+    created = set(create_entity_type(client, 'test_list_entity_types_{}'.format(i)) for i in range(3))
+
+    listed = []
+    url = '/api/entity-types?limit=2'
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page) <= 2
+        listed.extend(page)
+        url = response.headers.get('Link', '').split(';')[0].strip('<>')
+
+    ids = [entity_type['id'] for entity_type in listed]
+    assert ids == sorted(ids)
+    assert created <= set(ids)
+
+def test_list_entity_types_invalid_limit(client):
+    '''
+    Tests that entity types listing rejects a non numeric limit
+    '''
+    response = client.get('/api/entity-types?limit=many')
+    json_data = response.get_json()
+    assert response.status_code == 400
+    assert json_data['message'] == 'limit must be an integer'
@@ -0,0 +1,45 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Entity Export Tests
+==============
+'''
+import json
+from test_entity_types import create_entity_type
+
+def create_entities(client, entity_type_name, count):
+    entity_type_id = create_entity_type(client, entity_type_name)
+    items = [{'entity_type_id': entity_type_id, 'content': {'n': i}} for i in range(count)]
+    response = client.post('/api/entities:batch',
+        data=json.dumps(items),
+        content_type='application/json')
+    assert response.status_code == 201
+    return entity_type_id
+
+def test_export_entities_by_type(client):
+    entity_type_id = create_entities(client, 'test_export_entities_by_type', 3)
+
+    response = client.get('/api/entities:export?entity_type_id={}'.format(entity_type_id))
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(line['content']['n'] for line in lines) == [0, 1, 2]
+    assert all(line['entity_type_id'] == entity_type_id for line in lines)
+
+def test_export_entities_all(client):
+    entity_type_id = create_entities(client, 'test_export_entities_all', 2)
+
+    response = client.get('/api/entities:export')
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len([line for line in lines if line['entity_type_id'] == entity_type_id]) == 2
+
+def test_export_entities_command(app, client):
+    entity_type_id = create_entities(client, 'test_export_entities_command', 2)
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['export-entities', '--entity-type-id', entity_type_id])
+    assert result.exit_code == 0
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert sorted(line['content']['n'] for line in lines) == [0, 1]
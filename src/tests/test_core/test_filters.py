@@ -0,0 +1,60 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Entity Content Filter Tests
+==============
+'''
+import json
+import pytest
+from test_entity_types import create_entity_type
+
+contacts = [
+    {'name': 'ann', 'age': 31, 'active': True, 'company': {'name': 'acme'}, 'tags': ['vip', 'eu']},
+    {'name': 'bob', 'age': 25, 'active': False, 'company': {'name': 'initech'}, 'tags': ['us']},
+    {'name': 'cid', 'age': '40', 'active': True, 'company': {'name': 'acme'}, 'tags': []},
+    {'name': 'dee', 'age': None, 'active': True},
+]
+
+@pytest.fixture(scope='module')
+def contact_type_id(client):
+    entity_type_id = create_entity_type(client, 'test_filters_contact')
+    items = [{'entity_type_id': entity_type_id, 'content': content} for content in contacts]
+    response = client.post('/api/entities:batch',
+        data=json.dumps(items),
+        content_type='application/json')
+    assert response.status_code == 201
+    return entity_type_id
+
+def filtered_names(client, entity_type_id, query):
+    response = client.get('/api/entities?entity_type_id={}&{}'.format(entity_type_id, query))
+    assert response.status_code == 200, response.get_json()
+    return sorted(entity['content']['name'] for entity in response.get_json())
+
+@pytest.mark.parametrize('query, names', [
+    ('content.name=eq:bob', ['bob']),
+    ('content.name=bob', ['bob']),
+    ('content.name=ne:bob', ['ann', 'cid', 'dee']),
+    ('content.age=gte:30', ['ann']),
+    ('content.age=lt:30', ['bob']),
+    ('content.age=eq:"40"', ['cid']),
+    ('content.age=eq:null', ['dee']),
+    ('content.active=eq:false', ['bob']),
+    ('content.company.name=eq:acme', ['ann', 'cid']),
+    ('content.company.name=eq:acme&content.age=gt:30', ['ann']),
+    ('content=contains:{"company": {"name": "acme"}, "active": true}', ['ann', 'cid']),
+    ('content=contains:{"tags": ["eu"]}', ['ann']),
+])
+def test_list_entities_content_filter(client, contact_type_id, query, names):
+    assert filtered_names(client, contact_type_id, query) == names
+
+@pytest.mark.parametrize('query, message', [
+    ('content=eq:x', "content filter must be 'contains:<json object>'"),
+    ('content=contains:[1]', 'contains filter must be a json object'),
+    ('content.name=eq:{"a": 1}', "filter 'content.name' value must be a scalar"),
+    ('content..name=eq:x', "invalid filter path 'content..name'"),
+])
+def test_list_entities_invalid_filter(client, query, message):
+    response = client.get('/api/entities?{}'.format(query))
+    assert response.status_code == 400
+    assert response.get_json()['message'] == message
@@ -0,0 +1,180 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Idempotency Key Tests
+==============
+'''
+import datetime
+import json
+import time
+from flask import Response
+from app.core import idempotency
+from app.core.db import db
+from app.core.idempotency import Heartbeat, claim, prune_idempotency_keys, store, \
+    store_statement
+from app.core.models.idempotency_key import IdempotencyKey
+from test_entity_types import create_entity_type
+
+def post_entity(client, key, entity_type_id, content):
+    return client.post('/api/entities',
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': content}),
+        content_type='application/json',
+        headers={'Idempotency-Key': key})
+
+def count_entities(client, entity_type_id):
+    return len(client.get('/api/entities?entity_type_id={}'.format(entity_type_id)).get_json())
+
+def set_key(key, **values):
+    table = IdempotencyKey.__table__
+    db.session.begin()
+    db.session.execute(table.update().where(table.c.key == key).values(**values))
+    db.session.commit()
+
+def test_create_entity_replayed(client):
+    entity_type_id = create_entity_type(client, 'test_create_entity_replayed')
+    first = post_entity(client, 'test_create_entity_replayed', entity_type_id, {'n': 1})
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+
+    second = post_entity(client, 'test_create_entity_replayed', entity_type_id, {'n': 1})
+    assert second.status_code == 201
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert second.get_json() == first.get_json()
+    assert count_entities(client, entity_type_id) == 1
+
+def test_replay_does_not_validate_again(client):
+    entity_type_id = create_entity_type(client, 'test_replay_does_not_validate_again')
+    key = 'test_replay_does_not_validate_again'
+    response = client.put('/api/entity-types/{}'.format(entity_type_id),
+        data=json.dumps({'name': key, 'schema': {'type': 'object'}}),
+        content_type='application/json',
+        headers={'Idempotency-Key': key, 'If-Match': '"1"'})
+    assert response.status_code == 200
+
+    response = client.put('/api/entity-types/{}'.format(entity_type_id),
+        data=json.dumps({'name': key, 'schema': {'type': 'object'}}),
+        content_type='application/json',
+        headers={'Idempotency-Key': key, 'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['Idempotent-Replayed'] == 'true'
+
+def test_key_reused_for_another_request(client):
+    entity_type_id = create_entity_type(client, 'test_key_reused_for_another_request')
+    key = 'test_key_reused_for_another_request'
+    assert post_entity(client, key, entity_type_id, {'n': 1}).status_code == 201
+    assert post_entity(client, key, entity_type_id, {'n': 2}).status_code == 422
+    assert count_entities(client, entity_type_id) == 1
+
+def test_client_errors_are_stored(client):
+    key = 'test_client_errors_are_stored'
+    assert post_entity(client, key, 'unknown', {'n': 1}).status_code == 400
+    response = post_entity(client, key, 'unknown', {'n': 1})
+    assert response.status_code == 400
+    assert response.headers['Idempotent-Replayed'] == 'true'
+
+def test_key_in_progress(client):
+    entity_type_id = create_entity_type(client, 'test_key_in_progress')
+    key = 'test_key_in_progress'
+    assert post_entity(client, key, entity_type_id, {'n': 1}).status_code == 201
+    set_key(key, status=None, created=datetime.datetime.utcnow())
+    assert post_entity(client, key, entity_type_id, {'n': 1}).status_code == 409
+
+    # the claim outlived its lease, its worker is gone
+    set_key(key, expires=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+    response = post_entity(client, key, entity_type_id, {'n': 1})
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+
+def get_key(key):
+    return db.session.query(IdempotencyKey).filter(IdempotencyKey.key == key).one()
+
+def test_claim_is_renewed(app, monkeypatch):
+    monkeypatch.setattr(idempotency, 'HEARTBEAT_INTERVAL', 0.01)
+    key = 'test_claim_is_renewed'
+    created = datetime.datetime.utcnow()
+    assert claim(key, 'digest', created) is None
+    set_key(key, expires=created)
+    heartbeat = Heartbeat(app, key, created)
+    heartbeat.start()
+    try:
+        # the test database is one connection, reading it meanwhile would
+        # roll back the renewal in progress
+        time.sleep(0.2)
+    finally:
+        heartbeat.stop()
+        heartbeat.join(5)
+    db.session.expire_all()
+    assert get_key(key).expires > created + datetime.timedelta(seconds=30)
+    # a live claim is not taken over
+    assert claim(key, 'digest', datetime.datetime.utcnow()).status is None
+
+def test_taken_over_claim_is_not_stored(app):
+    key = 'test_taken_over_claim_is_not_stored'
+    first = datetime.datetime.utcnow()
+    assert claim(key, 'digest', first) is None
+    set_key(key, expires=first)
+    second = datetime.datetime.utcnow()
+    assert claim(key, 'digest', second) is None
+
+    assert store(key, second, Response(b'second', status=201))
+    assert not store(key, first, Response(b'first', status=201))
+    db.session.expire_all()
+    assert get_key(key).body == b'second'
+
+def test_key_reused_for_another_content_type(client):
+    entity_type_id = create_entity_type(client, 'test_key_reused_for_another_content_type')
+    entity_id = post_entity(client, 'create', entity_type_id, {'n': 1}).get_json()['id']
+    key = 'test_key_reused_for_another_content_type'
+    body = json.dumps({'n': 2})
+    response = client.patch('/api/entities/{}'.format(entity_id), data=body,
+        content_type='application/merge-patch+json', headers={'Idempotency-Key': key})
+    assert response.status_code == 200
+    response = client.patch('/api/entities/{}'.format(entity_id), data=body,
+        content_type='application/json-patch+json', headers={'Idempotency-Key': key})
+    assert response.status_code == 422
+
+def test_write_commits_with_its_response(client, monkeypatch):
+    entity_type_id = create_entity_type(client, 'test_write_commits_with_its_response')
+    key = 'test_write_commits_with_its_response'
+
+    def crash(key, created, response):
+        raise RuntimeError('crashed before the response was stored')
+    monkeypatch.setattr(idempotency, 'store_statement', crash)
+    try:
+        post_entity(client, key, entity_type_id, {'n': 1})
+    except RuntimeError:
+        pass
+    assert count_entities(client, entity_type_id) == 0
+
+    # a claim taken over while the request ran rolls its write back
+    monkeypatch.setattr(idempotency, 'store_statement',
+                        lambda key, created, response: store_statement(key, None, response))
+    assert post_entity(client, key, entity_type_id, {'n': 1}).status_code == 409
+    assert count_entities(client, entity_type_id) == 0
+
+    monkeypatch.undo()
+    set_key(key, expires=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+    assert post_entity(client, key, entity_type_id, {'n': 1}).status_code == 201
+    assert post_entity(client, key, entity_type_id, {'n': 1}).headers['Idempotent-Replayed']
+    assert count_entities(client, entity_type_id) == 1
+
+def test_expired_key(client):
+    entity_type_id = create_entity_type(client, 'test_expired_key')
+    key = 'test_expired_key'
+    assert post_entity(client, key, entity_type_id, {'n': 1}).status_code == 201
+    set_key(key, expires=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+    response = post_entity(client, key, entity_type_id, {'n': 1})
+    assert 'Idempotent-Replayed' not in response.headers
+    assert count_entities(client, entity_type_id) == 2
+
+    set_key(key, expires=datetime.datetime.utcnow() - datetime.timedelta(seconds=1))
+    assert prune_idempotency_keys() >= 1
+    assert db.session.query(IdempotencyKey).filter(IdempotencyKey.key == key).count() == 0
+
+def test_invalid_key(client):
+    response = post_entity(client, 'k' * 256, 'unknown', {'n': 1})
+    assert response.status_code == 400
+    response = post_entity(client, '', 'unknown', {'n': 1})
+    assert response.status_code == 400
@@ -0,0 +1,107 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Entity Import Tests
+==============
+'''
+import csv
+import json
+import pytest
+from app.core import importer
+from app.core.db import db
+from app.core.importer import import_entities, read_checkpoint, write_checkpoint
+from test_entity_types import create_entity_type
+
+def listed_contents(client, entity_type_id):
+    response = client.get('/api/entities?entity_type_id={}'.format(entity_type_id))
+    return sorted(entity['content']['n'] for entity in response.get_json())
+
+def test_import_entities_ndjson(app, client, tmpdir):
+    entity_type_id = create_entity_type(client, 'test_import_entities_ndjson')
+    path = tmpdir.join('entities.ndjson')
+    lines = [json.dumps({'entity_type_id': entity_type_id, 'content': {'n': i}}) for i in range(5)]
+    lines.append(json.dumps({'entity_type_id': entity_type_id, 'content': {'crap': 'crap'}}))
+    lines.append('{nope')
+    path.write('\n'.join(lines) + '\n')
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['import-entities', str(path), '--workers', '2', '--chunk-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'line 6: Entity content does not match type schema' in result.output
+    assert 'line 7: record is not a valid entity' in result.output
+    assert 'Imported 5 entities, rejected 2.' in result.output
+    assert listed_contents(client, entity_type_id) == [0, 1, 2, 3, 4]
+    assert read_checkpoint(str(path)) == 0
+
+def test_import_entities_csv(app, client, tmpdir):
+    entity_type_id = create_entity_type(client, 'test_import_entities_csv')
+    path = tmpdir.join('entities.csv')
+    with open(str(path), 'w', newline='') as stream:
+        writer = csv.writer(stream)
+        writer.writerow(['entity_type_id', 'content'])
+        for i in range(3):
+            writer.writerow([entity_type_id, json.dumps({'n': i})])
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['import-entities', str(path), '--workers', '0'])
+    assert result.exit_code == 0, result.output
+    assert listed_contents(client, entity_type_id) == [0, 1, 2]
+
+def test_import_entities_resume(app, client, tmpdir):
+    entity_type_id = create_entity_type(client, 'test_import_entities_resume')
+    path = tmpdir.join('entities.ndjson')
+    lines = [json.dumps({'entity_type_id': entity_type_id, 'content': {'n': i}}) for i in range(4)]
+    path.write('\n'.join(lines) + '\n')
+    db.session.begin()
+    write_checkpoint(str(path), 3)
+    db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['import-entities', str(path), '--workers', '0', '--resume'])
+    assert result.exit_code == 0, result.output
+    assert 'Resuming after 3 records.' in result.output
+    assert listed_contents(client, entity_type_id) == [3]
+
+def test_import_entities_checkpoint_commits_with_chunk(app, client, tmpdir, monkeypatch):
+    entity_type_id = create_entity_type(client, 'test_import_entities_checkpoint')
+    path = tmpdir.join('entities.ndjson')
+    lines = [json.dumps({'entity_type_id': entity_type_id, 'content': {'n': i}}) for i in range(5)]
+    path.write('\n'.join(lines) + '\n')
+
+    load_rows = importer.load_rows
+    def crash_on_third_chunk(rows, chunk_size):
+        if rows[0]['content'] == json.dumps({'n': 4}):
+            raise RuntimeError('crash')
+        load_rows(rows, chunk_size)
+    monkeypatch.setattr(importer, 'load_rows', crash_on_third_chunk)
+    with pytest.raises(RuntimeError):
+        import_entities(str(path), chunk_size=2, workers=0, echo=lambda message: None)
+    assert read_checkpoint(str(path)) == 4
+    monkeypatch.undo()
+
+    assert import_entities(str(path), chunk_size=2, workers=0, resume=True,
+                           echo=lambda message: None) == (1, 0)
+    assert listed_contents(client, entity_type_id) == [0, 1, 2, 3, 4]
+
+def test_import_entities_taken_id(app, client, tmpdir):
+    entity_type_id = create_entity_type(client, 'test_import_entities_taken_id')
+    path = tmpdir.join('entities.ndjson')
+    lines = [
+        json.dumps({'id': 'test_import_taken', 'entity_type_id': entity_type_id, 'content': {'n': 0}}),
+        json.dumps({'id': 'test_import_taken', 'entity_type_id': entity_type_id, 'content': {'n': 1}}),
+        json.dumps({'entity_type_id': entity_type_id, 'content': {'n': 2}}),
+    ]
+    path.write('\n'.join(lines) + '\n')
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['import-entities', str(path), '--workers', '0'])
+    assert result.exit_code == 0, result.output
+    assert "line 2: Entity id 'test_import_taken' already exists" in result.output
+    assert 'Imported 2 entities, rejected 1.' in result.output
+
+    result = runner.invoke(args=['import-entities', str(path), '--workers', '0'])
+    assert result.exit_code == 0, result.output
+    assert "line 1: Entity id 'test_import_taken' already exists" in result.output
+    assert 'Imported 1 entities, rejected 2.' in result.output
+    assert listed_contents(client, entity_type_id) == [0, 2, 2]
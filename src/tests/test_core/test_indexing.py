@@ -0,0 +1,95 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Declared Index Tests
+==============
+'''
+import json
+from app.core.db import db
+from app.core.models.entity_index import EntityIndex
+
+contact_schema = {
+    'type': 'object',
+    'properties': {
+        'email': {'type': 'string', 'x-bcrm-index': True},
+        'phone': {'type': 'string'},
+        'external': {
+            'type': 'object',
+            'properties': {'id': {'type': 'integer', 'x-bcrm-index': True}}
+        },
+    }
+}
+
+def create_contact_type(client, name, schema=contact_schema):
+    response = client.post('/api/entity-types',
+        data=json.dumps({'name': name, 'schema': schema}),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def create_contact(client, entity_type_id, content):
+    response = client.post('/api/entities',
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': content}),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def indexed(entity_id):
+    rows = db.session.query(EntityIndex.field, EntityIndex.value).filter(
+        EntityIndex.entity_id == entity_id
+    )
+    return dict(rows)
+
+def test_index_maintained_on_write(client):
+    entity_type_id = create_contact_type(client, 'test_index_maintained_on_write')
+    entity_id = create_contact(client, entity_type_id, {
+        'email': 'ann@example.com', 'phone': '555', 'external': {'id': 7}
+    })
+    assert indexed(entity_id) == {'email': '"ann@example.com"', 'external.id': '7'}
+
+    response = client.put('/api/entities/{}'.format(entity_id),
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': {'email': 'ann@example.org'}}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert indexed(entity_id) == {'email': '"ann@example.org"'}
+
+    client.delete('/api/entities/{}'.format(entity_id))
+    assert indexed(entity_id) == {}
+
+def test_indexed_lookup(client):
+    entity_type_id = create_contact_type(client, 'test_indexed_lookup')
+    ann = create_contact(client, entity_type_id, {'email': 'ann@example.com', 'external': {'id': 1}})
+    create_contact(client, entity_type_id, {'email': 'bob@example.com', 'external': {'id': 2}})
+
+    for query in ('content.email=eq:ann@example.com', 'content.external.id=eq:1'):
+        response = client.get('/api/entities?entity_type_id={}&{}'.format(entity_type_id, query))
+        assert [entity['id'] for entity in response.get_json()] == [ann]
+
+    response = client.get('/api/entities?entity_type_id={}&content.external.id=eq:"1"'.format(entity_type_id))
+    assert response.get_json() == []
+
+def test_index_rebuilt_on_type_update(client):
+    name = 'test_index_rebuilt_on_type_update'
+    entity_type_id = create_contact_type(client, name)
+    entity_id = create_contact(client, entity_type_id, {'email': 'ann@example.com', 'phone': '555'})
+
+    schema = json.loads(json.dumps(contact_schema))
+    del schema['properties']['email']['x-bcrm-index']
+    schema['properties']['phone']['x-bcrm-index'] = True
+    response = client.put('/api/entity-types/{}'.format(entity_type_id),
+        data=json.dumps({'name': name, 'schema': schema}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert indexed(entity_id) == {'phone': '"555"'}
+
+    response = client.get('/api/entities?entity_type_id={}&content.phone=eq:"555"'.format(entity_type_id))
+    assert [entity['id'] for entity in response.get_json()] == [entity_id]
+
+def test_batch_create_indexed(client):
+    entity_type_id = create_contact_type(client, 'test_batch_create_indexed')
+    response = client.post('/api/entities:batch',
+        data=json.dumps([{'entity_type_id': entity_type_id, 'content': {'email': 'x@example.com'}}]),
+        content_type='application/json')
+    entity_id = response.get_json()['results'][0]['id']
+    assert indexed(entity_id) == {'email': '"x@example.com"'}
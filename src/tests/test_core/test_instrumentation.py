@@ -0,0 +1,81 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Request Instrumentation Tests
+==============
+'''
+import json
+import pytest
+from app import create_app
+from app.core.db import db
+from app.instrumentation import Metrics, server_timing
+from test_entities import entity_stub
+from test_entity_types import create_entity_type
+
+@pytest.fixture
+def instrumented(monkeypatch, tmpdir):
+    monkeypatch.setenv('BCRM_INSTRUMENTATION', '1')
+    monkeypatch.setenv('BCRM_PROFILE_SAMPLE_RATE', '1')
+    monkeypatch.setenv('BCRM_PROFILE_SLOW_MS', '0')
+    monkeypatch.setenv('BCRM_PROFILE_DIR', str(tmpdir))
+    app = create_app()
+    app.config.update(TESTING=True, SQLALCHEMY_DATABASE_URI='sqlite:///:memory:')
+    with app.app_context():
+        db.session.remove()
+        db.create_all()
+        yield app
+        db.session.remove()
+
+def test_instrumentation_is_opt_in(client):
+    response = client.get('/api/entity-types')
+    assert 'Server-Timing' not in response.headers
+    assert client.get('/metrics').status_code == 404
+
+def test_server_timing_phases(instrumented):
+    client = instrumented.test_client()
+    response = client.post('/api/entities',
+        data=json.dumps({
+            'entity_type_id': create_entity_type(client, 'instrumented'),
+            'content': entity_stub['content']
+        }),
+        content_type='application/json')
+    assert response.status_code == 201
+
+    timing = response.headers['Server-Timing']
+    names = [entry.split(';')[0] for entry in timing.split(', ')]
+    for name in ('json', 'schema', 'lookup', 'validate', 'flush', 'commit', 'sql',
+                 'serialize', 'total'):
+        assert name in names
+    assert 'statements"' in timing
+
+def test_metrics_endpoint(instrumented):
+    client = instrumented.test_client()
+    client.get('/api/entity-types')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'bcrm_requests_total{endpoint="/api/entity-types",method="GET",status="200"} 1' \
+        in body
+    assert 'bcrm_sql_statements_total{endpoint="/api/entity-types"}' in body
+
+def test_slow_requests_are_profiled(instrumented, tmpdir):
+    instrumented.test_client().get('/api/entity-types')
+    assert [path.basename for path in tmpdir.listdir()] != []
+    assert all(path.ext == '.prof' for path in tmpdir.listdir())
+
+def test_metrics_histogram():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.observe('GET', '/api/entities', 200, 0.5, {'sql': 0.2}, 3)
+    body = metrics.render()
+    assert 'bcrm_request_duration_seconds_bucket{endpoint="/api/entities",le="0.1",method="GET"} 0' \
+        in body
+    assert 'bcrm_request_duration_seconds_bucket{endpoint="/api/entities",le="1.0",method="GET"} 1' \
+        in body
+    assert 'bcrm_request_phase_seconds_sum{endpoint="/api/entities",phase="sql"} 0.2' in body
+    assert 'bcrm_sql_statements_total{endpoint="/api/entities"} 3' in body
+
+def test_server_timing_header():
+    assert server_timing({'sql': 0.002}, 2, 0.005) == \
+        'sql;dur=2.00;desc="2 statements", total;dur=5.00'
@@ -0,0 +1,78 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Batched Read Tests
+==============
+'''
+import json
+import pytest
+from test_entity_types import create_entity_type
+
+@pytest.fixture
+def small_chunks(app):
+    chunk_size = app.config['BCRM_BATCH_CHUNK_SIZE']
+    app.config['BCRM_BATCH_CHUNK_SIZE'] = 2
+    yield
+    app.config['BCRM_BATCH_CHUNK_SIZE'] = chunk_size
+
+def create_people(client, name, contents):
+    entity_type_id = create_entity_type(client, name)
+    response = client.post('/api/entities:batch',
+        data=json.dumps([
+            {'entity_type_id': entity_type_id, 'content': content} for content in contents
+        ]),
+        content_type='application/json')
+    assert response.status_code == 201
+    return entity_type_id, [result['id'] for result in response.get_json()['results']]
+
+def batch_get(client, path, ids, query_string=None):
+    return client.post(path, data=json.dumps({'ids': ids}), content_type='application/json',
+                       query_string=query_string)
+
+def test_batch_get_entities(client, small_chunks):
+    entity_type_id, ids = create_people(client, 'test_batch_get_entities', [
+        {'name': 'Ada'}, {'name': 'Bob'}, {'name': 'Eve'},
+    ])
+    requested = [ids[2], 'unknown', ids[0], ids[1], ids[2]]
+    response = batch_get(client, '/api/entities:batchGet', requested)
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['index'] for result in results] == [0, 1, 2, 3, 4]
+    assert [result['status'] for result in results] == [200, 404, 200, 200, 200]
+    assert results[1] == {'index': 1, 'status': 404, 'id': 'unknown', 'message': 'Not found'}
+    assert [result['entity']['content']['name'] for result in results if 'entity' in result] == [
+        'Eve', 'Ada', 'Bob', 'Eve'
+    ]
+    assert results[0]['entity'] == {
+        'id': ids[2], 'entity_type_id': entity_type_id, 'content': {'name': 'Eve'}
+    }
+
+def test_batch_get_entities_fields(client):
+    _, ids = create_people(client, 'test_batch_get_entities_fields', [
+        {'name': 'Ada', 'email': 'ada@example.com'},
+    ])
+    response = batch_get(client, '/api/entities:batchGet', ids, {'fields': 'content.email'})
+    assert response.status_code == 200
+    assert response.get_json()['results'][0]['entity']['content'] == {'email': 'ada@example.com'}
+
+def test_batch_get_entity_types(client):
+    entity_type_id = create_entity_type(client, 'test_batch_get_entity_types')
+    response = batch_get(client, '/api/entity-types:batchGet', ['unknown', entity_type_id])
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results[0]['status'] == 404
+    assert results[1]['status'] == 200
+    assert results[1]['entity_type']['id'] == entity_type_id
+    assert results[1]['entity_type']['name'] == 'test_batch_get_entity_types'
+
+def test_batch_get_invalid_requests(client, app):
+    for path in ('/api/entities:batchGet', '/api/entity-types:batchGet'):
+        assert client.post(path, data='x', content_type='text/plain').status_code == 400
+        response = client.post(path, data=json.dumps({'ids': 'x'}),
+                               content_type='application/json')
+        assert response.status_code == 400
+        ids = ['x'] * (app.config['BCRM_BATCH_GET_MAX_IDS'] + 1)
+        assert batch_get(client, path, ids).status_code == 413
+    response = batch_get(client, '/api/entities:batchGet', ['x'], {'fields': 'name'})
+    assert response.status_code == 400
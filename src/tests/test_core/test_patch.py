@@ -0,0 +1,184 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Entity Patch Tests
+==============
+'''
+import json
+import pytest
+from jsonschema import ValidationError
+from sqlalchemy.dialects import postgresql
+from app.core.models.entity_type import EntityType
+from app.core.patch import PatchConflict, PatchError, MERGE_PATCH, JSON_PATCH, \
+    changed_keys, json_patch, merge_patch, merge_patch_select, merge_patch_statement
+from app.core.validation import validate_changes
+
+deal_schema = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+        'status': {'enum': ['open', 'won', 'lost']},
+        'owner': {'type': 'object', 'properties': {'name': {'type': 'string'}}},
+        'notes': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'required': ['name', 'status'],
+    'additionalProperties': False,
+}
+
+deal = {
+    'name': 'acme',
+    'status': 'open',
+    'owner': {'name': 'ann', 'phone': '555'},
+    'notes': ['call back'],
+}
+
+def create_deal(client, name):
+    response = client.post('/api/entity-types',
+        data=json.dumps({'name': name, 'schema': deal_schema}),
+        content_type='application/json')
+    assert response.status_code == 201
+    response = client.post('/api/entities',
+        data=json.dumps({'entity_type_id': response.get_json()['id'], 'content': deal}),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def patch(client, entity_id, document, mimetype, headers=None):
+    return client.patch('/api/entities/{}'.format(entity_id),
+        data=json.dumps(document),
+        content_type=mimetype,
+        headers=headers)
+
+@pytest.mark.parametrize('target, document, result', [
+    ({'a': 'b'}, {'a': 'c'}, {'a': 'c'}),
+    ({'a': 'b'}, {'b': 'c'}, {'a': 'b', 'b': 'c'}),
+    ({'a': 'b', 'b': 'c'}, {'a': None}, {'b': 'c'}),
+    ({'a': ['b']}, {'a': 'c'}, {'a': 'c'}),
+    ({'a': {'b': 'c'}}, {'a': {'b': 'd', 'c': None}}, {'a': {'b': 'd'}}),
+    ({'a': 'b'}, {'a': {'b': None}}, {'a': {}}),
+    ({'e': None}, {'a': 1}, {'e': None, 'a': 1}),
+])
+def test_merge_patch(target, document, result):
+    assert merge_patch(target, document) == result
+
+def test_json_patch():
+    operations = [
+        {'op': 'test', 'path': '/status', 'value': 'open'},
+        {'op': 'replace', 'path': '/status', 'value': 'won'},
+        {'op': 'add', 'path': '/notes/-', 'value': 'signed'},
+        {'op': 'add', 'path': '/notes/0', 'value': 'first'},
+        {'op': 'copy', 'from': '/owner/name', 'path': '/name'},
+        {'op': 'move', 'from': '/owner/phone', 'path': '/owner/mobile'},
+        {'op': 'remove', 'path': '/notes/1'},
+    ]
+    assert json_patch(deal, operations) == {
+        'name': 'ann',
+        'status': 'won',
+        'owner': {'name': 'ann', 'mobile': '555'},
+        'notes': ['first', 'signed'],
+    }
+    assert deal['status'] == 'open'
+
+@pytest.mark.parametrize('operations, error', [
+    ({'op': 'add'}, PatchError),
+    ([{'op': 'merge', 'path': '/a'}], PatchError),
+    ([{'op': 'add', 'path': 'name', 'value': 1}], PatchError),
+    ([{'op': 'move', 'from': '/owner', 'path': '/owner/name'}], PatchError),
+    ([{'op': 'remove', 'path': '/missing'}], PatchConflict),
+    ([{'op': 'replace', 'path': '/notes/1', 'value': 'x'}], PatchConflict),
+    ([{'op': 'add', 'path': '/notes/01', 'value': 'x'}], PatchConflict),
+    ([{'op': 'test', 'path': '/name', 'value': 1}], PatchConflict),
+])
+def test_json_patch_errors(operations, error):
+    with pytest.raises(error):
+        json_patch(deal, operations)
+
+def test_json_patch_test_distinguishes_booleans():
+    with pytest.raises(PatchConflict):
+        json_patch({'a': 1}, [{'op': 'test', 'path': '/a', 'value': True}])
+
+def test_changed_keys():
+    assert changed_keys(MERGE_PATCH, {'a': 1, 'b': None}) == {'a', 'b'}
+    assert changed_keys(JSON_PATCH, [
+        {'op': 'test', 'path': '/c', 'value': 1},
+        {'op': 'move', 'from': '/a/x', 'path': '/b/y'},
+    ]) == {'a', 'b'}
+    assert changed_keys(JSON_PATCH, [{'op': 'replace', 'path': '', 'value': {}}]) is None
+
+def test_validate_changes_checks_only_changed_properties():
+    entity_type = EntityType(name='test_validate_changes', schema=deal_schema)
+    content = dict(deal, name=1)
+    validate_changes(entity_type, content, {'status'})
+    with pytest.raises(ValidationError):
+        validate_changes(entity_type, content, {'name'})
+    with pytest.raises(ValidationError):
+        validate_changes(entity_type, dict(deal, extra=1), {'extra'})
+    with pytest.raises(ValidationError):
+        validate_changes(entity_type, {'name': 'acme'}, {'status'})
+
+def test_validate_changes_falls_back_to_full_validation():
+    entity_type = EntityType(name='test_validate_changes_full', schema={
+        'type': 'object',
+        'properties': {'name': {'type': 'string'}},
+        'minProperties': 2,
+    })
+    with pytest.raises(ValidationError):
+        validate_changes(entity_type, {'name': 'acme'}, {'name'})
+
+def test_merge_patch_statement_postgresql():
+    patch = {'status': 'won', 'owner': {'phone': None}}
+    sql = str(merge_patch_select('id', patch).compile(dialect=postgresql.dialect()))
+    assert 'jsonb_build_object' in sql
+    assert 'AS patched' in sql
+    assert sql.endswith('FOR UPDATE')
+    sql = str(merge_patch_statement('id', 3, patch).compile(dialect=postgresql.dialect()))
+    assert 'entity.version = %(version_2)s' in sql
+    assert 'RETURNING entity.version' in sql
+
+def test_merge_patch_entity(client):
+    entity_id = create_deal(client, 'test_merge_patch_entity')
+    response = patch(client, entity_id, {'status': 'won', 'owner': {'phone': None}}, MERGE_PATCH,
+        headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"2"'
+    assert response.get_json()['content'] == {
+        'name': 'acme',
+        'status': 'won',
+        'owner': {'name': 'ann'},
+        'notes': ['call back'],
+    }
+    response = client.get('/api/entities/{}'.format(entity_id))
+    assert response.get_json()['content']['status'] == 'won'
+
+def test_json_patch_entity(client):
+    entity_id = create_deal(client, 'test_json_patch_entity')
+    response = patch(client, entity_id, [
+        {'op': 'add', 'path': '/notes/-', 'value': 'signed'},
+    ], JSON_PATCH)
+    assert response.status_code == 200
+    assert response.get_json()['content']['notes'] == ['call back', 'signed']
+
+@pytest.mark.parametrize('document, mimetype, status', [
+    ({'status': 'won'}, 'application/json', 415),
+    ([{'status': 'won'}], MERGE_PATCH, 400),
+    ({'status': 'pending'}, MERGE_PATCH, 400),
+    ({'name': None}, MERGE_PATCH, 400),
+    ([{'op': 'remove', 'path': '/owner/email'}], JSON_PATCH, 409),
+    ([{'op': 'replace', 'path': '', 'value': []}], JSON_PATCH, 400),
+])
+def test_patch_entity_errors(client, document, mimetype, status):
+    entity_id = create_deal(client, 'test_patch_entity_errors_{}_{}'.format(
+        status, json.dumps(document)[:20]))
+    response = patch(client, entity_id, document, mimetype)
+    assert response.status_code == status
+    assert client.get('/api/entities/{}'.format(entity_id)).get_json()['content'] == deal
+
+def test_patch_entity_precondition_failed(client):
+    entity_id = create_deal(client, 'test_patch_entity_precondition_failed')
+    response = patch(client, entity_id, {'status': 'won'}, MERGE_PATCH,
+        headers={'If-Match': '"7"'})
+    assert response.status_code == 412
+
+def test_patch_entity_not_found(client):
+    assert patch(client, 'missing', {'status': 'won'}, MERGE_PATCH).status_code == 404
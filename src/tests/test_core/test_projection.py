@@ -0,0 +1,83 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Sparse Fieldset Tests
+==============
+'''
+import json
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+from werkzeug.datastructures import MultiDict
+from app.core.models.entity import Entity
+from app.core.projection import ProjectionError, content_path, parse_fields, project
+from test_entity_types import create_entity_type
+
+contact = {
+    'name': 'ann',
+    'email': 'ann@example.com',
+    'address': {'city': 'Oslo', 'zip': None},
+    'notes': ['a long history'] * 10,
+}
+
+@pytest.fixture(scope='module')
+def contact_type_id(client):
+    return create_entity_type(client, 'test_projection_contact')
+
+@pytest.fixture(scope='module')
+def contact_id(client, contact_type_id):
+    response = client.post('/api/entities',
+        data=json.dumps({'entity_type_id': contact_type_id, 'content': contact}),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+@pytest.mark.parametrize('fields, paths', [
+    (None, None),
+    ('content', None),
+    ('id,content.name', [['name']]),
+    ('content.address.city, content.address', [['address']]),
+    ('id,entity_type_id', []),
+])
+def test_parse_fields(fields, paths):
+    args = MultiDict() if fields is None else MultiDict({'fields': fields})
+    assert parse_fields(args) == paths
+
+@pytest.mark.parametrize('fields', ['name', 'content.', 'content..name'])
+def test_parse_invalid_fields(fields):
+    with pytest.raises(ProjectionError):
+        parse_fields(MultiDict({'fields': fields}))
+
+def test_project():
+    assert project(contact, [['name'], ['address', 'zip'], ['phone'], ['name', 'first']]) == {
+        'name': 'ann',
+        'address': {'zip': None},
+    }
+
+def test_postgresql_pushdown():
+    query = Query([Entity.id, content_path(['address', 'city']).label('field_0')])
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+    assert 'CAST(entity.content #> %(param_1)s::TEXT[] AS TEXT) AS field_0' in sql
+
+def test_get_entity_fields(client, contact_id):
+    response = client.get('/api/entities/{}?fields=content.name,content.address.zip'
+        .format(contact_id))
+    assert response.status_code == 200
+    assert response.get_json()['content'] == {'name': 'ann', 'address': {'zip': None}}
+    assert response.headers['ETag'] == '"1"'
+
+def test_list_entities_fields(client, contact_type_id, contact_id):
+    response = client.get('/api/entities?entity_type_id={}&fields=content.email'.format(
+        contact_type_id))
+    assert response.status_code == 200
+    assert response.get_json() == [{
+        'id': contact_id,
+        'entity_type_id': contact_type_id,
+        'content': {'email': 'ann@example.com'},
+    }]
+
+def test_invalid_fields(client, contact_id):
+    response = client.get('/api/entities/{}?fields=email'.format(contact_id))
+    assert response.status_code == 400
+    assert response.get_json()['message'] == "invalid field 'email'"
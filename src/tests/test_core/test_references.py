@@ -0,0 +1,150 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Entity Reference Tests
+==============
+'''
+import json
+from app.core.references import ref_fields
+
+company_schema = {'type': 'object', 'properties': {'name': {'type': 'string'}}}
+
+contact_schema = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+        'company': {'type': 'string', 'x-bcrm-ref': True},
+        'deals': {'type': 'array', 'items': {'type': 'string'}, 'x-bcrm-ref': True},
+        'links': {'type': 'object', 'properties': {
+            'partner': {'type': 'string', 'x-bcrm-ref': True},
+        }},
+    },
+}
+
+def create_type(client, name, schema):
+    response = client.post('/api/entity-types',
+        data=json.dumps({'name': name, 'schema': schema}),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def create(client, entity_type_id, content):
+    response = client.post('/api/entities',
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': content}),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def crm(client, name):
+    company_type = create_type(client, name + '_company', company_schema)
+    contact_type = create_type(client, name + '_contact', contact_schema)
+    acme = create(client, company_type, {'name': 'Acme'})
+    deals = [create(client, company_type, {'name': 'deal {}'.format(n)}) for n in range(2)]
+    return company_type, contact_type, acme, deals
+
+def names(included):
+    if isinstance(included, list):
+        return [entity['content']['name'] for entity in included]
+    return included and included['content']['name']
+
+def referrers(client, entity_id, **args):
+    response = client.get('/api/entities/{}/referrers'.format(entity_id), query_string=args)
+    assert response.status_code == 200
+    return [entity['id'] for entity in response.get_json()]
+
+def test_ref_fields():
+    assert ref_fields(json.dumps(contact_schema)) == (
+        ('company', False), ('deals', True), ('links.partner', False)
+    )
+
+def test_include_references(client):
+    company_type, contact_type, acme, deals = crm(client, 'test_include_references')
+    ada = create(client, contact_type, {
+        'name': 'Ada', 'company': acme, 'deals': [deals[1], 'unknown', deals[0]],
+        'links': {'partner': 'unknown'},
+    })
+
+    response = client.get('/api/entities/{}?include=company,deals,links.partner,name'.format(ada))
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['content']['name'] == 'Ada'
+    assert set(data['included']) == {'company', 'deals', 'links.partner'}
+    assert data['included']['company']['id'] == acme
+    assert names(data['included']['company']) == 'Acme'
+    assert names(data['included']['deals']) == ['deal 1', 'deal 0']
+    assert data['included']['links.partner'] is None
+
+    response = client.get('/api/entities?entity_type_id={}&include=company&fields=content.name'
+        .format(contact_type))
+    assert response.status_code == 200
+    assert response.get_json() == [{
+        'id': ada, 'entity_type_id': contact_type, 'content': {'name': 'Ada'},
+        'included': {'company': {
+            'id': acme, 'entity_type_id': company_type, 'content': {'name': 'Acme'}}},
+    }]
+
+    response = client.post('/api/entities:batchGet?include=deals',
+        data=json.dumps({'ids': [ada, 'unknown', acme]}),
+        content_type='application/json')
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert names(results[0]['entity']['included']['deals']) == ['deal 1', 'deal 0']
+    assert results[1]['status'] == 404
+    assert results[2]['entity']['included'] == {}
+
+def test_references_follow_writes(client):
+    _, contact_type, acme, deals = crm(client, 'test_references_follow_writes')
+    ada = create(client, contact_type, {'name': 'Ada', 'company': acme, 'deals': deals})
+    bob = create(client, contact_type, {'name': 'Bob', 'deals': [deals[0]]})
+    assert referrers(client, acme) == [ada]
+    assert referrers(client, deals[0]) == sorted([ada, bob])
+    assert referrers(client, deals[0], field='company') == []
+
+    response = client.patch('/api/entities/{}'.format(ada),
+        data=json.dumps({'company': None, 'deals': [deals[1]]}),
+        content_type='application/merge-patch+json')
+    assert response.status_code == 200
+    assert referrers(client, acme) == []
+    assert referrers(client, deals[0]) == [bob]
+    assert referrers(client, deals[1], field='deals', entity_type_id=contact_type) == [ada]
+
+    assert client.delete('/api/entities/{}'.format(ada)).status_code == 200
+    assert referrers(client, deals[1]) == []
+
+    response = client.get('/api/entities/{}/referrers?include=deals&limit=1'.format(deals[0]))
+    assert names(response.get_json()[0]['included']['deals']) == ['deal 0']
+
+def test_long_reference_is_not_kept(client):
+    _, contact_type, acme, _ = crm(client, 'test_long_reference_is_not_kept')
+    ada = create(client, contact_type, {'name': 'Ada', 'deals': ['x' * 61, acme]})
+    response = client.get('/api/entities/{}?include=deals'.format(ada))
+    assert names(response.get_json()['included']['deals']) == ['Acme']
+    assert referrers(client, acme) == [ada]
+
+def test_references_follow_schema_changes(client):
+    name = 'test_references_follow_schema_changes'
+    _, contact_type, acme, _ = crm(client, name)
+    schema = {'type': 'object', 'properties': {'employer': {'type': 'string'}}}
+    response = client.put('/api/entity-types/{}'.format(contact_type),
+        data=json.dumps({'name': name + '_contact', 'schema': schema}),
+        content_type='application/json')
+    assert response.status_code == 200
+    ada = create(client, contact_type, {'employer': acme})
+    assert referrers(client, acme) == []
+
+    schema['properties']['employer']['x-bcrm-ref'] = True
+    response = client.put('/api/entity-types/{}'.format(contact_type),
+        data=json.dumps({'name': name + '_contact', 'schema': schema}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert referrers(client, acme) == [ada]
+
+    response = client.delete('/api/entity-types/{}?cascade=true'.format(contact_type))
+    assert response.status_code == 200
+    assert referrers(client, acme) == []
+
+def test_invalid_include(client):
+    for include in ('', 'company,,deals', 'a.', ','.join(str(n) for n in range(11))):
+        response = client.get('/api/entities', query_string={'include': include})
+        assert response.status_code == 400
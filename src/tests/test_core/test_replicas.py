@@ -0,0 +1,104 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Read Replica Tests
+==============
+'''
+import json
+import time
+import pytest
+from app.core.db import db
+from app.core.models.entity import Entity
+from app.core.models.entity_type import EntityType
+from app.core.replicas import LAST_WRITE_HEADER, ReplicaSet
+from test_entity_types import create_entity_type
+
+def use_replica(app, uri):
+    binds = app.config.get('SQLALCHEMY_BINDS')
+    replicas = app.extensions['bcrm_replicas']
+    app.config['SQLALCHEMY_BINDS'] = {'replica_0': uri}
+    app.extensions['bcrm_replicas'] = ReplicaSet(['replica_0'], max_lag=5, interval=60)
+    def restore():
+        db.get_engine(app, bind='replica_0').dispose()
+        app.config['SQLALCHEMY_BINDS'] = binds
+        app.extensions['bcrm_replicas'] = replicas
+    return restore
+
+@pytest.fixture
+def replica(app, tmpdir):
+    restore = use_replica(app, 'sqlite:///{}'.format(tmpdir.join('replica.db')))
+    engine = db.get_engine(app, bind='replica_0')
+    db.Model.metadata.create_all(engine)
+    yield engine
+    restore()
+
+@pytest.fixture
+def unreachable_replica(app, tmpdir):
+    restore = use_replica(app, 'sqlite:///{}'.format(tmpdir.join('missing', 'replica.db')))
+    yield
+    restore()
+
+def create_contact(client, name, content):
+    response = client.post('/api/entities',
+        data=json.dumps({'entity_type_id': create_entity_type(client, name), 'content': content}),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response
+
+def get_name(client, entity_id, last_write):
+    response = client.get('/api/entities/{}?fields=content.name'.format(entity_id),
+                          headers={LAST_WRITE_HEADER: last_write})
+    return response.status_code, (response.get_json().get('content') or {}).get('name')
+
+def test_reads_go_to_replica(client, replica):
+    response = create_contact(client, 'test_reads_go_to_replica', {'name': 'Ada'})
+    last_write = response.headers[LAST_WRITE_HEADER]
+    assert 'bcrm_last_write=' + last_write in response.headers['Set-Cookie']
+    entity_id = response.get_json()['id']
+    assert get_name(client, entity_id, '0') == (404, None)
+
+    entity_type = db.session.query(EntityType).get(response.get_json()['entity_type_id'])
+    with replica.begin() as connection:
+        connection.execute(EntityType.__table__.insert().values(
+            id=entity_type.id, name=entity_type.name, schema=entity_type.schema, version=1))
+        connection.execute(Entity.__table__.insert().values(
+            id=entity_id, entityTypeId=entity_type.id, content='{"name": "Stale"}', version=1))
+    assert get_name(client, entity_id, '0') == (200, 'Stale')
+    # the replica read did not fill the cache
+    assert get_name(client, entity_id, last_write) == (200, 'Ada')
+
+    response = client.get('/api/entities?entity_type_id={}&content.name=Stale'.format(
+        entity_type.id), headers={LAST_WRITE_HEADER: '0'})
+    assert [entity['id'] for entity in response.get_json()] == [entity_id]
+    assert LAST_WRITE_HEADER not in response.headers
+
+def test_unreachable_replica(client, unreachable_replica):
+    response = create_contact(client, 'test_unreachable_replica', {'name': 'Ada'})
+    assert get_name(client, response.get_json()['id'], '0') == (200, 'Ada')
+
+def test_replica_round_robin():
+    replicas = ReplicaSet(['replica_0', 'replica_1', 'replica_2'])
+    for replica in replicas.replicas:
+        replica.healthy = True
+        replica.checked = time.monotonic()
+    assert sorted(replicas.pick() for _ in range(3)) == ['replica_0', 'replica_1', 'replica_2']
+
+    replicas.fail('replica_1')
+    assert set(replicas.pick() for _ in range(4)) == {'replica_0', 'replica_2'}
+    replicas.fail('replica_0')
+    replicas.fail('replica_2')
+    assert replicas.pick() is None
+
+def test_replica_check_timeout(app):
+    pytest.importorskip('psycopg2')
+    # a non routable address, the connection attempt hangs until its timeout
+    restore = use_replica(app, 'postgresql://bcrm@10.255.255.1/bcrm')
+    replicas = app.extensions['bcrm_replicas']
+    replicas.timeout = 1
+    try:
+        started = time.monotonic()
+        assert replicas.pick() is None
+        assert time.monotonic() - started < 5
+    finally:
+        restore()
@@ -0,0 +1,136 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Full-text Search Tests
+==============
+'''
+import json
+from werkzeug.urls import url_decode
+from app.core.search import searched_fields, search_text
+
+contact_schema = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string'},
+        'email': {'type': 'string'},
+        'notes': {'type': 'string', 'x-bcrm-search': False},
+        'tags': {'type': 'array', 'x-bcrm-search': True},
+        'address': {'type': 'object', 'properties': {'city': {'type': 'string'}}},
+        'age': {'type': 'integer'},
+    },
+}
+
+def create_contacts(client, name, contents, schema=contact_schema):
+    response = client.post('/api/entity-types',
+        data=json.dumps({'name': name, 'schema': schema}),
+        content_type='application/json')
+    assert response.status_code == 201
+    entity_type_id = response.get_json()['id']
+    response = client.post('/api/entities:batch',
+        data=json.dumps([
+            {'entity_type_id': entity_type_id, 'content': content} for content in contents
+        ]),
+        content_type='application/json')
+    assert response.status_code == 201
+    return entity_type_id, [result['id'] for result in response.get_json()['results']]
+
+def found(client, entity_type_id, q, **args):
+    args.update(q=q, entity_type_id=entity_type_id)
+    response = client.get('/api/search', query_string=args)
+    assert response.status_code == 200
+    return [entity['id'] for entity in response.get_json()]
+
+def test_searched_fields():
+    assert searched_fields(json.dumps(contact_schema)) == ('address.city', 'email', 'name', 'tags')
+    assert search_text(searched_fields(json.dumps(contact_schema)), {
+        'name': 'Ada Lovelace', 'notes': 'secret', 'tags': ['vip', 1],
+        'address': {'city': 'London'}, 'age': 36,
+    }) == 'London Ada Lovelace vip'
+
+def test_search_prefixes(client):
+    entity_type_id, ids = create_contacts(client, 'test_search_prefixes', [
+        {'name': 'Ada Lovelace', 'email': 'ada@example.com', 'notes': 'analytical'},
+        {'name': 'Charles Babbage', 'address': {'city': 'London'}},
+        {'name': 'Grace Hopper', 'tags': ['navy']},
+    ])
+    assert found(client, entity_type_id, 'ada') == [ids[0]]
+    assert found(client, entity_type_id, 'lov ad') == [ids[0]]
+    assert found(client, entity_type_id, 'EXAMPLE') == [ids[0]]
+    assert found(client, entity_type_id, 'lond') == [ids[1]]
+    assert found(client, entity_type_id, 'navy') == [ids[2]]
+    assert found(client, entity_type_id, 'analytical') == []
+    assert found(client, entity_type_id, 'ada hopper') == []
+
+def test_search_ranked_and_paginated(client):
+    entity_type_id, ids = create_contacts(client, 'test_search_ranked_and_paginated', [
+        {'name': 'Smith', 'email': 'smith@example.com', 'tags': ['smith']},
+        {'name': 'John Doe'},
+        {'name': 'Anna Smith'},
+        {'name': 'Smith Smith Smith'},
+    ])
+    ranked = found(client, entity_type_id, 'smith')
+    assert sorted(ranked) == sorted([ids[0], ids[2], ids[3]])
+    assert ranked[-1] == ids[2]
+
+    response = client.get('/api/search', query_string={
+        'q': 'smith', 'entity_type_id': entity_type_id, 'limit': 2})
+    assert [entity['id'] for entity in response.get_json()] == ranked[:2]
+    assert response.get_json()[0]['content']
+    after = url_decode(response.headers['Link'].split('?', 1)[1].split('>', 1)[0])['after']
+    assert found(client, entity_type_id, 'smith', limit=2, after=after) == ranked[2:]
+
+def test_search_pages_seek_past_ties(client):
+    entity_type_id, ids = create_contacts(client, 'test_search_pages_seek_past_ties', [
+        {'name': 'Grace Hopper'} for _ in range(5)
+    ])
+    assert found(client, entity_type_id, 'hopper') == sorted(ids)
+
+    read = []
+    args = {'q': 'hopper', 'entity_type_id': entity_type_id, 'limit': 2}
+    while True:
+        response = client.get('/api/search', query_string=args)
+        read.extend(entity['id'] for entity in response.get_json())
+        if 'Link' not in response.headers:
+            break
+        args = url_decode(response.headers['Link'].split('?', 1)[1].split('>', 1)[0])
+    assert read == sorted(ids)
+
+def test_search_follows_writes(client):
+    entity_type_id, ids = create_contacts(client, 'test_search_follows_writes', [
+        {'name': 'Margaret Hamilton'},
+    ])
+    response = client.put('/api/entities/{}'.format(ids[0]),
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': {'name': 'Katherine'}}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert found(client, entity_type_id, 'hamilton') == []
+    assert found(client, entity_type_id, 'kath') == ids
+
+    response = client.patch('/api/entities/{}'.format(ids[0]),
+        data=json.dumps({'name': 'Katherine Johnson'}),
+        content_type='application/merge-patch+json')
+    assert response.status_code == 200
+    assert found(client, entity_type_id, 'johnson') == ids
+
+    assert client.delete('/api/entities/{}'.format(ids[0])).status_code == 200
+    assert found(client, entity_type_id, 'kath') == []
+
+def test_search_follows_schema_changes(client):
+    entity_type_id, ids = create_contacts(client, 'test_search_follows_schema_changes', [
+        {'name': 'Edsger', 'notes': 'structured'},
+    ])
+    assert found(client, entity_type_id, 'structured') == []
+    schema = dict(contact_schema, properties=dict(
+        contact_schema['properties'], notes={'type': 'string'}))
+    response = client.put('/api/entity-types/{}'.format(entity_type_id),
+        data=json.dumps({'name': 'test_search_follows_schema_changes', 'schema': schema}),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert found(client, entity_type_id, 'structured') == ids
+    assert found(client, entity_type_id, 'edsger') == ids
+
+def test_search_invalid_arguments(client):
+    for args in ({}, {'q': '  !? '}, {'q': 'a', 'after': 'x'},
+                 {'q': 'a', 'after': '2'}, {'q': 'a', 'limit': 0}):
+        assert client.get('/api/search', query_string=args).status_code == 400
@@ -0,0 +1,79 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+JSON Response Tests
+==============
+'''
+import json
+import pytest
+from decimal import Decimal
+from collections import OrderedDict
+from app.core.serialization import RawJSON, json_response, render, set_backend, \
+    orjson_supported
+from test_entity_types import create_entity_type
+
+def test_render_splices_raw_json():
+    text = render({'id': 'a', 'content': RawJSON('{"name": "Ann"}'), 'tags': [1, None]})
+    assert text == '{"id":"a","content":{"name": "Ann"},"tags":[1,null]}'
+    assert json.loads(text)['content'] == {'name': 'Ann'}
+
+def test_render_escapes_strings():
+    text = render({'name': 'Zoë "Z"\n'})
+    assert json.loads(text) == {'name': 'Zoë "Z"\n'}
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_backends_splice_raw_json(backend, app):
+    if backend == 'orjson' and not orjson_supported():
+        pytest.skip('orjson 3.9 is not installed')
+    set_backend(backend)
+    try:
+        text = render([OrderedDict([('id', 'a'), ('content', RawJSON('{"name": "Ann"}'))]),
+                       {'score': 1.5, 'ok': True, 'name': 'Zoë'}])
+        assert '{"name": "Ann"}' in text
+        assert json.loads(text) == [{'id': 'a', 'content': {'name': 'Ann'}},
+                                    {'score': 1.5, 'ok': True, 'name': 'Zoë'}]
+    finally:
+        set_backend(app.config['BCRM_JSON_BACKEND'])
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_backends_write_the_same_json(backend, app):
+    if backend == 'orjson' and not orjson_supported():
+        pytest.skip('orjson 3.9 is not installed')
+    set_backend(backend)
+    try:
+        value = OrderedDict([(1, 'a'), (True, 'b'), (None, 'c'), (1.5, 'd'), ('e', Decimal('1.10'))])
+        assert render(value) == json.dumps(
+            OrderedDict([(1, 'a'), (True, 'b'), (None, 'c'), (1.5, 'd'), ('e', 0)]),
+            separators=(',', ':')
+        ).replace('0}', '1.10}')
+        assert render([Decimal('-3'), Decimal('2.5E+3')]) == '[-3,2.5E+3]'
+        with pytest.raises(TypeError):
+            render(Decimal('NaN'))
+    finally:
+        set_backend(app.config['BCRM_JSON_BACKEND'])
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        set_backend('yaml')
+
+def test_json_response(app):
+    with app.test_request_context():
+        response = json_response([RawJSON('{}')], 201)
+    assert response.status_code == 201
+    assert response.mimetype == 'application/json'
+    assert response.get_json() == [{}]
+
+def test_entity_response_keeps_content(client):
+    content = {'name': 'Zoë', 'nested': {'values': [1, 2.5, None, True]}}
+    response = client.post('/api/entities',
+        data=json.dumps({
+            'entity_type_id': create_entity_type(client, 'serialization'),
+            'content': content
+        }),
+        content_type='application/json')
+    assert response.status_code == 201
+    assert response.get_json()['content'] == content
+
+    response = client.get('/api/entities/{}'.format(response.get_json()['id']))
+    assert response.get_json()['content'] == content
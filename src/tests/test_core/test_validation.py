@@ -0,0 +1,58 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Validator Registry Tests
+==============
+'''
+import json
+import pytest
+from jsonschema import ValidationError
+from app.core.models.entity_type import EntityType
+from app.core.validation import ValidatorRegistry
+
+schema_stub = {
+    'type': 'object',
+    'required': ['name']
+}
+
+def test_validator_is_compiled_once():
+    registry = ValidatorRegistry()
+    entity_type = EntityType(name='test_validator_is_compiled_once', schema=schema_stub)
+
+    validator = registry.get(entity_type)
+    assert registry.get(entity_type) is validator
+    assert len(registry) == 1
+
+def test_validator_recompiled_on_schema_change():
+    registry = ValidatorRegistry()
+    entity_type = EntityType(name='test_validator_recompiled', schema=schema_stub)
+    registry.get(entity_type).validate({'name': 'name'})
+
+    entity_type.schema = json.dumps({'type': 'object', 'required': ['email']})
+    with pytest.raises(ValidationError):
+        registry.get(entity_type).validate({'name': 'name'})
+    assert len(registry) == 1
+
+def test_validator_invalidate():
+    registry = ValidatorRegistry()
+    entity_type = EntityType(name='test_validator_invalidate', schema=schema_stub)
+    registry.get(entity_type)
+
+    registry.invalidate(entity_type.id)
+    assert entity_type.id not in registry
+
+def test_validator_lru_eviction():
+    registry = ValidatorRegistry(maxsize=2)
+    first, second, third = [
+        EntityType(name='test_validator_lru_{}'.format(i), schema=schema_stub)
+        for i in range(3)
+    ]
+    registry.get(first)
+    registry.get(second)
+    registry.get(first)
+    registry.get(third)
+
+    assert first.id in registry
+    assert second.id not in registry
+    assert third.id in registry
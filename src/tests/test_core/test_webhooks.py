@@ -0,0 +1,261 @@
+# coding: utf-8
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+'''
+Webhook Tests
+==============
+'''
+import datetime
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import pytest
+from app.core.db import db
+from app.core.models.webhook_delivery import WebhookDelivery
+from app.core import webhooks
+from app.core.webhooks import backoff, claim_batches, deliver, dispatch, record
+from test_entity_types import create_entity_type
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path.endswith('/slow'):
+            time.sleep(0.5)
+        self.server.received.append((self.headers, json.loads(body.decode('utf-8')), body))
+        self.send_response(self.server.status)
+        if self.path.endswith('/drip'):
+            # every chunk arrives within the socket timeout, the whole body does not
+            self.send_header('Content-Length', '20')
+            self.end_headers()
+            try:
+                for _ in range(20):
+                    self.wfile.write(b' ')
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except ConnectionError:
+                pass
+            return
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    server.received = []
+    server.status = 204
+    server.url = 'http://127.0.0.1:{}/hook'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def subscribe(client, entity_type_id, url, **kwargs):
+    kwargs['url'] = url
+    response = client.post('/api/entity-types/{}/webhooks'.format(entity_type_id),
+        data=json.dumps(kwargs),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def create(client, entity_type_id, content):
+    response = client.post('/api/entities',
+        data=json.dumps({'entity_type_id': entity_type_id, 'content': content}),
+        content_type='application/json')
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+def pending(webhook_id):
+    return db.session.query(WebhookDelivery).filter(WebhookDelivery.webhook_id == webhook_id).all()
+
+def test_webhook_subscriptions(client):
+    entity_type_id = create_entity_type(client, 'test_webhook_subscriptions')
+    webhook_id = subscribe(client, entity_type_id, 'https://example.com/hook', events=['delete'])
+
+    response = client.get('/api/entity-types/{}/webhooks'.format(entity_type_id))
+    assert response.get_json() == [{
+        'id': webhook_id,
+        'entity_type_id': entity_type_id,
+        'url': 'https://example.com/hook',
+        'events': ['delete'],
+    }]
+
+    for payload in ({'url': 'ftp://example.com'}, {'url': 'http://a', 'events': ['read']}):
+        response = client.post('/api/entity-types/{}/webhooks'.format(entity_type_id),
+            data=json.dumps(payload),
+            content_type='application/json')
+        assert response.status_code == 400
+    response = client.post('/api/entity-types/unknown/webhooks',
+        data=json.dumps({'url': 'http://a'}),
+        content_type='application/json')
+    assert response.status_code == 404
+
+    create(client, entity_type_id, {'name': 'not subscribed'})
+    assert pending(webhook_id) == []
+
+    response = client.delete('/api/entity-types/{}/webhooks/{}'.format(entity_type_id, webhook_id))
+    assert response.status_code == 200
+    assert client.get('/api/entity-types/{}/webhooks'.format(entity_type_id)).get_json() == []
+
+def test_webhook_delivery(client, stub):
+    entity_type_id = create_entity_type(client, 'test_webhook_delivery')
+    webhook_id = subscribe(client, entity_type_id, stub.url, secret='s3cret')
+    first = create(client, entity_type_id, {'name': 'first'})
+    second = create(client, entity_type_id, {'name': 'second'})
+    assert client.delete('/api/entities/{}'.format(first)).status_code == 200
+    assert len(pending(webhook_id)) == 3
+
+    assert dispatch(batch_size=2, once=True) == (3, 0)
+    assert pending(webhook_id) == []
+    events = [event for _, payload, _ in stub.received for event in payload['events']]
+    assert [(event['event'], event['entity']['id']) for event in events] == [
+        ('create', first), ('create', second), ('delete', first)
+    ]
+    assert events[0]['entity']['content'] == {'name': 'first'}
+    assert events[2]['entity']['content'] is None
+    assert [len(payload['events']) for _, payload, _ in stub.received] == [2, 1]
+
+    headers, _, body = stub.received[0]
+    assert headers['X-BCRM-Signature'] == \
+        'sha256=' + hmac.new(b's3cret', body, hashlib.sha256).hexdigest()
+
+def test_claim_batches_per_webhook(client):
+    webhook_ids = []
+    for name, count in (('busy', 3), ('quiet', 1)):
+        entity_type_id = create_entity_type(client, 'test_claim_batches_per_webhook_' + name)
+        webhook_ids.append(subscribe(client, entity_type_id, 'http://127.0.0.1:1/' + name))
+        for n in range(count):
+            create(client, entity_type_id, {'n': n})
+
+    # the backlog of the first webhook does not fill the round
+    batches = claim_batches(1, 2, 3600)
+    assert [(batch.webhook_id, len(batch.deliveries)) for batch in batches] == [
+        (webhook_ids[0], 1), (webhook_ids[1], 1)
+    ]
+    batches = claim_batches(2, 2, 3600)
+    assert [(batch.webhook_id, len(batch.deliveries)) for batch in batches] == [
+        (webhook_ids[0], 2)
+    ]
+    assert claim_batches(2, 2, 3600) == []
+
+def test_webhook_retries_and_dead_letters(client, stub):
+    stub.status = 503
+    entity_type_id = create_entity_type(client, 'test_webhook_retries_and_dead_letters')
+    webhook_id = subscribe(client, entity_type_id, stub.url)
+    entity_id = create(client, entity_type_id, {'name': 'retried'})
+
+    assert dispatch(max_attempts=2, once=True) == (0, 1)
+    delivery, = pending(webhook_id)
+    assert delivery.status == 'pending'
+    assert delivery.attempts == 1
+    assert delivery.last_error == 'HTTP 503'
+    assert delivery.next_attempt > datetime.datetime.utcnow()
+
+    db.session.begin()
+    delivery.next_attempt = datetime.datetime.utcnow()
+    db.session.commit()
+    assert dispatch(max_attempts=2, once=True) == (0, 1)
+    url = '/api/entity-types/{}/webhooks/{}/deliveries'.format(entity_type_id, webhook_id)
+    dead = client.get(url).get_json()
+    assert [(item['entity_id'], item['status'], item['attempts']) for item in dead] == [
+        (entity_id, 'dead', 2)
+    ]
+    assert dispatch(once=True) == (0, 0)
+
+    stub.status = 200
+    assert client.post(url + ':retry').get_json() == {'retried': 1}
+    assert client.get(url).get_json() == []
+    assert dispatch(once=True) == (1, 0)
+    assert len(stub.received) == 3
+    assert client.get(url + '?status=pending').get_json() == []
+    assert client.get(url + '?status=sent').status_code == 400
+
+def test_webhook_unreachable(client):
+    entity_type_id = create_entity_type(client, 'test_webhook_unreachable')
+    webhook_id = subscribe(client, entity_type_id, 'http://127.0.0.1:1/hook')
+    create(client, entity_type_id, {'name': 'unreachable'})
+    assert dispatch(max_attempts=1, timeout=1, once=True) == (0, 1)
+    delivery, = pending(webhook_id)
+    assert delivery.status == 'dead'
+    assert delivery.last_error
+
+def test_backoff():
+    for attempts in range(1, 20):
+        assert backoff(attempts) <= min(3600, 2 ** attempts)
+        assert backoff(attempts) >= min(3600, 2 ** attempts) / 4
+
+def test_delete_entity_type_with_webhooks(client):
+    entity_type_id = create_entity_type(client, 'test_delete_entity_type_with_webhooks')
+    webhook_id = subscribe(client, entity_type_id, 'http://127.0.0.1:1/hook')
+    create(client, entity_type_id, {'name': 'queued'})
+    response = client.delete('/api/entity-types/{}?cascade=true'.format(entity_type_id))
+    assert response.status_code == 200
+    assert pending(webhook_id) == []
+
+def test_claim_skips_deleted_webhook(client, monkeypatch):
+    webhook_ids = []
+    for name in ('kept', 'deleted'):
+        entity_type_id = create_entity_type(client, 'test_claim_skips_deleted_webhook_' + name)
+        webhook_ids.append(subscribe(client, entity_type_id, 'http://127.0.0.1:1/' + name))
+        create(client, entity_type_id, {'name': name})
+
+    # the second webhook is deleted between the claim of its events and its lookup
+    claimed_webhooks = webhooks.claimed_webhooks
+    monkeypatch.setattr(webhooks, 'claimed_webhooks', lambda webhook_ids_: dict(
+        (webhook_id, webhook) for webhook_id, webhook in claimed_webhooks(webhook_ids_).items()
+        if webhook_id != webhook_ids[1]
+    ))
+    batches = claim_batches(10, 10, 3600)
+    assert [batch.webhook_id for batch in batches] == [webhook_ids[0]]
+
+def test_record_keeps_taken_over_lease(client):
+    entity_type_id = create_entity_type(client, 'test_record_keeps_taken_over_lease')
+    webhook_id = subscribe(client, entity_type_id, 'http://127.0.0.1:1/hook')
+    create(client, entity_type_id, {'name': 'leased'})
+    batch, = claim_batches(10, 10, 0)
+
+    # the lease ran out and another dispatcher claimed the events
+    assert [other.webhook_id for other in claim_batches(10, 10, 3600)] == [webhook_id]
+    record(batch, None, 8)
+    record(batch, 'HTTP 500', 8)
+    delivery, = pending(webhook_id)
+    assert delivery.attempts == 0
+    assert delivery.next_attempt > datetime.datetime.utcnow()
+
+def test_slow_webhook_does_not_hold_up_others(client, stub, monkeypatch):
+    webhook_ids = []
+    for name in ('slow', 'fast'):
+        entity_type_id = create_entity_type(client, 'test_slow_webhook_' + name)
+        webhook_ids.append(subscribe(client, entity_type_id, stub.url[:-len('hook')] + name))
+        create(client, entity_type_id, {'name': name})
+
+    recorded = []
+    record_batch = webhooks.record
+    def recording(batch, error, max_attempts):
+        recorded.append(batch.webhook_id)
+        record_batch(batch, error, max_attempts)
+    monkeypatch.setattr(webhooks, 'record', recording)
+    assert dispatch(once=True, poll_interval=0.05) == (2, 0)
+    assert recorded == [webhook_ids[1], webhook_ids[0]]
+
+def test_delivery_is_bounded_by_timeout(client, stub):
+    entity_type_id = create_entity_type(client, 'test_delivery_is_bounded_by_timeout')
+    stub.status = 200
+    subscribe(client, entity_type_id, stub.url[:-len('hook')] + 'drip')
+    create(client, entity_type_id, {'name': 'drip'})
+    batch, = claim_batches(10, 10, 3600)
+    started = time.monotonic()
+    assert deliver(batch, 0.5) == 'timed out'
+    assert time.monotonic() - started < 1.5